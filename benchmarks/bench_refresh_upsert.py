@@ -0,0 +1,128 @@
+"""
+Compare the legacy per-country refresh write path with the bulk upsert.
+
+Runs both against a local SQLite file with a synthetic upstream payload and
+reports statement round trips and wall time, for a cold (empty table) and a
+warm (every country already stored) refresh.
+
+    python benchmarks/bench_refresh_upsert.py --rows 10000
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from sqlalchemy import event, func, select  # noqa: E402
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine  # noqa: E402
+
+from database import Base  # noqa: E402
+from models import Country  # noqa: E402
+from service import CountryService  # noqa: E402
+from transform import transform_countries  # noqa: E402
+
+CURRENCIES = ["USD", "EUR", "NGN", "GHS", "KES", "JPY", "GBP", "XXX"]
+
+
+def synthetic_payload(rows: int, seed: int = 42):
+    rnd = random.Random(seed)
+    countries = []
+    for i in range(rows):
+        currencies = [] if i % 50 == 0 else [{"code": rnd.choice(CURRENCIES)}]
+        countries.append({
+            "name": f"Country {i}",
+            "capital": f"Capital {i}",
+            "region": rnd.choice(["Africa", "Americas", "Asia", "Europe", "Oceania"]),
+            "population": rnd.randint(1_000, 300_000_000),
+            "flag": f"https://flagcdn.com/{i}.svg",
+            "currencies": currencies,
+        })
+    rates = {code: rnd.uniform(0.5, 2000) for code in CURRENCIES if code != "XXX"}
+    return countries, rates
+
+
+async def legacy_upsert(session: AsyncSession, prepared):
+    """The original write loop: one SELECT per country, ORM objects added one by one."""
+    async with session.begin():
+        for rec in prepared:
+            name = rec["name"]
+            if not name:
+                continue
+            result = await session.execute(select(Country).where(func.lower(Country.name) == name.lower()))
+            existing = result.scalars().first()
+            if existing:
+                existing.capital = rec["capital"]
+                existing.region = rec["region"]
+                existing.population = rec["population"] if rec["population"] is not None else existing.population
+                existing.currency_code = rec["currency_code"]
+                existing.exchange_rate = rec["exchange_rate"]
+                existing.estimated_gdp = rec["estimated_gdp"] if rec["estimated_gdp"] is not None else existing.estimated_gdp
+                existing.flag_url = rec["flag_url"]
+                existing.last_refreshed_at = rec["last_refreshed_at"]
+                session.add(existing)
+            else:
+                session.add(Country(
+                    name=name,
+                    capital=rec["capital"],
+                    region=rec["region"],
+                    population=rec["population"] or 0,
+                    currency_code=rec["currency_code"],
+                    exchange_rate=rec["exchange_rate"],
+                    estimated_gdp=rec["estimated_gdp"] if rec["estimated_gdp"] is not None else (0 if rec["currency_code"] is None else None),
+                    flag_url=rec["flag_url"],
+                    last_refreshed_at=rec["last_refreshed_at"],
+                ))
+
+
+async def bulk_upsert(session: AsyncSession, prepared):
+    async with session.begin():
+        await CountryService._upsert_countries(session, prepared)
+
+
+async def run(label, writer, db_path: Path, prepared):
+    if db_path.exists():
+        db_path.unlink()
+    engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}")
+    round_trips = {"count": 0}
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def _count(*_args):
+        round_trips["count"] += 1
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    results = []
+    for phase in ("cold", "warm"):
+        round_trips["count"] = 0
+        async with AsyncSession(engine, expire_on_commit=False) as session:
+            started = time.perf_counter()
+            await writer(session, prepared)
+            elapsed = time.perf_counter() - started
+        results.append((phase, round_trips["count"], elapsed))
+    await engine.dispose()
+    for phase, trips, elapsed in results:
+        print(f"{label:<8} {phase:<5} round_trips={trips:<7} wall={elapsed * 1000:9.1f} ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--db", type=Path, default=Path("bench_refresh.db"))
+    args = parser.parse_args()
+
+    countries, rates = synthetic_payload(args.rows)
+    prepared = list(transform_countries(countries, rates, datetime.now(timezone.utc)))
+    print(f"{args.rows} synthetic countries, SQLite file {args.db}")
+    await run("legacy", legacy_upsert, args.db, prepared)
+    await run("bulk", bulk_upsert, args.db, prepared)
+    args.db.unlink(missing_ok=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
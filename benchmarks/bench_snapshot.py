@@ -0,0 +1,87 @@
+"""
+Measure warm starts from a binary snapshot against a refresh write.
+
+Fills a SQLite file with synthetic countries, exports them, and reports the
+snapshot size (next to the same rows as JSON), encode time, memory-mapped
+decode time and the time to import into an empty database (bulk insert,
+cache rebuild and summary image), compared with writing the same rows via
+the refresh upsert.
+
+    python benchmarks/bench_snapshot.py --rows 100000
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine  # noqa: E402
+
+from bench_refresh_upsert import synthetic_payload  # noqa: E402
+from database import Base  # noqa: E402
+from service import CountryService  # noqa: E402
+from snapshot import encode_snapshot, export_snapshot, import_snapshot, read_snapshot_file  # noqa: E402
+from transform import transform_countries  # noqa: E402
+
+
+async def fresh_engine(db_path: Path):
+    db_path.unlink(missing_ok=True)
+    engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    return engine
+
+
+def timed(label: str, started: float, extra: str = "") -> None:
+    print(f"{label:<24} {(time.perf_counter() - started) * 1000:9.1f} ms {extra}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--db", type=Path, default=Path("bench_snapshot.db"))
+    parser.add_argument("--out", type=Path, default=Path("bench_snapshot.snap"))
+    args = parser.parse_args()
+
+    countries, rates = synthetic_payload(args.rows)
+    prepared = list(transform_countries(countries, rates, datetime.now(timezone.utc)))
+    print(f"{args.rows} synthetic countries, SQLite file {args.db}")
+
+    engine = await fresh_engine(args.db)
+    async with AsyncSession(engine, expire_on_commit=False) as session:
+        started = time.perf_counter()
+        async with session.begin():
+            await CountryService._upsert_countries(session, prepared)
+        timed("refresh upsert", started)
+
+        started = time.perf_counter()
+        data = await export_snapshot(session)
+        args.out.write_bytes(data)
+        timed("export", started, f"{len(data) / 1e6:.2f} MB")
+    await engine.dispose()
+
+    as_json = json.dumps(prepared, default=str).encode("utf-8")
+    started = time.perf_counter()
+    encode_snapshot([dict(row, id=i) for i, row in enumerate(prepared, 1)], rates)
+    timed("encode only", started, f"(same rows as JSON: {len(as_json) / 1e6:.2f} MB)")
+
+    started = time.perf_counter()
+    snapshot = read_snapshot_file(args.out)
+    timed("mmap decode", started)
+
+    engine = await fresh_engine(args.db)
+    async with AsyncSession(engine, expire_on_commit=False) as session:
+        started = time.perf_counter()
+        await import_snapshot(session, snapshot)
+        timed("import", started, "(insert + cache rebuild + image)")
+    await engine.dispose()
+    args.db.unlink(missing_ok=True)
+    args.out.unlink(missing_ok=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,130 @@
+"""
+Compare the legacy per-country refresh transform with the chunked one in
+transform.py, on synthetic payloads of increasing size.
+
+Both run with the same seed, so besides wall time the script checks that
+they produce identical records (including the random GDP multipliers).
+Peak memory compares building the full prepared list with consuming the
+generator chunk by chunk, as refresh_countries does.
+
+    python benchmarks/bench_transform.py --rows 250 10000 1000000
+"""
+import argparse
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from transform import transform_countries  # noqa: E402
+
+CURRENCIES = ["USD", "EUR", "NGN", "GHS", "KES", "JPY", "GBP", "XXX", "BAD", "ZER"]
+
+
+def synthetic_payload(rows: int, seed: int = 42):
+    rnd = random.Random(seed)
+    countries = []
+    for i in range(rows):
+        if i % 50 == 0:
+            currencies = []
+        elif i % 97 == 0:
+            currencies = [{"name": "no code"}]
+        else:
+            currencies = [{"code": rnd.choice(CURRENCIES)}]
+        countries.append({
+            "name": f"Country {i}",
+            "capital": f"Capital {i}",
+            "region": rnd.choice(["Africa", "Americas", "Asia", "Europe", "Oceania"]),
+            "population": 0 if i % 211 == 0 else rnd.randint(1_000, 300_000_000),
+            "flag": f"https://flagcdn.com/{i}.svg",
+            "currencies": currencies,
+        })
+    rates = {code: rnd.uniform(0.5, 2000) for code in CURRENCIES[:7]}
+    rates["BAD"] = "n/a"
+    rates["ZER"] = 0
+    return countries, rates
+
+
+def legacy_transform(countries_data, rates, refresh_time, rng):
+    """The original per-row loop from CountryService._prepare_records."""
+    prepared = []
+    for c in countries_data:
+        population = c.get("population")
+        currencies = c.get("currencies") or []
+        currency_code = None
+        exchange_rate = None
+        estimated_gdp = None
+        if isinstance(currencies, list) and len(currencies) > 0:
+            first = currencies[0]
+            currency_code = first.get("code") if isinstance(first, dict) else None
+            if currency_code:
+                rate_val = rates.get(currency_code)
+                if rate_val is not None:
+                    try:
+                        exchange_rate = float(rate_val)
+                    except Exception:
+                        exchange_rate = None
+                    if exchange_rate and population:
+                        estimated_gdp = (population * rng.uniform(1000, 2000)) / exchange_rate
+            else:
+                currency_code = None
+        else:
+            estimated_gdp = 0
+        prepared.append({
+            "name": c.get("name"),
+            "capital": c.get("capital"),
+            "region": c.get("region"),
+            "population": population,
+            "currency_code": currency_code,
+            "exchange_rate": exchange_rate,
+            "estimated_gdp": estimated_gdp,
+            "flag_url": c.get("flag"),
+            "last_refreshed_at": refresh_time,
+        })
+    return prepared
+
+
+def timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - started
+
+
+def peak_mib(fn) -> float:
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[250, 10_000, 1_000_000])
+    parser.add_argument("--seed", default="bench")
+    args = parser.parse_args()
+
+    refresh_time = datetime.now(timezone.utc)
+    for rows in args.rows:
+        countries, rates = synthetic_payload(rows)
+        legacy, legacy_s = timed(lambda: legacy_transform(countries, rates, refresh_time, random.Random(args.seed)))
+        chunked, chunked_s = timed(lambda: list(transform_countries(countries, rates, refresh_time, rng=random.Random(args.seed))))
+        # source_hash is new in the chunked transform; everything else must match
+        if legacy != [{k: v for k, v in row.items() if k != "source_hash"} for row in chunked]:
+            raise SystemExit(f"{rows} rows: chunked output differs from the legacy transform")
+        del legacy, chunked
+        list_peak = peak_mib(lambda: legacy_transform(countries, rates, refresh_time, random.Random(args.seed)))
+        # streaming: consume without materializing the prepared list
+        stream_peak = peak_mib(lambda: sum(1 for _ in transform_countries(countries, rates, refresh_time, rng=random.Random(args.seed))))
+        print(
+            f"{rows:>9} rows  legacy={legacy_s * 1000:9.1f} ms  chunked={chunked_s * 1000:9.1f} ms"
+            f"  peak list={list_peak:8.1f} MiB  peak streaming={stream_peak:6.1f} MiB  outputs identical"
+        )
+
+
+if __name__ == "__main__":
+    main()
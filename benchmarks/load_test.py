@@ -0,0 +1,466 @@
+"""
+Mixed-workload load test for the API, with JSON reports that can be compared.
+
+Either point it at a running server, or let it start the upstream stub and a
+uvicorn instance on a throwaway SQLite database (--spawn):
+
+    python benchmarks/load_test.py run --spawn --duration 30 --concurrency 32
+    python benchmarks/load_test.py run --base-url http://127.0.0.1:8000 --mix list=5,detail=3,status=1
+    python benchmarks/load_test.py compare benchmarks/results/before.json benchmarks/results/after.json
+
+Operations (weights via --mix): list, filter (region/currency/sort), page
+(limit/fields), detail, status, image, image_variant and refresh. Bursts of
+concurrent refreshes can also be fired on a timer (--refresh-every/--refresh-burst).
+
+Each run records throughput and p50/p95/p99 latency overall and per
+operation, plus DB statement counts and refresh phase times scraped from
+/metrics before and after the run. Requests turned away by the server's rate
+limiting or admission control (429/503 with Retry-After) are counted as
+``rejected`` and kept out of the latency figures. --spawn starts the server
+with rate limiting off (override with RATE_LIMIT_ENABLED=true).
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+BENCH_DIR = Path(__file__).resolve().parent
+REPO_DIR = BENCH_DIR.parent
+sys.path.insert(0, str(BENCH_DIR))
+
+from upstream_stub import serve as serve_stub  # noqa: E402
+
+DEFAULT_MIX = "list=20,filter=20,page=10,detail=25,status=10,image=10,image_variant=5"
+SORTS = ["gdp_desc", "gdp_asc", "population_desc", "population_asc", "name_asc", "name_desc"]
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for part in mix.split(","):
+        if not part.strip():
+            continue
+        name, _, weight = part.partition("=")
+        if name.strip() not in OPERATIONS:
+            raise SystemExit(f"unknown operation {name!r}; expected one of: {', '.join(OPERATIONS)}")
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+
+class Dataset:
+    """Names, regions and currencies sampled from the server so requests hit real rows."""
+
+    def __init__(self, names: List[str], regions: List[str], currencies: List[str]):
+        self.names = names or ["Nigeria"]
+        self.regions = regions or ["Africa"]
+        self.currencies = currencies or ["USD"]
+
+    @classmethod
+    async def load(cls, client: httpx.AsyncClient) -> "Dataset":
+        response = await client.get("/countries", params={"fields": "name,region,currency_code", "limit": 1000})
+        rows = response.json() if response.status_code == 200 else []
+        return cls(
+            [row["name"] for row in rows],
+            sorted({row["region"] for row in rows if row.get("region")}),
+            sorted({row["currency_code"] for row in rows if row.get("currency_code")}),
+        )
+
+
+def _op_list(rnd, data):
+    return "GET", "/countries", None
+
+
+def _op_filter(rnd, data):
+    params = {"sort": rnd.choice(SORTS)}
+    if rnd.random() < 0.7:
+        params["region"] = rnd.choice(data.regions)
+    else:
+        params["currency"] = rnd.choice(data.currencies)
+    return "GET", "/countries", params
+
+
+def _op_page(rnd, data):
+    return "GET", "/countries", {"limit": 50, "sort": rnd.choice(SORTS), "fields": "name,population,estimated_gdp"}
+
+
+def _op_detail(rnd, data):
+    name = rnd.choice(data.names)
+    return "GET", f"/countries/{name.upper() if rnd.random() < 0.2 else name}", None
+
+
+def _op_status(rnd, data):
+    return "GET", "/status", None
+
+
+def _op_image(rnd, data):
+    return "GET", "/countries/image", None
+
+
+def _op_image_variant(rnd, data):
+    return "GET", "/countries/image", {"width": rnd.choice([400, 800, 1200]), "top": rnd.choice([5, 10]), "region": rnd.choice(data.regions)}
+
+
+def _op_refresh(rnd, data):
+    return "POST", "/countries/refresh", None
+
+
+OPERATIONS = {
+    "list": _op_list,
+    "filter": _op_filter,
+    "page": _op_page,
+    "detail": _op_detail,
+    "status": _op_status,
+    "image": _op_image,
+    "image_variant": _op_image_variant,
+    "refresh": _op_refresh,
+}
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.statuses: Dict[str, Dict[str, int]] = {}
+        self.errors: Dict[str, int] = {}
+        self.rejected: Dict[str, int] = {}
+
+    def add(self, op: str, elapsed: float, status: Optional[int], rejected: bool = False) -> None:
+        codes = self.statuses.setdefault(op, {})
+        key = str(status) if status is not None else "error"
+        codes[key] = codes.get(key, 0) + 1
+        if rejected:
+            # shed before doing any work; its latency says nothing about the endpoint
+            self.latencies.setdefault(op, [])
+            self.rejected[op] = self.rejected.get(op, 0) + 1
+            return
+        self.latencies.setdefault(op, []).append(elapsed)
+        if status is None or status >= 500:
+            self.errors[op] = self.errors.get(op, 0) + 1
+
+
+async def _request(client: httpx.AsyncClient, recorder: Recorder, op: str, method: str, url: str, params) -> None:
+    started = time.perf_counter()
+    try:
+        response = await client.request(method, url, params=params)
+        await response.aread()
+        status = response.status_code
+        rejected = status in (429, 503) and "retry-after" in response.headers
+    except httpx.HTTPError:
+        status = None
+        rejected = False
+    recorder.add(op, time.perf_counter() - started, status, rejected)
+
+
+async def _worker(client, recorder, weights, data, deadline, seed):
+    rnd = random.Random(seed)
+    names, cumulative = list(weights), []
+    total = 0.0
+    for name in names:
+        total += weights[name]
+        cumulative.append(total)
+    while time.perf_counter() < deadline:
+        op = rnd.choices(names, cum_weights=cumulative)[0]
+        method, url, params = OPERATIONS[op](rnd, data)
+        await _request(client, recorder, op, method, url, params)
+
+
+async def _refresh_bursts(client, recorder, every: float, burst: int, deadline):
+    while True:
+        await asyncio.sleep(every)
+        if time.perf_counter() >= deadline:
+            return
+        await asyncio.gather(*(_request(client, recorder, "refresh_burst", "POST", "/countries/refresh", None) for _ in range(burst)))
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies: List[float], duration: float, errors: int = 0, rejected: int = 0) -> Dict[str, float]:
+    values = sorted(latencies)
+    return {
+        "requests": len(values),
+        "errors": errors,
+        "rejected": rejected,
+        "throughput_rps": round(len(values) / duration, 2) if duration else 0.0,
+        "mean_ms": round(sum(values) / len(values) * 1000, 3) if values else 0.0,
+        "p50_ms": round(percentile(values, 50) * 1000, 3),
+        "p95_ms": round(percentile(values, 95) * 1000, 3),
+        "p99_ms": round(percentile(values, 99) * 1000, 3),
+        "max_ms": round(values[-1] * 1000, 3) if values else 0.0,
+    }
+
+
+def parse_metrics(text: str) -> Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float]:
+    """Minimal parser for the Prometheus text format served by /metrics."""
+    samples = {}
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        series, _, value = line.rpartition(" ")
+        name, _, labels = series.partition("{")
+        pairs = []
+        for part in labels.rstrip("}").split('",'):
+            if "=" in part:
+                key, _, val = part.partition("=")
+                pairs.append((key, val.strip('"')))
+        try:
+            samples[(name, tuple(pairs))] = float(value)
+        except ValueError:
+            continue
+    return samples
+
+
+async def scrape(client: httpx.AsyncClient):
+    try:
+        response = await client.get("/metrics")
+    except httpx.HTTPError:
+        return None
+    return parse_metrics(response.text) if response.status_code == 200 else None
+
+
+def metrics_delta(before, after) -> Dict:
+    if before is None or after is None:
+        return {}
+
+    def delta(name: str, label: str) -> Dict[str, float]:
+        out = {}
+        for (metric, labels), value in after.items():
+            if metric != name:
+                continue
+            key = dict(labels).get(label, "")
+            out[key] = round(out.get(key, 0) + value - before.get((metric, labels), 0), 6)
+        return out
+
+    queries = delta("http_request_db_queries_sum", "route")
+    requests = delta("http_request_db_queries_count", "route")
+    phase_sum = delta("refresh_phase_duration_seconds_sum", "phase")
+    phase_count = delta("refresh_phase_duration_seconds_count", "phase")
+    return {
+        "db_queries_total": delta("db_queries_total", "engine"),
+        "db_queries_per_request": {route: round(queries[route] / count, 3) for route, count in requests.items() if count},
+        "refresh_phase_mean_s": {phase: round(phase_sum[phase] / count, 4) for phase, count in phase_count.items() if count},
+        "refresh_runs": delta("refresh_runs_total", "outcome"),
+        "cache_hits": delta("cache_hits_total", "cache"),
+        "cache_misses": delta("cache_misses_total", "cache"),
+    }
+
+
+class SpawnedStack:
+    """Upstream stub (in-process thread) plus a uvicorn subprocess on a temporary SQLite database."""
+
+    def __init__(self, args):
+        self.args = args
+        self.workdir = tempfile.TemporaryDirectory(prefix="country-bench-")
+        self.stub = None
+        self.process = None
+
+    def start(self) -> str:
+        args = self.args
+        self.stub = serve_stub("127.0.0.1", 0, args.countries, args.upstream_latency_ms, seed=args.seed, change_fraction=args.change_fraction)
+        stub_url = f"http://127.0.0.1:{self.stub.server_port}"
+        env = dict(
+            os.environ,
+            DATABASE_URL=f"sqlite+aiosqlite:///{self.workdir.name}/bench.db",
+            COUNTRY_API_URL=f"{stub_url}/countries",
+            RATE_API_URL=f"{stub_url}/rates",
+            UPSTREAM_CACHE_DIR=f"{self.workdir.name}/upstream",
+            LOG_FILE="",
+            ACCESS_LOG_SAMPLE_RATE=os.environ.get("ACCESS_LOG_SAMPLE_RATE", "0"),
+            # refresh bursts would otherwise mostly measure 429s
+            RATE_LIMIT_ENABLED=os.environ.get("RATE_LIMIT_ENABLED", "false"),
+        )
+        command = [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", str(REPO_DIR),
+                   "--host", "127.0.0.1", "--port", str(args.port), "--no-access-log", "--log-level", "warning"]
+        # cwd is the temp dir so cache/summary.png and friends stay out of the repo
+        self.process = subprocess.Popen(command, cwd=self.workdir.name, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return f"http://127.0.0.1:{args.port}"
+
+    async def wait_ready(self, client: httpx.AsyncClient, timeout: float = 30) -> None:
+        deadline = time.perf_counter() + timeout
+        while time.perf_counter() < deadline:
+            if self.process.poll() is not None:
+                raise SystemExit(f"uvicorn exited with code {self.process.returncode}")
+            try:
+                if (await client.get("/status")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+        raise SystemExit("server did not become ready")
+
+    def stop(self) -> None:
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        if self.stub is not None:
+            self.stub.shutdown()
+        self.workdir.cleanup()
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args) -> Dict:
+    weights = parse_mix(args.mix)
+    stack = SpawnedStack(args) if args.spawn else None
+    base_url = stack.start() if stack else args.base_url
+    limits = httpx.Limits(max_connections=args.concurrency + args.refresh_burst + 4)
+    try:
+        async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+            if stack:
+                await stack.wait_ready(client)
+            if stack or args.refresh_first:
+                response = await client.post("/countries/refresh")
+                if response.status_code >= 400:
+                    raise SystemExit(f"initial refresh failed: {response.status_code} {response.text}")
+            data = await Dataset.load(client)
+            for _ in range(args.warmup):
+                method, url, params = OPERATIONS[random.choice(list(weights))](random.Random(), data)
+                await client.request(method, url, params=params)
+
+            before = await scrape(client)
+            recorder = Recorder()
+            started = time.perf_counter()
+            deadline = started + args.duration
+            tasks = [_worker(client, recorder, weights, data, deadline, args.seed + i) for i in range(args.concurrency)]
+            if args.refresh_every > 0:
+                tasks.append(_refresh_bursts(client, recorder, args.refresh_every, args.refresh_burst, deadline))
+            await asyncio.gather(*tasks)
+            duration = time.perf_counter() - started
+            after = await scrape(client)
+    finally:
+        if stack:
+            stack.stop()
+
+    all_latencies = [value for values in recorder.latencies.values() for value in values]
+    return {
+        "meta": {
+            "started_at": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
+            "git_revision": _git_revision(),
+            "base_url": base_url,
+            "spawned": bool(stack),
+            "duration_s": round(duration, 3),
+            "concurrency": args.concurrency,
+            "mix": weights,
+            "refresh_every_s": args.refresh_every,
+            "refresh_burst": args.refresh_burst,
+            "countries": args.countries if stack else len(data.names),
+            "upstream_latency_ms": args.upstream_latency_ms if stack else None,
+            "seed": args.seed,
+        },
+        "totals": summarize(all_latencies, duration, sum(recorder.errors.values()), sum(recorder.rejected.values())),
+        "operations": {
+            op: dict(summarize(values, duration, recorder.errors.get(op, 0), recorder.rejected.get(op, 0)), statuses=recorder.statuses[op])
+            for op, values in sorted(recorder.latencies.items())
+        },
+        "server": metrics_delta(before, after),
+    }
+
+
+def print_report(report: Dict) -> None:
+    totals = report["totals"]
+    print(f"{totals['requests']} requests in {report['meta']['duration_s']}s: {totals['throughput_rps']} req/s, "
+          f"p50 {totals['p50_ms']} ms, p95 {totals['p95_ms']} ms, p99 {totals['p99_ms']} ms, {totals['errors']} errors, "
+          f"{totals.get('rejected', 0)} rejected")
+    print(f"{'operation':<15}{'requests':>9}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}{'rejected':>10}")
+    for op, stats in report["operations"].items():
+        print(f"{op:<15}{stats['requests']:>9}{stats['throughput_rps']:>9}{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}{stats['errors']:>8}{stats.get('rejected', 0):>10}")
+    server = report.get("server") or {}
+    if server.get("db_queries_total"):
+        print(f"DB statements: {server['db_queries_total']}")
+        print(f"DB statements per request: {server['db_queries_per_request']}")
+    if server.get("refresh_phase_mean_s"):
+        print(f"Refresh phases (mean s): {server['refresh_phase_mean_s']}")
+
+
+def compare(baseline: Dict, candidate: Dict) -> None:
+    def change(old: float, new: float) -> str:
+        if old == new:
+            return "+0.0%"
+        if not old:
+            return "n/a"
+        return f"{(new - old) / old * 100:+.1f}%"
+
+    print(f"baseline {baseline['meta'].get('git_revision')} ({baseline['meta']['started_at']}) "
+          f"vs candidate {candidate['meta'].get('git_revision')} ({candidate['meta']['started_at']})")
+    print(f"{'operation':<22}{'metric':<16}{'baseline':>12}{'candidate':>12}{'change':>10}")
+    rows = [("total", baseline["totals"], candidate["totals"])]
+    rows += [(op, stats, candidate["operations"][op]) for op, stats in baseline["operations"].items() if op in candidate["operations"]]
+    for op, old, new in rows:
+        for metric in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms", "errors", "rejected"):
+            # reports from before rejections were tracked have no "rejected"
+            before, after = old.get(metric, 0), new.get(metric, 0)
+            print(f"{op:<22}{metric:<16}{before:>12}{after:>12}{change(before, after):>10}")
+
+    old_db = baseline.get("server", {}).get("db_queries_per_request", {})
+    new_db = candidate.get("server", {}).get("db_queries_per_request", {})
+    for route in sorted(set(old_db) | set(new_db)):
+        print(f"{route:<22}{'db_queries/req':<16}{old_db.get(route, 0):>12}{new_db.get(route, 0):>12}{change(old_db.get(route, 0), new_db.get(route, 0)):>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run a workload and write a JSON report")
+    run_parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    run_parser.add_argument("--spawn", action="store_true", help="start the upstream stub and a uvicorn server on a temporary SQLite DB")
+    run_parser.add_argument("--port", type=int, default=8765, help="port for the spawned server")
+    run_parser.add_argument("--countries", type=int, default=250, help="upstream stub size (with --spawn)")
+    run_parser.add_argument("--upstream-latency-ms", type=float, default=200, help="upstream stub latency (with --spawn)")
+    run_parser.add_argument("--change-fraction", type=float, default=0.0, help="share of countries changed per upstream response (with --spawn)")
+    run_parser.add_argument("--refresh-first", action="store_true", help="refresh before the run (always done with --spawn)")
+    run_parser.add_argument("--duration", type=float, default=20)
+    run_parser.add_argument("--concurrency", type=int, default=16)
+    run_parser.add_argument("--mix", default=DEFAULT_MIX)
+    run_parser.add_argument("--refresh-every", type=float, default=5, help="seconds between refresh bursts; 0 disables")
+    run_parser.add_argument("--refresh-burst", type=int, default=4, help="concurrent POST /countries/refresh per burst")
+    run_parser.add_argument("--warmup", type=int, default=50, help="untimed requests before the run")
+    run_parser.add_argument("--timeout", type=float, default=60)
+    run_parser.add_argument("--seed", type=int, default=1)
+    run_parser.add_argument("--out", type=Path, help="report path (default benchmarks/results/<timestamp>.json)")
+    run_parser.add_argument("--baseline", type=Path, help="compare the new report against this one")
+
+    compare_parser = commands.add_parser("compare", help="compare two JSON reports")
+    compare_parser.add_argument("baseline", type=Path)
+    compare_parser.add_argument("candidate", type=Path)
+
+    args = parser.parse_args()
+    if args.command == "compare":
+        compare(json.loads(args.baseline.read_text()), json.loads(args.candidate.read_text()))
+        return
+
+    report = asyncio.run(run(args))
+    out = args.out or BENCH_DIR / "results" / f"{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, indent=2))
+    print_report(report)
+    print(f"Report written to {out}")
+    if args.baseline:
+        print()
+        compare(json.loads(args.baseline.read_text()), report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Local stand-in for the REST Countries and exchange-rate APIs.
+
+Serves synthetic payloads in the upstream formats at a configurable size and
+latency, with ETag / If-None-Match support, so refresh benchmarks do not
+depend on (or hammer) the real services:
+
+    python benchmarks/upstream_stub.py --countries 250 --latency-ms 300 --port 8099
+    COUNTRY_API_URL=http://127.0.0.1:8099/countries RATE_API_URL=http://127.0.0.1:8099/rates uvicorn main:app
+
+--change-fraction makes every response change that share of countries'
+populations, to exercise incremental refreshes.
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple
+
+REGIONS = ["Africa", "Americas", "Asia", "Europe", "Oceania", "Polar"]
+CURRENCY_CODES = [
+    "USD", "EUR", "NGN", "GHS", "KES", "ZAR", "EGP", "JPY", "CNY", "INR", "GBP", "CHF",
+    "BRL", "ARS", "MXN", "CAD", "AUD", "NZD", "SEK", "NOK", "RUB", "TRY", "SAR", "AED",
+]
+
+
+def build_countries(count: int, seed: int) -> List[Dict]:
+    """Records shaped like REST Countries v2 (name, capital, region, population, flag, currencies)."""
+    rnd = random.Random(seed)
+    countries = []
+    for i in range(count):
+        if i % 40 == 0:
+            currencies = []
+        elif i % 97 == 0:
+            # currency without a rate upstream -> exchange_rate/estimated_gdp null
+            currencies = [{"code": "XXX", "name": "No rate", "symbol": "?"}]
+        else:
+            code = rnd.choice(CURRENCY_CODES)
+            currencies = [{"code": code, "name": f"{code} currency", "symbol": code[0]}]
+        countries.append({
+            "name": f"Country {i:05d}",
+            "capital": f"Capital {i:05d}",
+            "region": rnd.choice(REGIONS),
+            "population": rnd.randint(10_000, 1_400_000_000),
+            "flag": f"https://flagcdn.com/c{i}.svg",
+            "currencies": currencies,
+            "independent": True,
+        })
+    return countries
+
+
+def build_rates(seed: int) -> Dict:
+    rnd = random.Random(seed + 1)
+    rates = {code: round(rnd.uniform(0.3, 2000), 6) for code in CURRENCY_CODES}
+    rates["USD"] = 1
+    return {"result": "success", "base_code": "USD", "time_last_update_unix": 0, "rates": rates}
+
+
+class StubState:
+    def __init__(self, countries: int, seed: int, change_fraction: float):
+        self.countries = build_countries(countries, seed)
+        self.rates = build_rates(seed)
+        self.change_fraction = change_fraction
+        self.rnd = random.Random(seed + 2)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self._bodies: Dict[str, Tuple[bytes, str]] = {}
+        self._render()
+
+    def _render(self) -> None:
+        for path, payload in (("/countries", self.countries), ("/rates", self.rates)):
+            body = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+            self._bodies[path] = (body, f'"{hashlib.sha1(body).hexdigest()}"')
+
+    def body(self, path: str) -> Tuple[bytes, str]:
+        with self.lock:
+            self.requests += 1
+            if path == "/countries" and self.change_fraction > 0:
+                for country in self.rnd.sample(self.countries, max(1, int(len(self.countries) * self.change_fraction))):
+                    country["population"] += self.rnd.randint(1, 1000)
+                self._render()
+            return self._bodies[path]
+
+
+def make_handler(state: StubState, latency_s: float, jitter_s: float):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            path = self.path.split("?", 1)[0]
+            if path.startswith("/v6/latest"):
+                path = "/rates"
+            elif path.startswith("/v2/all"):
+                path = "/countries"
+            if path not in ("/countries", "/rates"):
+                self.send_response(404)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            time.sleep(latency_s + random.uniform(0, jitter_s))
+            body, etag = state.body(path)
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(host: str, port: int, countries: int, latency_ms: float, jitter_ms: float = 0, seed: int = 42, change_fraction: float = 0.0) -> ThreadingHTTPServer:
+    """Start the stub in a daemon thread and return the server (call ``shutdown()`` to stop)."""
+    state = StubState(countries, seed, change_fraction)
+    server = ThreadingHTTPServer((host, port), make_handler(state, latency_ms / 1000, jitter_ms / 1000))
+    server.daemon_threads = True
+    server.state = state
+    threading.Thread(target=server.serve_forever, name="upstream-stub", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--countries", type=int, default=250)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--change-fraction", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = serve(args.host, args.port, args.countries, args.latency_ms, args.jitter_ms, args.seed, args.change_fraction)
+    print(f"Upstream stub on http://{args.host}:{server.server_port} ({args.countries} countries, {args.latency_ms} ms latency)")
+    print(f"  COUNTRY_API_URL=http://{args.host}:{server.server_port}/countries")
+    print(f"  RATE_API_URL=http://{args.host}:{server.server_port}/rates")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
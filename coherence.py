@@ -0,0 +1,253 @@
+"""
+Cache coherence between worker processes.
+
+Every worker keeps its own in-memory country cache. After a write
+(refresh, delete, snapshot import) the writing worker bumps a shared
+generation counter. The other workers compare it with the value they last
+loaded on their next read and rebuild lazily when it moved. Backends:
+
+- ``none``  single process; nothing is shared.
+- ``file``  an 8-byte counter in a memory-mapped file under COHERENCE_DIR.
+            Reads are a memory access, bumps take an exclusive file lock.
+            Works for workers on one host sharing that directory.
+- ``db``    a one-row ``cache_generation`` table, polled at most every
+            COHERENCE_POLL_SECONDS. The locks described below stay file locks, so
+            this is still for workers on one host; it does not make
+            several hosts refresh or elect a leader safely.
+
+The same directory also holds the file locks that make the scheduler run
+on one leader worker only and keep refreshes and startup schema/snapshot
+work from overlapping between workers.
+"""
+import asyncio
+import mmap
+import os
+import struct
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Dict, Optional
+
+from sqlalchemy import select
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from logger import get_logger
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locks, behave like a single process
+    fcntl = None
+
+logger = get_logger(__name__)
+
+COHERENCE_BACKENDS = ("none", "file", "db")
+COHERENCE_BACKEND = os.getenv("COHERENCE_BACKEND", "file").strip().lower()
+COHERENCE_DIR = os.getenv("COHERENCE_DIR", "cache")
+COHERENCE_POLL_SECONDS = float(os.getenv("COHERENCE_POLL_SECONDS", "1.0"))
+# How often a worker waiting for a lock held by another process retries.
+_LOCK_RETRY_SECONDS = 0.2
+
+_COUNTER = struct.Struct("<Q")
+
+
+class _FileLock:
+    """Exclusive flock on a file; released by the OS if the holder dies."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._fd: Optional[int] = None
+
+    @property
+    def held(self) -> bool:
+        return self._fd is not None
+
+    def try_acquire(self) -> bool:
+        if self._fd is not None:
+            return True
+        if fcntl is None:
+            self._fd = -1
+            return True
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._fd = fd
+        return True
+
+    def release(self) -> None:
+        if self._fd is None:
+            return
+        if self._fd >= 0:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+        self._fd = None
+
+
+class Coherence:
+    """No sharing: the generation never moves and every lock is uncontended."""
+
+    name = "none"
+
+    def __init__(self, directory: str = COHERENCE_DIR):
+        self.directory = Path(directory)
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._leader: Optional[_FileLock] = None
+
+    async def current(self) -> int:
+        """Shared generation; a change means another worker wrote."""
+        return 0
+
+    async def bump(self) -> int:
+        """Announce a write to the other workers; returns the new generation."""
+        return 0
+
+    def is_leader(self) -> bool:
+        """True in exactly one worker: the one holding the scheduler lock."""
+        return True
+
+    @asynccontextmanager
+    async def exclusive(self, name: str):
+        """Hold ``name`` against other tasks in this worker (and, for shared backends, other workers)."""
+        lock = self._locks.setdefault(name, asyncio.Lock())
+        async with lock:
+            yield
+
+    def close(self) -> None:
+        pass
+
+
+class FileCoherence(Coherence):
+    name = "file"
+
+    def __init__(self, directory: str = COHERENCE_DIR):
+        super().__init__(directory)
+        self.path = self.directory / "generation"
+        self._map: Optional[mmap.mmap] = None
+        self._fd: Optional[int] = None
+
+    def _counter(self) -> mmap.mmap:
+        if self._map is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            if os.fstat(fd).st_size < _COUNTER.size:
+                # concurrent creators may both extend it; zero-filling is idempotent
+                os.ftruncate(fd, _COUNTER.size)
+            self._map = mmap.mmap(fd, _COUNTER.size)
+            self._fd = fd
+        return self._map
+
+    async def current(self) -> int:
+        return _COUNTER.unpack_from(self._counter(), 0)[0]
+
+    async def bump(self) -> int:
+        counter = self._counter()
+        # the lock may be held by another worker mid-bump; wait for it off the event loop
+        return await asyncio.to_thread(self._increment, counter)
+
+    def _increment(self, counter: mmap.mmap) -> int:
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            value = _COUNTER.unpack_from(counter, 0)[0] + 1
+            _COUNTER.pack_into(counter, 0, value)
+        finally:
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        return value
+
+    def is_leader(self) -> bool:
+        if self._leader is None:
+            self._leader = _FileLock(self.directory / "scheduler.lock")
+        was_leader = self._leader.held
+        # retried on every call, so a follower takes over once the leader exits
+        leader = self._leader.try_acquire()
+        if leader and not was_leader:
+            logger.info(f"This worker (pid {os.getpid()}) is now the scheduler leader")
+        return leader
+
+    @asynccontextmanager
+    async def exclusive(self, name: str):
+        async with super().exclusive(name):
+            lock = _FileLock(self.directory / f"{name}.lock")
+            waited = False
+            while not lock.try_acquire():
+                if not waited:
+                    logger.info(f"Waiting for another worker to release the {name} lock")
+                    waited = True
+                await asyncio.sleep(_LOCK_RETRY_SECONDS)
+            try:
+                yield
+            finally:
+                lock.release()
+
+    def close(self) -> None:
+        if self._leader is not None:
+            self._leader.release()
+        if self._map is not None:
+            self._map.close()
+            os.close(self._fd)
+            self._map = None
+
+
+class DatabaseCoherence(FileCoherence):
+    """Generation in the database; locks and leader election stay file-based, so one host only."""
+
+    name = "db"
+
+    def __init__(self, directory: str = COHERENCE_DIR, poll_seconds: float = COHERENCE_POLL_SECONDS):
+        super().__init__(directory)
+        self.poll_seconds = poll_seconds
+        self._value = 0
+        self._checked = float("-inf")
+
+    async def current(self) -> int:
+        if time.monotonic() - self._checked < self.poll_seconds:
+            return self._value
+        from database import read_session
+        from models import CacheGeneration
+
+        async with read_session() as session:
+            value = (await session.execute(select(CacheGeneration.generation).where(CacheGeneration.id == 1))).scalar()
+        self._value = value or 0
+        self._checked = time.monotonic()
+        return self._value
+
+    async def bump(self) -> int:
+        from database import async_session
+        from models import CacheGeneration
+
+        async with async_session() as session:
+            await session.execute(_bump_statement(session.bind.dialect.name))
+            await session.commit()
+            value = (await session.execute(select(CacheGeneration.generation).where(CacheGeneration.id == 1))).scalar()
+        self._value = value
+        self._checked = time.monotonic()
+        return value
+
+
+def _bump_statement(dialect: str):
+    """Increment the generation row, creating it on first use, as one statement so racing workers cannot collide."""
+    from models import CacheGeneration
+
+    table = CacheGeneration.__table__
+    if dialect == "mysql":
+        stmt = mysql_insert(table).values(id=1, generation=1)
+        return stmt.on_duplicate_key_update(generation=table.c.generation + 1)
+    stmt = sqlite_insert(table).values(id=1, generation=1)
+    return stmt.on_conflict_do_update(index_elements=[table.c.id], set_={"generation": table.c.generation + 1})
+
+
+def create_coherence(backend: str = COHERENCE_BACKEND) -> Coherence:
+    if backend not in COHERENCE_BACKENDS:
+        logger.warning(f"Unknown COHERENCE_BACKEND {backend!r}; expected one of: {', '.join(COHERENCE_BACKENDS)}. Using 'none'.")
+        backend = "none"
+    if backend != "none" and fcntl is None:
+        logger.warning("File locks are not available on this platform; run a single worker.")
+    return {"none": Coherence, "file": FileCoherence, "db": DatabaseCoherence}[backend]()
+
+
+coherence = create_coherence()
@@ -0,0 +1,543 @@
+import asyncio
+import hashlib
+import heapq
+import json
+import math
+import os
+import zlib
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from coherence import coherence
+from logger import get_logger
+from models import Country, normalize_name
+from pagination import COUNTRY_FIELDS, SORT_FIELDS, SORT_OPTIONS, parse_sort
+from schemas import CountryResponse
+from timeutil import iso_utc
+
+logger = get_logger(__name__)
+
+# Tables larger than this are not held in memory; list requests then go to the DB.
+COUNTRY_CACHE_MAX_ROWS = int(os.getenv("COUNTRY_CACHE_MAX_ROWS", "50000"))
+# Pre-serialized GET /countries filter/sort combinations kept per generation.
+MAX_LIST_VARIANTS = int(os.getenv("COUNTRY_CACHE_MAX_LIST_VARIANTS", "256"))
+# Countries kept in the precomputed GDP rankings (overall and per region).
+STATS_TOP_N = int(os.getenv("COUNTRY_STATS_TOP_N", "10"))
+
+# Rows fetched per round trip while the cache is loaded.
+_LOAD_BATCH_SIZE = 1000
+# What the name index, rates and aggregates need when the table is too large to cache.
+_AGGREGATE_FIELDS = ("name", "region", "currency_code", "population", "estimated_gdp", "last_refreshed_at")
+_AGGREGATE_COLUMNS = tuple(Country.__table__.c[name] for name in ("id", "name_normalized", "exchange_rate") + _AGGREGATE_FIELDS)
+
+
+def _dump_json(value: Any) -> bytes:
+    # same encoder settings as starlette's JSONResponse.render
+    return json.dumps(value, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def _to_float(value):
+    return float(value) if value is not None else None
+
+
+# Conversions applied to DB values before JSON encoding; other fields pass through.
+_FIELD_FORMATTERS = {
+    "exchange_rate": _to_float,
+    "estimated_gdp": _to_float,
+    "last_refreshed_at": iso_utc,
+}
+
+
+def serialize_country(c, fields: Tuple[str, ...] = COUNTRY_FIELDS) -> Dict[str, Any]:
+    """Country row (ORM object or Core row) -> JSON-ready dict used by GET /countries."""
+    output = {}
+    for field in fields:
+        value = getattr(c, field, None)
+        formatter = _FIELD_FORMATTERS.get(field)
+        output[field] = formatter(value) if formatter is not None else value
+    return output
+
+
+def row_serializer(fields: Tuple[str, ...] = COUNTRY_FIELDS) -> Callable[[Sequence[Any]], Dict[str, Any]]:
+    """
+    serialize_country for rows selected as exactly ``fields``, in that order.
+    Reads values by position, which is several times cheaper than attribute
+    access on Core rows when serializing large result sets.
+    """
+    converters = [(index, _FIELD_FORMATTERS[field]) for index, field in enumerate(fields) if field in _FIELD_FORMATTERS]
+
+    def serialize(row: Sequence[Any]) -> Dict[str, Any]:
+        values = list(row)
+        for index, convert in converters:
+            values[index] = convert(values[index])
+        return dict(zip(fields, values))
+
+    return serialize
+
+
+class CountrySnapshot:
+    """
+    Immutable in-memory copy of the countries table for one cache generation.
+
+    Rows are kept in primary-key order (the order the DB returns them without
+    ORDER BY) with secondary indexes by region and currency code. The
+    GDP-descending order is precomputed; other sort orders are built on
+    first use and kept for the rest of the generation. Serialized JSON bodies for list
+    variants and single countries are memoized on the snapshot, so they are
+    produced at most once per generation.
+    """
+
+    __slots__ = (
+        "generation", "tag", "rows", "by_name", "by_id", "by_region", "by_currency", "gdp_desc",
+        "_orders", "_row_json", "_list_bodies", "_detail_bodies",
+    )
+
+    def __init__(self, generation: int, rows: List[Dict[str, Any]]):
+        self.generation = generation
+        self.rows: Tuple[Dict[str, Any], ...] = tuple(rows)
+        # Each row serialized once per generation, byte-for-byte what JSONResponse would emit.
+        self._row_json = tuple(_dump_json(row) for row in self.rows)
+        digest = hashlib.blake2b(b"\n".join(self._row_json), digest_size=8).hexdigest()
+        # Strong ETag prefix. Content-only, so every worker (each counting its own
+        # generations) hands out the same tag for the same data.
+        self.tag = digest
+        self._list_bodies: "OrderedDict[Tuple, Tuple[bytes, str]]" = OrderedDict()
+        self._detail_bodies: Dict[int, Optional[Tuple[bytes, str]]] = {}
+        self.by_name: Dict[str, int] = {}
+        self.by_id: Dict[int, int] = {}
+        by_region: Dict[str, List[int]] = {}
+        by_currency: Dict[str, List[int]] = {}
+        for pos, row in enumerate(self.rows):
+            self.by_name.setdefault(normalize_name(row["name"]), pos)
+            self.by_id[row["id"]] = pos
+            if row["region"] is not None:
+                by_region.setdefault(row["region"], []).append(pos)
+            if row["currency_code"] is not None:
+                by_currency.setdefault(row["currency_code"], []).append(pos)
+        self.by_region = {key: tuple(val) for key, val in by_region.items()}
+        self.by_currency = {key: tuple(val) for key, val in by_currency.items()}
+        self._orders: Dict[str, Tuple[Tuple[int, ...], List[int]]] = {}
+        self.gdp_desc = self._order("gdp_desc")[0]
+
+    def _order(self, sort: str) -> Tuple[Tuple[int, ...], List[int]]:
+        """Row positions in ``sort`` order plus each position's rank, built once per sort."""
+        cached = self._orders.get(sort)
+        if cached is not None:
+            return cached
+        key, descending = parse_sort(sort)
+        field = SORT_FIELDS[key]
+        # rows are in id order and sorted() is stable (also with reverse=True),
+        # so ties keep ascending id exactly like the SQL tie-breaker
+        present = [pos for pos, row in enumerate(self.rows) if row[field] is not None]
+        missing = [pos for pos, row in enumerate(self.rows) if row[field] is None]
+        order = tuple(sorted(present, key=lambda pos: self.rows[pos][field], reverse=descending) + missing)
+        rank = [0] * len(self.rows)
+        for index, pos in enumerate(order):
+            rank[pos] = index
+        self._orders[sort] = (order, rank)
+        return order, rank
+
+    def select(self, region: Optional[str] = None, currency: Optional[str] = None, sort: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Same result as the filtered/sorted SQL query in GET /countries."""
+        positions = self._positions(region, currency, sort)
+        if positions is None:
+            return list(self.rows)
+        return [self.rows[pos] for pos in positions]
+
+    def _positions(self, region: Optional[str], currency: Optional[str], sort: Optional[str]):
+        if region and currency:
+            wanted = set(self.by_currency.get(currency, ()))
+            positions = [pos for pos in self.by_region.get(region, ()) if pos in wanted]
+        elif region:
+            positions = self.by_region.get(region, ())
+        elif currency:
+            positions = self.by_currency.get(currency, ())
+        else:
+            positions = None
+
+        if sort in SORT_OPTIONS:
+            order, rank = self._order(sort)
+            if positions is None:
+                positions = order
+            else:
+                positions = sorted(positions, key=rank.__getitem__)
+        return positions
+
+    def list_body(self, region: Optional[str] = None, currency: Optional[str] = None, sort: Optional[str] = None) -> Tuple[bytes, str]:
+        """Pre-serialized JSON array and ETag for a GET /countries variant."""
+        key = (region or None, currency or None, sort if sort in SORT_OPTIONS else None)
+        cached = self._list_bodies.get(key)
+        if cached is not None:
+            self._list_bodies.move_to_end(key)
+            return cached
+        positions = self._positions(*key)
+        if positions is None:
+            positions = range(len(self.rows))
+        body = b"[" + b",".join(self._row_json[pos] for pos in positions) + b"]"
+        etag = f'"{self.tag}-l{zlib.crc32(repr(key).encode("utf-8")):08x}"'
+        self._list_bodies[key] = (body, etag)
+        if len(self._list_bodies) > MAX_LIST_VARIANTS:
+            self._list_bodies.popitem(last=False)
+        return body, etag
+
+    def batch(self, names: Sequence[str], ids: Sequence[int]) -> Tuple[bytes, List[str], List[int]]:
+        """
+        JSON array of the countries matching ``names`` (case-insensitive) or
+        ``ids``, in request order without duplicates, plus the names and ids
+        that matched nothing. Rows are the pre-serialized GET /countries ones.
+        """
+        seen = set()
+        found: List[bytes] = []
+        missing_names = []
+        missing_ids = []
+        for name in names:
+            pos = self.by_name.get(normalize_name(name))
+            if pos is None:
+                missing_names.append(name)
+            elif pos not in seen:
+                seen.add(pos)
+                found.append(self._row_json[pos])
+        for country_id in ids:
+            pos = self.by_id.get(country_id)
+            if pos is None:
+                missing_ids.append(country_id)
+            elif pos not in seen:
+                seen.add(pos)
+                found.append(self._row_json[pos])
+        return b"[" + b",".join(found) + b"]", missing_names, missing_ids
+
+    def contains(self, name: str) -> bool:
+        return normalize_name(name) in self.by_name
+
+    def detail_body(self, name: str) -> Optional[Tuple[bytes, str]]:
+        """
+        Pre-serialized GET /countries/{name} body and ETag, rendered through
+        CountryResponse on first request per generation. None when the name is
+        unknown or the row does not validate (the caller falls back to the DB).
+        """
+        pos = self.by_name.get(normalize_name(name))
+        if pos is None:
+            return None
+        if pos not in self._detail_bodies:
+            try:
+                body = CountryResponse.model_validate(self.rows[pos]).model_dump_json().encode("utf-8")
+                self._detail_bodies[pos] = (body, f'"{self.tag}-d{self.rows[pos]["id"]}"')
+            except ValueError:
+                self._detail_bodies[pos] = None
+        return self._detail_bodies[pos]
+
+
+def _exact_add(partials: List[float], x: float) -> None:
+    # Shewchuk's running sum (the algorithm behind math.fsum): fsum(partials)
+    # equals fsum of every value added, without keeping the values
+    i = 0
+    for y in partials:
+        if abs(x) < abs(y):
+            x, y = y, x
+        hi = x + y
+        lo = y - (hi - x)
+        if lo:
+            partials[i] = lo
+            i += 1
+        x = hi
+    partials[i:] = [x]
+
+
+class _Totals:
+    """Running count/sums/latest timestamp and top-N GDP heap for one group of countries."""
+
+    __slots__ = ("count", "population", "gdp", "last_refreshed_at", "top")
+
+    def __init__(self):
+        self.count = 0
+        self.population = 0
+        self.gdp: List[float] = []
+        self.last_refreshed_at = None
+        # min-heap of (gdp, -seq, name); -seq keeps ties in ascending id like the SQL ranking did
+        self.top: List[Tuple[float, int, str]] = []
+
+    def add(self, seq: int, row: Dict[str, Any], top_n: int) -> None:
+        self.count += 1
+        self.population += row["population"] or 0
+        if row["last_refreshed_at"] and (self.last_refreshed_at is None or row["last_refreshed_at"] > self.last_refreshed_at):
+            self.last_refreshed_at = row["last_refreshed_at"]
+        gdp = row["estimated_gdp"]
+        if gdp is None:
+            return
+        _exact_add(self.gdp, gdp)
+        entry = (gdp, -seq, row["name"])
+        if len(self.top) < top_n:
+            heapq.heappush(self.top, entry)
+        elif top_n and entry > self.top[0]:
+            heapq.heapreplace(self.top, entry)
+
+    def ranking(self) -> List[Dict[str, Any]]:
+        return [{"name": name, "estimated_gdp": gdp} for gdp, _, name in sorted(self.top, reverse=True)]
+
+
+class AggregateBuilder:
+    """
+    Single pass over the rows (in id order) behind CountryAggregates. Keeps
+    O(regions x top_n) state rather than the rows themselves, so it also
+    works when the table is streamed because it is too large to cache.
+    """
+
+    def __init__(self, top_n: int = STATS_TOP_N):
+        self.top_n = top_n
+        self.overall = _Totals()
+        self.regions: Dict[str, _Totals] = {}
+        self.currencies: Dict[str, int] = {}
+
+    def add(self, row: Dict[str, Any]) -> None:
+        seq = self.overall.count
+        self.overall.add(seq, row, self.top_n)
+        if row["region"] is not None:
+            totals = self.regions.get(row["region"])
+            if totals is None:
+                totals = self.regions[row["region"]] = _Totals()
+            totals.add(seq, row, self.top_n)
+        if row["currency_code"] is not None:
+            self.currencies[row["currency_code"]] = self.currencies.get(row["currency_code"], 0) + 1
+
+    def build(self, generation: int, last_refreshed_at) -> "CountryAggregates":
+        return CountryAggregates(generation, self, last_refreshed_at)
+
+
+class CountryAggregates:
+    """
+    Totals, per-region/per-currency breakdowns and GDP rankings for one cache
+    generation, computed once when the cache is rebuilt. /status,
+    /countries/stats and the summary images read these instead of running
+    COUNT/MAX/ORDER BY queries on every call.
+    """
+
+    __slots__ = ("generation", "total", "last_refreshed_at", "top_n", "top_by_gdp", "regions", "body", "etag", "status_body")
+
+    def __init__(self, generation: int, totals: AggregateBuilder, last_refreshed_at):
+        self.generation = generation
+        self.total = totals.overall.count
+        # raw DB value; formatted with iso_utc like every other timestamp
+        self.last_refreshed_at = last_refreshed_at
+        self.top_n = totals.top_n
+        self.top_by_gdp = totals.overall.ranking()
+        self.regions = {
+            region: {
+                "count": members.count,
+                "population": members.population,
+                "estimated_gdp": math.fsum(members.gdp),
+                "last_refreshed_at": members.last_refreshed_at,
+                "top_by_gdp": members.ranking(),
+            }
+            for region, members in sorted(totals.regions.items())
+        }
+
+        last_iso = iso_utc(last_refreshed_at)
+        self.status_body = _dump_json({"total_countries": self.total, "last_refreshed_at": last_iso})
+        self.body = _dump_json({
+            "total_countries": self.total,
+            "last_refreshed_at": last_iso,
+            "population": totals.overall.population,
+            "estimated_gdp": math.fsum(totals.overall.gdp),
+            "top_by_gdp": self.top_by_gdp,
+            "regions": self.regions,
+            "currencies": dict(sorted(totals.currencies.items())),
+        })
+        digest = hashlib.blake2b(self.body, digest_size=8).hexdigest()
+        self.etag = f'"{digest}-s"'
+
+    def image_data(self, top: int, region: Optional[str] = None) -> Optional[Tuple[int, List[Tuple[str, float]], Optional[str]]]:
+        """(total, ranked, refreshed) for a summary image, or None when ``top`` exceeds the precomputed rankings."""
+        if top > self.top_n:
+            return None
+        if region:
+            stats = self.regions.get(region)
+            if stats is None:
+                return 0, [], None
+            total, ranking, refreshed = stats["count"], stats["top_by_gdp"], stats["last_refreshed_at"]
+        else:
+            total, ranking, refreshed = self.total, self.top_by_gdp, iso_utc(self.last_refreshed_at)
+        return total, [(entry["name"], entry["estimated_gdp"]) for entry in ranking[:top]], refreshed
+
+
+class CountryCache:
+    """
+    Read-through holder for the current CountrySnapshot.
+
+    Refresh and delete rebuild the snapshot from the DB and swap it in with a
+    single assignment, so readers always see either the old or the new
+    generation, never a mix.
+
+    Alongside it a normalized-name -> id map is kept for point lookups. It is
+    built on every rebuild, also when the table is too large for a snapshot.
+    Lookups that miss it need no SQL, and hits become primary-key reads.
+    The CountryAggregates are likewise rebuilt regardless of table size.
+
+    With several workers each process holds its own copy. Writes bump the
+    shared generation in ``coherence``; a worker that sees it move marks
+    itself stale and rebuilds on its next read.
+    """
+
+    def __init__(self, max_rows: int = COUNTRY_CACHE_MAX_ROWS):
+        self.max_rows = max_rows
+        self.snapshot: Optional[CountrySnapshot] = None
+        self.name_index: Optional[Dict[str, int]] = None
+        self.aggregates: Optional[CountryAggregates] = None
+        # currency -> exchange rate per USD, as stored on the countries
+        self.rates: Optional[Dict[str, float]] = None
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self._stale = True
+        # shared generation the current contents were loaded at
+        self._shared_seen: Optional[int] = None
+        self._lock = asyncio.Lock()
+
+    def _is_current(self, shared: int) -> bool:
+        return not self._stale and shared == self._shared_seen
+
+    async def _ensure_fresh(self, session: AsyncSession) -> None:
+        if not self._is_current(await coherence.current()):
+            # first use, or another worker wrote since we loaded
+            await self.rebuild(session, force=False)
+
+    async def get(self, session: AsyncSession) -> Optional[CountrySnapshot]:
+        """Current snapshot, loading it on first use; None when the table is over the memory bound."""
+        await self._ensure_fresh(session)
+        snapshot = self.snapshot
+        if snapshot is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return snapshot
+
+    async def rebuild(self, session: AsyncSession, force: bool = True) -> Optional[CountrySnapshot]:
+        """
+        Load the table into a new generation. With ``force=False`` (readers)
+        the load is skipped when another caller brought the cache up to date
+        while this one waited for the lock, so a burst of cold or stale reads
+        costs one table scan, not one each.
+        """
+        # serialized so a slow read-through load can never overwrite the snapshot
+        # built by a refresh that committed after it started
+        async with self._lock:
+            # read before the rows: a write landing during the load moves it again
+            shared = await coherence.current()
+            if not force and self._is_current(shared):
+                return self.snapshot
+            started_at = self.generation
+            # decide before loading, so an oversized table is streamed into the
+            # index and aggregates without ever holding its serialized rows
+            count = (await session.execute(select(func.count(Country.id)))).scalar() or 0
+            cacheable = count <= self.max_rows
+            stmt = select(Country.__table__) if cacheable else select(*_AGGREGATE_COLUMNS)
+            result = await session.stream(stmt.order_by(Country.id).execution_options(yield_per=_LOAD_BATCH_SIZE))
+            fields = COUNTRY_FIELDS if cacheable else _AGGREGATE_FIELDS
+            rows: List[Dict[str, Any]] = []
+            totals = AggregateBuilder()
+            name_index: Dict[str, int] = {}
+            rates: Dict[str, Tuple[Any, float]] = {}
+            last_refreshed_at = None
+            async for row in result:
+                serialized = serialize_country(row, fields)
+                totals.add(serialized)
+                if cacheable:
+                    rows.append(serialized)
+                name_index.setdefault(row.name_normalized or normalize_name(row.name), row.id)
+                if row.last_refreshed_at is not None and (last_refreshed_at is None or row.last_refreshed_at > last_refreshed_at):
+                    last_refreshed_at = row.last_refreshed_at
+                if row.currency_code and row.exchange_rate:
+                    # after incremental refreshes the most recently written row has the current rate
+                    known = rates.get(row.currency_code)
+                    if known is None or (row.last_refreshed_at is not None and (known[0] is None or row.last_refreshed_at > known[0])):
+                        rates[row.currency_code] = (row.last_refreshed_at, float(row.exchange_rate))
+            if self.generation != started_at:
+                # invalidated while loading; what we read may already be outdated
+                return None
+            self.generation += 1
+            self.name_index = name_index
+            self.aggregates = totals.build(self.generation, last_refreshed_at)
+            self.rates = {code: rate for code, (_, rate) in rates.items()}
+            if not cacheable:
+                logger.warning(f"Country cache disabled: {count} rows exceeds COUNTRY_CACHE_MAX_ROWS={self.max_rows}")
+                self.snapshot = None
+            else:
+                snapshot = CountrySnapshot(self.generation, rows)
+                # warm the variants nearly every client polls
+                snapshot.list_body()
+                snapshot.list_body(sort="gdp_desc")
+                self.snapshot = snapshot
+            self._shared_seen = shared
+            self._stale = False
+            logger.info(f"Country cache rebuilt: generation {self.generation}, {self.aggregates.total} rows")
+            return self.snapshot
+
+    async def reload(self, session: AsyncSession) -> Optional[CountrySnapshot]:
+        """
+        Rebuild after a write and tell the other workers to do the same; on
+        failure drop the snapshot instead of serving stale data.
+        """
+        try:
+            snapshot = await self.rebuild(session)
+        except Exception:
+            logger.exception("Failed to rebuild country cache; dropping it.")
+            self.invalidate()
+            snapshot = None
+        try:
+            shared = await coherence.bump()
+        except Exception:
+            logger.exception("Failed to announce the cache change to other workers.")
+            return snapshot
+        if not self._stale and self._shared_seen == shared - 1:
+            # no other worker wrote in between, so what we just loaded is current
+            self._shared_seen = shared
+        return snapshot
+
+    def invalidate(self) -> None:
+        """Drop the snapshot; the next read reloads it."""
+        self.generation += 1
+        self.snapshot = None
+        self.name_index = None
+        self.aggregates = None
+        self.rates = None
+        self._stale = True
+
+    async def lookup_id(self, session: AsyncSession, name: str) -> Tuple[bool, Optional[int]]:
+        """
+        Resolve a country name via the in-memory index: (True, id) when known,
+        (True, None) when definitely absent, (False, None) when the index is
+        unavailable and the caller has to ask the DB.
+        """
+        await self._ensure_fresh(session)
+        name_index = self.name_index
+        if name_index is None:
+            return False, None
+        return True, name_index.get(normalize_name(name))
+
+    async def get_aggregates(self, session: AsyncSession) -> Optional[CountryAggregates]:
+        """Precomputed aggregates for the current generation; None when they could not be built."""
+        await self._ensure_fresh(session)
+        return self.aggregates
+
+    async def get_rates(self, session: AsyncSession) -> Optional[Dict[str, float]]:
+        """Stored exchange rates per USD by currency code; None when they could not be loaded."""
+        await self._ensure_fresh(session)
+        return self.rates
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "generation": self.generation,
+            "shared_generation": self._shared_seen,
+            "rows": len(self.snapshot.rows) if self.snapshot is not None else 0,
+            "indexed_names": len(self.name_index) if self.name_index is not None else 0,
+            "max_rows": self.max_rows,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
+
+
+country_cache = CountryCache()
@@ -1,6 +1,10 @@
+import logging
 import os
+from typing import Any, Dict, Tuple
 from dotenv import load_dotenv
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
 
 load_dotenv()
@@ -26,15 +30,108 @@ if not DATABASE_URL:
         # Default to local SQLite file (async)
         DATABASE_URL = os.getenv("SQLITE_DATABASE_URL", "sqlite+aiosqlite:///./countries.db")
 
-# Create the async engine
-engine = create_async_engine(DATABASE_URL, echo=True, future=True)
+def env_bool(name: str, default: bool) -> bool:
+    """Boolean setting from the environment: 1/true/yes/on (any case) are true."""
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
 
-# Create an async session factory
+
+# SQL statement logging is noisy and slow; opt in with SQL_ECHO=true when debugging.
+SQL_ECHO = env_bool("SQL_ECHO", False)
+if SQL_ECHO:
+    # Same output as echo=True, but through the app's logging queue instead of
+    # the synchronous stdout handler echo installs.
+    logging.getLogger("sqlalchemy.engine").setLevel(logging.INFO)
+
+# Pool settings for server databases (MySQL)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = env_bool("DB_POOL_PRE_PING", True)
+
+# SQLite settings
+SQLITE_WAL = env_bool("SQLITE_WAL", True)
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_READ_POOL_SIZE = int(os.getenv("SQLITE_READ_POOL_SIZE", "5"))
+
+DB_DIALECT = make_url(DATABASE_URL).get_backend_name()
+
+
+def _is_memory_sqlite(url: str) -> bool:
+    database = make_url(url).database or ""
+    return database in ("", ":memory:") or "mode=memory" in url
+
+
+def _sqlite_pragmas(read_only: bool):
+    pragmas = [
+        f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}",
+        f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}",
+        f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}",
+    ]
+    if SQLITE_WAL and not read_only:
+        # persistent per database file; readers then no longer block behind the refresh writer
+        pragmas.insert(0, "PRAGMA journal_mode=WAL")
+    if read_only:
+        pragmas.append("PRAGMA query_only=ON")
+
+    def apply(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+    return apply
+
+
+def _create_engines() -> Tuple[AsyncEngine, AsyncEngine]:
+    """Build the write engine and the engine used for read-only requests, per dialect."""
+    if DB_DIALECT == "sqlite":
+        if _is_memory_sqlite(DATABASE_URL):
+            # every connection to :memory: is a separate database; keep a single engine
+            memory_engine = create_async_engine(DATABASE_URL, future=True)
+            return memory_engine, memory_engine
+        write_engine = create_async_engine(DATABASE_URL, future=True)
+        event.listen(write_engine.sync_engine, "connect", _sqlite_pragmas(read_only=False))
+        # Separate pool of query_only connections for GET handlers; with WAL they read
+        # the last committed snapshot while a refresh holds the write lock.
+        read_only_engine = create_async_engine(
+            DATABASE_URL, future=True,
+            pool_size=SQLITE_READ_POOL_SIZE, max_overflow=SQLITE_READ_POOL_SIZE,
+        )
+        event.listen(read_only_engine.sync_engine, "connect", _sqlite_pragmas(read_only=True))
+        return write_engine, read_only_engine
+
+    server_engine = create_async_engine(
+        DATABASE_URL,
+        future=True,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+    )
+    return server_engine, server_engine
+
+
+# Create the async engines
+engine, read_engine = _create_engines()
+
+# Create async session factories
 async_session = sessionmaker(
     bind=engine,
     class_=AsyncSession,
     expire_on_commit=False,
 )
+read_session = sessionmaker(
+    bind=read_engine,
+    class_=AsyncSession,
+    expire_on_commit=False,
+)
 
 # Base class for all models
 Base = declarative_base()
@@ -46,3 +143,40 @@ async def get_db():
             yield session
         finally:
             await session.close()
+
+
+async def get_read_db():
+    """Session for handlers that only read; uses the read-only pool where the dialect has one."""
+    async with read_session() as session:
+        try:
+            yield session
+        finally:
+            await session.close()
+
+
+async def describe_database() -> Dict[str, Any]:
+    """Effective engine settings, as reported by the database itself where possible."""
+    settings: Dict[str, Any] = {
+        "dialect": DB_DIALECT,
+        "url": make_url(DATABASE_URL).render_as_string(hide_password=True),
+        "echo": SQL_ECHO,
+        "pool": engine.pool.status(),
+        "separate_read_pool": read_engine is not engine,
+    }
+    async with engine.connect() as conn:
+        if DB_DIALECT == "sqlite":
+            for pragma in ("journal_mode", "synchronous", "mmap_size", "busy_timeout"):
+                settings[pragma] = (await conn.exec_driver_sql(f"PRAGMA {pragma}")).scalar()
+        elif DB_DIALECT == "mysql":
+            settings.update({
+                "pool_size": DB_POOL_SIZE,
+                "max_overflow": DB_MAX_OVERFLOW,
+                "pool_recycle": DB_POOL_RECYCLE,
+                "pool_pre_ping": DB_POOL_PRE_PING,
+                "server_version": (await conn.exec_driver_sql("SELECT VERSION()")).scalar(),
+            })
+    if read_engine is not engine:
+        async with read_engine.connect() as conn:
+            settings["read_pool"] = read_engine.pool.status()
+            settings["read_query_only"] = bool((await conn.exec_driver_sql("PRAGMA query_only")).scalar())
+    return settings
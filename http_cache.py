@@ -0,0 +1,111 @@
+import asyncio
+import hashlib
+import json
+import os
+from dataclasses import dataclass, replace
+from pathlib import Path
+from typing import Any, Optional
+
+import httpx
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+
+@dataclass
+class UpstreamResponse:
+    url: str
+    body: bytes
+    digest: str
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    # True when the upstream answered 304 or returned the body we already have.
+    unchanged: bool = False
+
+    def json(self) -> Any:
+        return json.loads(self.body)
+
+
+class HTTPResponseCache:
+    """
+    Persistent cache of upstream API responses.
+
+    Stores the raw body plus its ETag / Last-Modified validators per URL so
+    the next fetch can be a conditional request. Entries are only written via
+    ``store`` once the caller has successfully processed a response, so a
+    failed refresh is retried in full next time instead of being skipped.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        # hit: upstream answered 304 or sent the body we already had
+        self.hits = 0
+        self.misses = 0
+
+    def _paths(self, url: str):
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()[:32]
+        return self.directory / f"{key}.json", self.directory / f"{key}.body"
+
+    def load(self, url: str) -> Optional[UpstreamResponse]:
+        meta_path, body_path = self._paths(url)
+        try:
+            meta = json.loads(meta_path.read_text(encoding="utf-8"))
+            body = body_path.read_bytes()
+        except (OSError, ValueError):
+            return None
+        if hashlib.sha256(body).hexdigest() != meta.get("digest"):
+            logger.warning(f"Discarding corrupt upstream cache entry for {url}")
+            return None
+        return UpstreamResponse(url=url, body=body, digest=meta["digest"], etag=meta.get("etag"), last_modified=meta.get("last_modified"))
+
+    def store(self, response: UpstreamResponse) -> None:
+        meta_path, body_path = self._paths(response.url)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        meta = {"url": response.url, "digest": response.digest, "etag": response.etag, "last_modified": response.last_modified}
+        # body first, then metadata: a reader never sees metadata for a body that is not on disk yet
+        _write_atomic(body_path, response.body)
+        _write_atomic(meta_path, json.dumps(meta).encode("utf-8"))
+
+    def clear(self) -> None:
+        """Forget every stored response, so the next fetch of each URL is unconditional."""
+        for path in self.directory.glob("*.json"):
+            path.unlink(missing_ok=True)
+            path.with_suffix(".body").unlink(missing_ok=True)
+
+    async def fetch(self, client: httpx.AsyncClient, url: str) -> UpstreamResponse:
+        cached = await asyncio.to_thread(self.load, url)
+        headers = {}
+        if cached is not None:
+            if cached.etag:
+                headers["If-None-Match"] = cached.etag
+            if cached.last_modified:
+                headers["If-Modified-Since"] = cached.last_modified
+
+        response = await client.get(url, headers=headers)
+        if response.status_code == 304 and cached is not None:
+            logger.info(f"Upstream not modified: {url}")
+            self.hits += 1
+            return replace(cached, unchanged=True)
+        response.raise_for_status()
+
+        body = response.content
+        digest = hashlib.sha256(body).hexdigest()
+        unchanged = cached is not None and cached.digest == digest
+        if unchanged:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return UpstreamResponse(
+            url=url,
+            body=body,
+            digest=digest,
+            etag=response.headers.get("etag"),
+            last_modified=response.headers.get("last-modified"),
+            unchanged=unchanged,
+        )
+
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
@@ -1,10 +1,132 @@
+import atexit
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import random
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Optional
 
-logging.basicConfig(level=logging.INFO,
-format="%(levelname)s - %(filename)s - %(asctime)s - %(name)s- %(message)s",
-handlers=[logging.FileHandler("app.log"), logging.StreamHandler()])
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# "json" (one object per line) or "text" (the classic human-readable format)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").strip().lower()
+# Empty LOG_FILE disables the file handler.
+LOG_FILE = os.getenv("LOG_FILE", "app.log")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+# Records waiting for the writer thread; further records are dropped rather than blocking the caller.
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Fraction of successful requests that get an access log line; 5xx and errors are always logged.
+ACCESS_LOG_SAMPLE_RATE = float(os.getenv("ACCESS_LOG_SAMPLE_RATE", "1.0"))
+
+TEXT_FORMAT = "%(levelname)s - %(filename)s - %(asctime)s - %(name)s- %(message)s"
+
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+# Attributes every LogRecord has; anything else was passed via ``extra=`` and is emitted as a JSON field.
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "request_id"}
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z"),
+            "level": record.levelname,
+            "logger": record.name,
+            "file": record.filename,
+            "msg": record.getMessage(),
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            entry["request_id"] = request_id
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+_exception_formatter = logging.Formatter()
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Enqueues records for the writer thread without formatting them, so the
+    event loop only pays for creating the record. The request id is captured
+    here because the context variable is not visible from the writer thread.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.request_id = request_id_var.get()
+        if record.exc_info:
+            # tracebacks reference live frames; render them while they are still accurate
+            record.exc_text = _exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _build_handlers():
+    formatter = JSONFormatter() if LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT)
+    handlers = [logging.StreamHandler()]
+    if LOG_FILE:
+        handlers.append(logging.handlers.RotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8"))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    return handlers
+
+
+queue_handler = _NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+_listener = logging.handlers.QueueListener(queue_handler.queue, *_build_handlers(), respect_handler_level=True)
+
+_root = logging.getLogger()
+_root.setLevel(LOG_LEVEL)
+_root.handlers = [queue_handler]
+_listener.start()
+
+
+def stop_logging() -> None:
+    """Flush queued records and stop the writer thread (idempotent)."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(stop_logging)
 
 logger = logging.getLogger(__name__)
+access_logger = logging.getLogger("access")
+
+
+def route_uvicorn_logs() -> None:
+    """
+    uvicorn installs its own synchronous stream handlers; call after it has
+    configured logging (e.g. on startup) to send its records through the queue too.
+    """
+    for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+        uvicorn_logger = logging.getLogger(name)
+        uvicorn_logger.handlers = []
+        uvicorn_logger.propagate = True
+
+
+def should_log_access(status_code: int) -> bool:
+    return status_code >= 500 or ACCESS_LOG_SAMPLE_RATE >= 1 or random.random() < ACCESS_LOG_SAMPLE_RATE
+
 
 def get_logger(filename: str) -> logging.Logger:
-    return logging.getLogger(filename)
\ No newline at end of file
+    return logging.getLogger(filename)
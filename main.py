@@ -1,19 +1,59 @@
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from coherence import coherence
 from middleware import add_request_id_and_process_time
-from database import engine,Base
-from logger import get_logger
+from database import async_session, engine, read_engine, Base, describe_database
+from metrics import Counter, Gauge, cache_metrics, instrument_engine, registry
+from models import upgrade_schema
+from logger import get_logger, queue_handler, route_uvicorn_logs
 from routers import router
+from service import close_http_client, upstream_cache
+from country_cache import country_cache
+from scheduler import refresh_scheduler
+from snapshot import load_snapshot_on_startup
+from summary_image import image_variants, shutdown_render_pool
 
 logger = get_logger(__name__)   
 
+instrument_engine(engine, "write")
+if read_engine is not engine:
+    instrument_engine(read_engine, "read")
+
+
+def _cache_collector():
+    generation = Gauge("country_cache_generation", "Current country cache generation.")
+    generation.set(country_cache.generation)
+    rows = Gauge("country_cache_rows", "Countries held in the in-memory snapshot.")
+    rows.set(country_cache.stats()["rows"])
+    dropped = Counter("log_records_dropped_total", "Log records dropped because the logging queue was full.")
+    dropped.inc(amount=queue_handler.dropped)
+    return cache_metrics({"country": country_cache, "image_variants": image_variants, "upstream": upstream_cache}) + [generation, rows, dropped]
+
+
+registry.add_collector(_cache_collector)
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    async with engine.begin() as conn:
-        logger.info("Creating database tables...")
-        await conn.run_sync(Base.metadata.create_all)
+    route_uvicorn_logs()
+    # one worker at a time, so workers don't race creating tables or loading the snapshot
+    async with coherence.exclusive("startup"):
+        async with engine.begin() as conn:
+            logger.info("Creating database tables...")
+            await conn.run_sync(Base.metadata.create_all)
+            await conn.run_sync(upgrade_schema)
+        logger.info(f"Database settings: {await describe_database()}")
+        async with async_session() as session:
+            await load_snapshot_on_startup(session)
+    if refresh_scheduler.interval > 0:
+        # claim leadership up front; later workers keep retrying from the loop
+        coherence.is_leader()
+    await refresh_scheduler.start()
     yield
+    await refresh_scheduler.stop()
+    coherence.close()
+    await close_http_client()
+    shutdown_render_pool()
     logger.info("Application shutdown complete.")
 app = FastAPI(lifespan=lifespan, title="Country Data, Country Currency & Exchange API", version="1.0.0")
 
@@ -24,6 +64,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor"],
 )
 
 @app.get("/")
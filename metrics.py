@@ -0,0 +1,231 @@
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+REFRESH_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+_HTTP_METHODS = frozenset(("GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"))
+
+# [queries, seconds] for the DB work done on behalf of the current request.
+# The list is shared by reference, so queries issued from the handler task and
+# from SQLAlchemy's greenlets (which copy the context) land in the same holder.
+_db_usage: ContextVar[Optional[List[float]]] = ContextVar("db_usage", default=None)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+
+    def samples(self) -> Iterable[Tuple[str, Tuple[str, ...], Tuple[str, ...], float]]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, names, values, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(names, values)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    """
+    Monotonic counter. Updates are plain dict arithmetic on the event loop
+    thread, so recording needs no locks.
+    """
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in list(self._values.items()):
+            yield "", self.labelnames, labels, value
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) - amount
+
+    def set(self, value: float, *labels: str) -> None:
+        self._values[labels] = value
+
+
+class Histogram(_Metric):
+    """Cumulative-bucket histogram; each series is [bucket counts..., +Inf count, sum]."""
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 2)
+        # counts are stored per bucket and made cumulative on render
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def samples(self):
+        bucket_names = self.labelnames + ("le",)
+        for labels, series in list(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                yield "_bucket", bucket_names, labels + (_format_value(bound),), cumulative
+            yield "_sum", self.labelnames, labels, series[-1]
+            yield "_count", self.labelnames, labels, cumulative
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], Iterable[_Metric]]] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], Iterable[_Metric]]) -> None:
+        """Callable producing metrics at scrape time, for state owned by other modules."""
+        self._collectors.append(collector)
+
+    def render(self) -> bytes:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            for metric in collector():
+                lines.extend(metric.render())
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+registry = Registry()
+
+http_requests_total = registry.register(Counter("http_requests_total", "HTTP requests by route and status code.", ("method", "route", "status")))
+http_request_duration = registry.register(Histogram("http_request_duration_seconds", "HTTP request latency.", ("method", "route")))
+http_requests_in_flight = registry.register(Gauge("http_requests_in_flight", "HTTP requests currently being served.", ("method",)))
+http_requests_rejected_total = registry.register(Counter("http_requests_rejected_total", "Requests turned away by rate limiting or admission control.", ("route", "reason")))
+admission_in_progress = registry.register(Gauge("admission_in_progress", "Admission-controlled requests currently running."))
+admission_queue_depth = registry.register(Gauge("admission_queue_depth", "Admission-controlled requests waiting for a slot."))
+http_request_db_queries = registry.register(Histogram("http_request_db_queries", "DB statements executed per HTTP request.", ("route",), QUERY_COUNT_BUCKETS))
+http_request_db_duration = registry.register(Histogram("http_request_db_duration_seconds", "Time spent in DB statements per HTTP request.", ("route",)))
+db_queries_total = registry.register(Counter("db_queries_total", "DB statements executed.", ("engine",)))
+db_query_duration = registry.register(Histogram("db_query_duration_seconds", "DB statement latency.", ("engine",)))
+refresh_phase_duration = registry.register(Histogram("refresh_phase_duration_seconds", "Time spent in each refresh phase.", ("phase",), REFRESH_BUCKETS))
+refresh_runs_total = registry.register(Counter("refresh_runs_total", "Finished refresh jobs by outcome.", ("mode", "outcome")))
+refresh_rows_total = registry.register(Counter("refresh_rows_total", "Countries touched by refreshes, by kind of change.", ("change",)))
+refresh_in_progress = registry.register(Gauge("refresh_in_progress", "1 while a refresh job is running."))
+
+
+def method_label(method: str) -> str:
+    return method if method in _HTTP_METHODS else "OTHER"
+
+
+def route_label(scope) -> str:
+    """Route template (e.g. /countries/{name}) so label cardinality stays bounded."""
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+def start_request() -> List[float]:
+    """Begin per-request DB accounting for the current context."""
+    usage = [0, 0.0]
+    _db_usage.set(usage)
+    return usage
+
+
+def stop_db_tracking() -> None:
+    """Detach the current context (e.g. a background job) from the request that spawned it."""
+    _db_usage.set(None)
+
+
+def record_request(method: str, route: str, status: int, elapsed: float, usage: List[float]) -> None:
+    http_requests_total.inc(method, route, str(status))
+    http_request_duration.observe(elapsed, method, route)
+    http_request_db_queries.observe(usage[0], route)
+    if usage[0]:
+        http_request_db_duration.observe(usage[1], route)
+
+
+@contextmanager
+def phase_timer(phase: str):
+    """Record the duration of the ``with`` block as a refresh phase."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        refresh_phase_duration.observe(time.perf_counter() - started, phase)
+
+
+def instrument_engine(engine: AsyncEngine, label: str) -> None:
+    """Count and time every statement the engine sends to the database."""
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        db_queries_total.inc(label)
+        db_query_duration.observe(elapsed, label)
+        usage = _db_usage.get()
+        if usage is not None:
+            usage[0] += 1
+            usage[1] += elapsed
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _error(context):
+        # after_cursor_execute does not fire for failed statements
+        started = context.connection.info.get("query_started") if context.connection is not None else None
+        if started:
+            started.pop()
+
+
+def cache_metrics(caches: Dict[str, object]) -> List[_Metric]:
+    """Hit/miss counters and hit ratio for objects exposing ``hits`` and ``misses``."""
+    hits = Counter("cache_hits_total", "Cache hits.", ("cache",))
+    misses = Counter("cache_misses_total", "Cache misses.", ("cache",))
+    ratio = Gauge("cache_hit_ratio", "Cache hits / lookups since startup.", ("cache",))
+    for name, cache in caches.items():
+        hits.inc(name, amount=cache.hits)
+        misses.inc(name, amount=cache.misses)
+        total = cache.hits + cache.misses
+        ratio.set(cache.hits / total if total else 0.0, name)
+    return [hits, misses, ratio]
@@ -1,7 +1,10 @@
 import time
 import uuid
-from fastapi import FastAPI, Request, HTTPException
-from logger import get_logger
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from logger import access_logger, get_logger, request_id_var, should_log_access
+from metrics import http_requests_in_flight, method_label, record_request, route_label, start_request
+from ratelimit import request_gate
 
 app = FastAPI()
 logger = get_logger(__name__)
@@ -9,43 +12,80 @@ logger = get_logger(__name__)
 @app.middleware("http")
 async def add_request_id_and_process_time(request: Request, call_next):
     # Generate unique request ID
-    request_id = str(uuid.uuid4()).replace('-', '')[:10]
+    request_id = uuid.uuid4().hex[:10]
     
-    # Add request ID to request state for access in route handlers
+    # Add request ID to request state for access in route handlers, and to the
+    # logging context so every record emitted while serving it carries the id
     request.state.request_id = request_id
-    
-    # Log incoming request with ID
-    logger.info(
-        f"Request {request_id}: {request.method} {request.url.path} "
-        f"from {request.client.host if request.client else 'unknown'}"
-    )
+    request_id_var.set(request_id)
     
     # Track processing time
     start_time = time.perf_counter()
+    method = method_label(request.method)
+    db_usage = start_request()
+    http_requests_in_flight.inc(method)
+    client = request.client.host if request.client else None
+    rule = rejection = None
+    slot_handed_off = False
     
     try:
-        response = await call_next(request)
+        # Expensive routes pass the per-client rate limit and the shared
+        # admission queue first; rejected requests never reach the router
+        rule, rejection = await request_gate.admit(request.method, request.url.path, client or "unknown")
+        admitted_at = time.perf_counter()
+        if rejection is not None:
+            response = JSONResponse(
+                status_code=rejection.status,
+                content={"error": rejection.message},
+                headers={"Retry-After": str(rejection.retry_after)},
+            )
+        else:
+            response = await call_next(request)
         process_time = time.perf_counter() - start_time
+        # the router stored the matched route in the shared scope
+        route = rule.route if rejection is not None else route_label(request.scope)
+        record_request(method, route, response.status_code, process_time, db_usage)
         
         # Add headers to response
         response.headers["X-Request-ID"] = request_id
         response.headers["X-Process-Time"] = str(process_time)
         
-        # Log successful response
-        logger.info(
-            f"Request {request_id}: Completed {response.status_code} "
-            f"in {process_time:.4f}s"
-        )
+        # One (sampled) access line per request; %-style args so the message is
+        # only formatted on the log writer thread
+        if should_log_access(response.status_code):
+            access_logger.info(
+                "%s %s %s in %.4fs", request.method, request.url.path, response.status_code, process_time,
+                extra={
+                    "method": request.method,
+                    "path": request.url.path,
+                    "route": route,
+                    "status": response.status_code,
+                    "duration_ms": round(process_time * 1000, 3),
+                    "db_queries": db_usage[0],
+                    "client": client,
+                },
+            )
+        
+        if rule is not None and rejection is None:
+            # the slot stays taken until the body (e.g. a streamed export) is sent
+            response = request_gate.hold_until_sent(response, admitted_at)
+            slot_handed_off = True
         
         return response
         
     except Exception as e:
         process_time = time.perf_counter() - start_time
+        record_request(method, route_label(request.scope), 500, process_time, db_usage)
         
-        # Log error with request ID
-        logger.error(
-            f"Request {request_id}: Error after {process_time:.4f}s - {str(e)}"
+        # Errors are always logged, with the traceback
+        logger.exception(
+            "%s %s failed after %.4fs: %s", request.method, request.url.path, process_time, e,
+            extra={"method": request.method, "path": request.url.path, "duration_ms": round(process_time * 1000, 3)},
         )
         
         # Re-raise the exception to let FastAPI handle it
-        raise 
\ No newline at end of file
+        raise 
+    finally:
+        if rule is not None and rejection is None and not slot_handed_off:
+            request_gate.release(time.perf_counter() - admitted_at)
+        http_requests_in_flight.dec(method)
@@ -1,12 +1,21 @@
-from sqlalchemy import Column, DateTime, Integer, Numeric, String, Float
+from sqlalchemy import Column, DateTime, Integer, Numeric, String, Float, Index, inspect, text
+from sqlalchemy.orm import validates
 from sqlalchemy.sql import func
 from database import Base
 
+
+def normalize_name(name: str) -> str:
+    """Key used for case-insensitive country lookups and upserts."""
+    return name.strip().lower()
+
+
 class Country(Base):
     __tablename__ = 'countries'
 
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     name = Column(String, index=True, nullable=False)
+    # Persisted lower-cased name; unique so refresh can upsert on it.
+    name_normalized = Column(String(255), unique=True, index=True, nullable=True)
     capital = Column(String, nullable=True)
     region = Column(String, index=True, nullable=True)
     population = Column(Integer, nullable=False)
@@ -15,3 +24,87 @@ class Country(Base):
     estimated_gdp = Column(Float, nullable=True)
     flag_url = Column(String, nullable=True)
     last_refreshed_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
+    # Digest of the upstream record the row was last written from; lets an
+    # incremental refresh skip countries whose source data did not change.
+    source_hash = Column(String(64), nullable=True)
+
+    # Composite indexes backing the keyset-paginated sorts of GET /countries
+    # (sort column + id tie-breaker) and the common region + GDP listing.
+    __table_args__ = (
+        Index("ix_countries_name_id", "name", "id"),
+        Index("ix_countries_population_id", "population", "id"),
+        Index("ix_countries_gdp_id", "estimated_gdp", "id"),
+        Index("ix_countries_region_gdp", "region", "estimated_gdp"),
+    )
+
+    @validates("name")
+    def _sync_name_normalized(self, key, value):
+        self.name_normalized = normalize_name(value) if value else None
+        return value
+
+
+class RateHistory(Base):
+    """One exchange rate (per USD) observed by a refresh. Rows are only appended or compacted."""
+    __tablename__ = 'rate_history'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    currency_code = Column(String(8), nullable=False)
+    recorded_at = Column(DateTime(timezone=True), nullable=False)
+    rate = Column(Float, nullable=False)
+    # 0 for rates recorded by a refresh; otherwise the bucket size in seconds
+    # of a row averaging older raw rates (see rate_history.compact_history).
+    resolution = Column(Integer, nullable=False, default=0)
+    # Raw rates averaged into this row (1 for raw rows); lets a late raw rate be
+    # merged into an existing bucket with the right weight.
+    samples = Column(Integer, nullable=False, default=1, server_default=text("1"))
+
+    __table_args__ = (
+        # Covering index: history queries are answered from the index alone.
+        Index("ix_rate_history_currency_time_rate", "currency_code", "recorded_at", "rate"),
+        # Finds raw rows due for downsampling and rows past retention.
+        Index("ix_rate_history_resolution_time", "resolution", "recorded_at"),
+    )
+
+
+class CacheGeneration(Base):
+    """Single row counting writes to countries; polled by workers when COHERENCE_BACKEND=db."""
+    __tablename__ = 'cache_generation'
+
+    id = Column(Integer, primary_key=True)
+    generation = Column(Integer, nullable=False, default=0)
+
+
+def upgrade_schema(connection) -> None:
+    """Add columns introduced after the first release to an existing table.
+
+    ``create_all`` only creates missing tables, so deployments that already
+    have a ``countries`` or ``rate_history`` table need the newer columns added in place.
+    """
+    inspector = inspect(connection)
+    if inspector.has_table(RateHistory.__tablename__):
+        history_columns = {col["name"] for col in inspector.get_columns(RateHistory.__tablename__)}
+        if "samples" not in history_columns:
+            # existing averaged rows count as one sample each; only their weight in later merges is approximate
+            connection.execute(text("ALTER TABLE rate_history ADD COLUMN samples INTEGER NOT NULL DEFAULT 1"))
+    if not inspector.has_table(Country.__tablename__):
+        return
+    columns = {col["name"] for col in inspector.get_columns(Country.__tablename__)}
+    if "name_normalized" not in columns:
+        connection.execute(text("ALTER TABLE countries ADD COLUMN name_normalized VARCHAR(255)"))
+        # Backfill in Python so the keys match normalize_name() exactly
+        # (SQL LOWER() differs between dialects for non-ASCII names).
+        rows = connection.execute(text("SELECT id, name FROM countries")).all()
+        if rows:
+            connection.execute(
+                text("UPDATE countries SET name_normalized = :key WHERE id = :id"),
+                [{"id": row.id, "key": normalize_name(row.name)} for row in rows],
+            )
+        connection.execute(text("CREATE UNIQUE INDEX ix_countries_name_normalized ON countries (name_normalized)"))
+    if "source_hash" not in columns:
+        # NULL never matches, so the next incremental refresh rewrites every row once
+        connection.execute(text("ALTER TABLE countries ADD COLUMN source_hash VARCHAR(64)"))
+
+    existing_indexes = {index["name"] for index in inspector.get_indexes(Country.__tablename__)}
+    for index in Country.__table__.indexes:
+        if index.name not in existing_indexes:
+            index.create(connection, checkfirst=True)
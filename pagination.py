@@ -0,0 +1,100 @@
+import base64
+import json
+from typing import Any, List, Optional, Tuple
+
+from sqlalchemy import and_, or_
+
+from models import Country
+
+# Columns GET /countries can return, in response order.
+COUNTRY_FIELDS = (
+    "id", "name", "capital", "region", "population", "currency_code",
+    "exchange_rate", "estimated_gdp", "flag_url", "last_refreshed_at",
+)
+
+# sort key -> column; every key is available as <key>_asc and <key>_desc.
+# Ties are always broken by id ascending; NULL GDPs sort last in both directions.
+SORT_KEYS = {
+    "name": Country.name,
+    "population": Country.population,
+    "gdp": Country.estimated_gdp,
+}
+SORT_OPTIONS = tuple(f"{key}_{direction}" for key in SORT_KEYS for direction in ("asc", "desc"))
+# list dict key holding each sort key's value
+SORT_FIELDS = {"name": "name", "population": "population", "gdp": "estimated_gdp"}
+
+
+class PaginationError(ValueError):
+    """Invalid fields/sort/cursor combination; reported to the client as 400."""
+
+    def __init__(self, field: str, message: str):
+        super().__init__(message)
+        self.field = field
+
+
+def parse_sort(sort: Optional[str]) -> Optional[Tuple[str, bool]]:
+    """'gdp_desc' -> ('gdp', True); None keeps primary-key order."""
+    if not sort:
+        return None
+    if sort not in SORT_OPTIONS:
+        raise PaginationError("sort", f"must be one of: {', '.join(SORT_OPTIONS)}")
+    key, direction = sort.rsplit("_", 1)
+    return key, direction == "desc"
+
+
+def parse_fields(fields: Optional[str]) -> Tuple[str, ...]:
+    if not fields:
+        return COUNTRY_FIELDS
+    requested = {name.strip() for name in fields.split(",") if name.strip()}
+    unknown = requested.difference(COUNTRY_FIELDS)
+    if unknown:
+        raise PaginationError("fields", f"unknown field(s): {', '.join(sorted(unknown))}")
+    return tuple(name for name in COUNTRY_FIELDS if name in requested)
+
+
+def encode_cursor(sort: Optional[str], value: Any, last_id: int) -> str:
+    raw = json.dumps([sort or "", value, last_id], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: Optional[str]) -> Tuple[Any, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        cursor_sort, value, last_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (ValueError, TypeError):
+        raise PaginationError("cursor", "malformed cursor")
+    if cursor_sort != (sort or "") or not isinstance(last_id, int):
+        raise PaginationError("cursor", "cursor does not match the requested sort")
+    return value, last_id
+
+
+def order_by_clauses(sort: Optional[str]) -> List[Any]:
+    parsed = parse_sort(sort)
+    if parsed is None:
+        return [Country.id.asc()]
+    key, descending = parsed
+    column = SORT_KEYS[key]
+    if descending:
+        # NULL is the lowest value in SQLite and MySQL, so DESC already puts it last
+        return [column.desc(), Country.id.asc()]
+    clauses = [column.asc(), Country.id.asc()]
+    if key == "gdp":
+        clauses.insert(0, column.is_(None))
+    return clauses
+
+
+def keyset_condition(sort: Optional[str], value: Any, last_id: int):
+    """WHERE clause selecting the rows strictly after (value, last_id) in sort order."""
+    parsed = parse_sort(sort)
+    if parsed is None:
+        return Country.id > last_id
+    key, descending = parsed
+    column = SORT_KEYS[key]
+    if value is None:
+        # already inside the trailing NULL block: only later NULLs remain
+        return and_(column.is_(None), Country.id > last_id)
+    after = column < value if descending else column > value
+    condition = or_(after, and_(column == value, Country.id > last_id))
+    if key == "gdp":
+        condition = or_(condition, column.is_(None))
+    return condition
@@ -0,0 +1,210 @@
+import math
+import os
+import re
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, distinct, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import env_bool
+from logger import get_logger
+from models import RateHistory
+from timeutil import as_utc, iso_utc
+
+logger = get_logger(__name__)
+
+RATE_HISTORY_ENABLED = env_bool("RATE_HISTORY_ENABLED", True)
+# Rates younger than this are kept exactly as recorded ...
+RATE_HISTORY_RAW_DAYS = float(os.getenv("RATE_HISTORY_RAW_DAYS", "7"))
+# ... older ones are averaged into one row per currency and bucket of this many seconds.
+RATE_HISTORY_DOWNSAMPLE_SECONDS = int(os.getenv("RATE_HISTORY_DOWNSAMPLE_SECONDS", "3600"))
+# Rows older than this are deleted; 0 keeps them forever.
+RATE_HISTORY_RETENTION_DAYS = float(os.getenv("RATE_HISTORY_RETENTION_DAYS", "365"))
+# Largest number of points one history request may ask for (range / step).
+RATE_HISTORY_MAX_POINTS = int(os.getenv("RATE_HISTORY_MAX_POINTS", "5000"))
+RATE_HISTORY_DEFAULT_DAYS = 30
+RATE_HISTORY_DEFAULT_STEP = 3600
+
+_INSERT_BATCH_SIZE = 1000
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_STEP_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+_STEP_PATTERN = re.compile(r"^(\d+)([smhdw]?)$")
+
+class HistoryQueryError(ValueError):
+    """Invalid from/to/step; reported to the client as 400."""
+
+    def __init__(self, field: str, message: str):
+        super().__init__(message)
+        self.field = field
+
+
+def bucket_start(value: datetime, step: int) -> datetime:
+    """Start of the epoch-aligned ``step``-second bucket containing ``value``."""
+    width = timedelta(seconds=step)
+    return _EPOCH + (as_utc(value) - _EPOCH) // width * width
+
+
+async def record_rates(session: AsyncSession, rate_table: Dict[str, Optional[float]], recorded_at: datetime) -> int:
+    """Append one row per usable rate. Runs inside the refresh transaction; returns the rows written."""
+    rows = [
+        {"currency_code": code, "recorded_at": recorded_at, "rate": rate, "resolution": 0}
+        for code, rate in rate_table.items()
+        if rate is not None and math.isfinite(rate) and isinstance(code, str) and 0 < len(code) <= 8
+    ]
+    for start in range(0, len(rows), _INSERT_BATCH_SIZE):
+        await session.execute(insert(RateHistory.__table__), rows[start:start + _INSERT_BATCH_SIZE])
+    return len(rows)
+
+
+async def _compaction_due(session: AsyncSession, cutoff: datetime, expired: Optional[datetime]) -> bool:
+    """
+    Whether compact_history has anything to do, read from the table itself:
+    a raw rate before ``cutoff`` or a row past retention. Each probe is a
+    LIMIT 1 range scan on the (resolution, recorded_at) index, so the check
+    is cheap enough to run after every refresh, in every worker.
+    """
+    resolutions = (await session.execute(select(distinct(RateHistory.resolution)))).scalars().all()
+    for resolution in resolutions:
+        limit = cutoff if resolution == 0 else expired
+        if limit is None:
+            continue
+        probe = select(RateHistory.id).where(RateHistory.resolution == resolution, RateHistory.recorded_at < limit).limit(1)
+        if (await session.execute(probe)).first() is not None:
+            return True
+    return False
+
+
+async def compact_history(session: AsyncSession, now: Optional[datetime] = None) -> Tuple[int, int]:
+    """
+    Apply the retention policy: average raw rates older than
+    RATE_HISTORY_RAW_DAYS into one row per currency and bucket, and delete
+    rows older than RATE_HISTORY_RETENTION_DAYS. Raw rates that arrive for
+    a bucket that was already averaged (e.g. from a snapshot import) are
+    merged into its row, weighted by ``samples``, so a bucket never has two
+    rows. All statements are range scans on the (resolution, recorded_at)
+    index. Commits on success and returns (rows compacted, rows deleted).
+    """
+    now = now or datetime.now(timezone.utc)
+    step = RATE_HISTORY_DOWNSAMPLE_SECONDS
+    # whole buckets only, so a bucket being recorded into is never averaged
+    cutoff = bucket_start(now - timedelta(days=RATE_HISTORY_RAW_DAYS), step)
+    expired = now - timedelta(days=RATE_HISTORY_RETENTION_DAYS) if RATE_HISTORY_RETENTION_DAYS > 0 else None
+
+    try:
+        if not await _compaction_due(session, cutoff, expired):
+            return 0, 0
+        raw = await session.execute(
+            select(RateHistory.currency_code, RateHistory.recorded_at, RateHistory.rate)
+            .where(RateHistory.resolution == 0, RateHistory.recorded_at < cutoff)
+        )
+        buckets: Dict[Tuple[str, datetime], List[float]] = {}
+        compacted = 0
+        for code, recorded_at, rate in raw:
+            totals = buckets.setdefault((code, bucket_start(recorded_at, step)), [0.0, 0])
+            totals[0] += rate
+            totals[1] += 1
+            compacted += 1
+
+        merged = []
+        if buckets:
+            # averaged rows already covering some of these buckets; normally only the newest one or none
+            earliest = min(start for _, start in buckets)
+            existing = await session.execute(
+                select(RateHistory.id, RateHistory.currency_code, RateHistory.recorded_at, RateHistory.rate, RateHistory.samples)
+                .where(RateHistory.resolution == step, RateHistory.recorded_at >= earliest, RateHistory.recorded_at < cutoff)
+            )
+            for row in existing:
+                totals = buckets.pop((row.currency_code, as_utc(row.recorded_at)), None)
+                if totals is not None:
+                    samples = row.samples + totals[1]
+                    merged.append({"id": row.id, "rate": (row.rate * row.samples + totals[0]) / samples, "samples": samples})
+        averaged = [
+            {"currency_code": code, "recorded_at": start, "rate": total / count, "resolution": step, "samples": count}
+            for (code, start), (total, count) in buckets.items()
+        ]
+        for start in range(0, len(averaged), _INSERT_BATCH_SIZE):
+            await session.execute(insert(RateHistory.__table__), averaged[start:start + _INSERT_BATCH_SIZE])
+        for start in range(0, len(merged), _INSERT_BATCH_SIZE):
+            await session.execute(update(RateHistory), merged[start:start + _INSERT_BATCH_SIZE])
+        if compacted:
+            await session.execute(delete(RateHistory).where(RateHistory.resolution == 0, RateHistory.recorded_at < cutoff))
+
+        deleted = 0
+        if expired is not None:
+            # per resolution, so each delete stays a range scan on the index
+            resolutions = (await session.execute(select(distinct(RateHistory.resolution)))).scalars().all()
+            for resolution in resolutions:
+                result = await session.execute(
+                    delete(RateHistory).where(RateHistory.resolution == resolution, RateHistory.recorded_at < expired)
+                )
+                deleted += result.rowcount or 0
+        await session.commit()
+    except Exception:
+        await session.rollback()
+        raise
+    if compacted or deleted:
+        logger.info(
+            f"Rate history: {compacted} raw rates averaged into {len(averaged)} new and {len(merged)} existing rows, "
+            f"{deleted} expired rows deleted"
+        )
+    return compacted, deleted
+
+
+def parse_step(value: Optional[str]) -> int:
+    """'3600', '15m', '1h', '1d' or '1w' -> seconds."""
+    if not value:
+        return RATE_HISTORY_DEFAULT_STEP
+    match = _STEP_PATTERN.match(value.strip().lower())
+    if not match or int(match.group(1)) == 0:
+        raise HistoryQueryError("step", "must be a positive number of seconds or a duration like 15m, 1h, 1d")
+    return int(match.group(1)) * _STEP_UNITS[match.group(2) or "s"]
+
+
+def parse_time(field: str, value: Optional[str], default: datetime) -> datetime:
+    if not value:
+        return default
+    try:
+        return as_utc(datetime.fromisoformat(value.strip().replace("Z", "+00:00")))
+    except ValueError:
+        raise HistoryQueryError(field, "must be an ISO 8601 timestamp, e.g. 2025-10-22T18:00:00Z")
+
+
+async def query_history(session: AsyncSession, currency: str, start: datetime, end: datetime, step: int) -> List[Dict[str, Any]]:
+    """
+    Points for ``currency`` in [start, end), one per ``step``-second bucket
+    that has data, with the average, min, max and last stored rate. The
+    rows are read in index order from the covering index, so buckets are
+    aggregated in a single pass without touching the table.
+    """
+    result = await session.execute(
+        select(RateHistory.recorded_at, RateHistory.rate)
+        .where(RateHistory.currency_code == currency, RateHistory.recorded_at >= start, RateHistory.recorded_at < end)
+        .order_by(RateHistory.recorded_at)
+    )
+    points: List[Dict[str, Any]] = []
+    current = None
+    total = 0.0
+    for recorded_at, rate in result:
+        bucket = bucket_start(recorded_at, step)
+        if current is None or current["t"] != bucket:
+            if current is not None:
+                current["rate"] = total / current["samples"]
+            current = {"t": bucket, "rate": None, "min": rate, "max": rate, "last": rate, "samples": 0}
+            points.append(current)
+            total = 0.0
+        total += rate
+        current["samples"] += 1
+        current["min"] = min(current["min"], rate)
+        current["max"] = max(current["max"], rate)
+        current["last"] = rate
+    if current is not None:
+        current["rate"] = total / current["samples"]
+    for point in points:
+        point["t"] = iso_utc(point["t"])
+    return points
+
+
+async def has_history(session: AsyncSession, currency: str) -> bool:
+    result = await session.execute(select(RateHistory.id).where(RateHistory.currency_code == currency).limit(1))
+    return result.first() is not None
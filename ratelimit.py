@@ -0,0 +1,250 @@
+"""
+Rate limiting and admission control for the expensive endpoints.
+
+Two checks run in the request middleware before routing, for the routes
+listed in RATE_LIMITS only; everything else passes straight through.
+
+- A token bucket per (client IP, route): ``N/period`` allows bursts of N
+  and refills N tokens per period. Buckets live in an LRU-ordered dict of
+  at most RATE_LIMIT_MAX_CLIENTS entries, so memory stays bounded however
+  many clients show up. An empty bucket answers 429 with ``Retry-After``.
+- A shared concurrency limit: at most ADMISSION_MAX_CONCURRENCY of these
+  requests run at once and ADMISSION_MAX_QUEUE more wait for a slot. Past
+  that, or after waiting ADMISSION_QUEUE_TIMEOUT, the request is shed with
+  503 and ``Retry-After``; the token it took is refunded. An admitted
+  request keeps its slot until its response body is fully sent, so
+  streamed exports count for their whole duration. Cheap reads never queue
+  here, so their latency does not depend on how hard someone hammers refresh.
+
+All state is per process; with several workers each enforces its own limits.
+"""
+import asyncio
+import math
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from starlette.routing import compile_path
+
+from database import env_bool
+from logger import get_logger
+from metrics import admission_in_progress, admission_queue_depth, http_requests_rejected_total
+
+logger = get_logger(__name__)
+
+RATE_LIMIT_ENABLED = env_bool("RATE_LIMIT_ENABLED", True)
+# "METHOD /route/template=N/period" entries separated by commas; period is seconds or e.g. 30s, 1m, 1h.
+RATE_LIMITS = os.getenv(
+    "RATE_LIMITS",
+    "POST /countries/refresh=5/1m, DELETE /countries/{name}=30/1m, GET /countries/export=10/1m, POST /admin/snapshot=2/1m",
+)
+# Per-client buckets kept; the least recently seen client is evicted first.
+RATE_LIMIT_MAX_CLIENTS = int(os.getenv("RATE_LIMIT_MAX_CLIENTS", "10000"))
+ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", "4"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "16"))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10"))
+
+_PERIOD_UNITS = {"s": 1, "m": 60, "h": 3600}
+_RULE_PATTERN = re.compile(r"^\s*([A-Z]+)\s+(/\S*)\s*=\s*(\d+)\s*/\s*(\d+(?:\.\d+)?)\s*([smh]?)\s*$")
+# Weight of the newest sample in the running average of request durations.
+_EWMA_WEIGHT = 0.2
+
+
+class RateRule:
+    """Token-bucket limit for one route: ``capacity`` burst, ``rate`` tokens per second."""
+
+    __slots__ = ("method", "route", "regex", "capacity", "rate")
+
+    def __init__(self, method: str, route: str, capacity: int, period: float):
+        self.method = method
+        self.route = route
+        self.regex = compile_path(route)[0]
+        self.capacity = float(capacity)
+        self.rate = capacity / period
+
+
+def parse_rules(spec: str) -> List[RateRule]:
+    rules = []
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        match = _RULE_PATTERN.match(entry)
+        if not match or int(match.group(3)) == 0 or float(match.group(4)) == 0:
+            logger.warning(f"Ignoring invalid RATE_LIMITS entry {entry!r}; expected e.g. 'POST /countries/refresh=5/1m'")
+            continue
+        method, route, count, period, unit = match.groups()
+        rules.append(RateRule(method, route, int(count), float(period) * _PERIOD_UNITS[unit or "s"]))
+    return rules
+
+
+class Rejection:
+    """Why a request was turned away; rendered by the middleware."""
+
+    __slots__ = ("status", "reason", "retry_after")
+
+    def __init__(self, status: int, reason: str, retry_after: float):
+        self.status = status
+        self.reason = reason
+        # whole seconds, at least 1, as Retry-After requires
+        self.retry_after = max(1, math.ceil(retry_after))
+
+    @property
+    def message(self) -> str:
+        return "Too many requests" if self.status == 429 else "Server busy, try again later"
+
+
+class RateLimiter:
+    """Token buckets keyed by (client, route) in a bounded LRU."""
+
+    def __init__(self, max_clients: int = RATE_LIMIT_MAX_CLIENTS):
+        self.max_clients = max_clients
+        # (client, route) -> [tokens, last update (monotonic)]
+        self._buckets: "OrderedDict[Tuple[str, str], List[float]]" = OrderedDict()
+
+    def acquire(self, client: str, rule: RateRule) -> Optional[float]:
+        """Take a token; None when allowed, otherwise seconds until one is available."""
+        now = time.monotonic()
+        key = (client, rule.route)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [rule.capacity, now]
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(rule.capacity, bucket[0] + (now - bucket[1]) * rule.rate)
+            bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return None
+        return (1 - bucket[0]) / rule.rate
+
+    def refund(self, client: str, rule: RateRule) -> None:
+        """Give back a token taken by a request that was then shed without running."""
+        bucket = self._buckets.get((client, rule.route))
+        if bucket is not None:
+            bucket[0] = min(rule.capacity, bucket[0] + 1)
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class AdmissionController:
+    """Bounded concurrency with a bounded wait queue for the limited routes."""
+
+    def __init__(self, max_concurrency: int = ADMISSION_MAX_CONCURRENCY, max_queue: int = ADMISSION_MAX_QUEUE, timeout: float = ADMISSION_QUEUE_TIMEOUT):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.active = 0
+        self.waiting = 0
+        # running average of how long an admitted request holds its slot
+        self._avg_seconds = 1.0
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def _retry_after(self) -> float:
+        # time for the queue ahead to drain at the current concurrency
+        return self._avg_seconds * (self.waiting + 1) / self.max_concurrency
+
+    async def enter(self) -> Optional[Rejection]:
+        if self.max_concurrency <= 0:
+            return None
+        if self._semaphore is None:
+            # created lazily so it binds to the running loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        if self._semaphore.locked():
+            if self.waiting >= self.max_queue:
+                return Rejection(503, "queue_full", self._retry_after())
+            self.waiting += 1
+            admission_queue_depth.inc()
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=self.timeout)
+            except asyncio.TimeoutError:
+                return Rejection(503, "queue_timeout", self._retry_after())
+            finally:
+                self.waiting -= 1
+                admission_queue_depth.dec()
+        else:
+            await self._semaphore.acquire()
+        self.active += 1
+        admission_in_progress.inc()
+        return None
+
+    def exit(self, elapsed: float) -> None:
+        if self.max_concurrency <= 0:
+            return
+        self.active -= 1
+        admission_in_progress.dec()
+        self._avg_seconds += _EWMA_WEIGHT * (elapsed - self._avg_seconds)
+        self._semaphore.release()
+
+
+class RequestGate:
+    """
+    Rate limiter plus admission control, applied to the routes in RATE_LIMITS.
+
+    ``admit`` returns the matched rule and a rejection (or None). When the
+    request was admitted the caller must call ``release`` once it finishes.
+    """
+
+    def __init__(self, rules: List[RateRule], limiter: RateLimiter, admission: AdmissionController, enabled: bool = RATE_LIMIT_ENABLED):
+        self.enabled = enabled and bool(rules)
+        self.limiter = limiter
+        self.admission = admission
+        # a few rules per method, so matching is a handful of regex checks at most
+        self._rules: Dict[str, List[RateRule]] = {}
+        for rule in rules:
+            self._rules.setdefault(rule.method, []).append(rule)
+
+    def match(self, method: str, path: str) -> Optional[RateRule]:
+        for rule in self._rules.get(method, ()):
+            if rule.regex.match(path):
+                return rule
+        return None
+
+    async def admit(self, method: str, path: str, client: str) -> Tuple[Optional[RateRule], Optional[Rejection]]:
+        if not self.enabled:
+            return None, None
+        rule = self.match(method, path)
+        if rule is None:
+            return None, None
+        wait = self.limiter.acquire(client, rule)
+        if wait is not None:
+            rejection = Rejection(429, "rate_limited", wait)
+        else:
+            rejection = await self.admission.enter()
+            if rejection is not None:
+                # shed for load, not for this client's rate; it may retry after Retry-After
+                self.limiter.refund(client, rule)
+        if rejection is not None:
+            http_requests_rejected_total.inc(rule.route, rejection.reason)
+            logger.warning(f"Rejected {method} {path} from {client}: {rejection.reason}, retry after {rejection.retry_after}s")
+        return rule, rejection
+
+    def release(self, elapsed: float) -> None:
+        self.admission.exit(elapsed)
+
+    def hold_until_sent(self, response, admitted_at: float) -> "_ReleaseAfterSend":
+        """
+        Hand the admission slot to ``response``: it is released once the body
+        has been sent, so a streamed export keeps its slot (and the DB
+        connection it holds) counted until the last byte, not just the headers.
+        """
+        return _ReleaseAfterSend(response, lambda: self.release(time.perf_counter() - admitted_at))
+
+
+class _ReleaseAfterSend:
+    """ASGI wrapper around a response that runs ``release`` after sending it, however that ends."""
+
+    def __init__(self, response, release):
+        self.response = response
+        self._release = release
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await self.response(scope, receive, send)
+        finally:
+            self._release()
+
+
+request_gate = RequestGate(parse_rules(RATE_LIMITS), RateLimiter(), AdmissionController())
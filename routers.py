@@ -1,106 +1,464 @@
-from fastapi import APIRouter, Depends, HTTPException, Query,status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
 from typing import Optional, List
 from sqlalchemy.ext.asyncio import AsyncSession
-from database import get_db
-from models import Country
-from schemas import CountryResponse
-from service import country_service
+from database import get_db, get_read_db, read_session
+from models import Country, normalize_name
+from schemas import CountryBatchRequest, CountryResponse, ConvertRequest
+from scheduler import refresh_scheduler
+from service import REFRESH_MODES, forget_upstream_validators
+from rate_history import (
+    RATE_HISTORY_DEFAULT_DAYS, RATE_HISTORY_MAX_POINTS, HistoryQueryError, has_history, parse_step, parse_time, query_history,
+)
+from snapshot import SnapshotConflict, SnapshotError, decode_snapshot, export_snapshot, import_snapshot
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, registry as metrics_registry
+from summary_image import BASE_WIDTH, SUMMARY_IMAGE_PATH, image_variants, render_summary_png, run_render
+from country_cache import country_cache, row_serializer, serialize_country
+from timeutil import iso_utc
 from logger import get_logger
-from fastapi.responses import FileResponse, JSONResponse
-from sqlalchemy import select, func, desc
-from datetime import datetime
+from pagination import (
+    COUNTRY_FIELDS, SORT_FIELDS, SORT_OPTIONS, PaginationError, decode_cursor,
+    encode_cursor, keyset_condition, order_by_clauses, parse_fields, parse_sort,
+)
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from sqlalchemy import select, func, delete
+from datetime import datetime, timedelta, timezone
+import csv
+import hmac
+import io
+import json
 import os
+import zlib
 
 logger = get_logger(__name__)
 router = APIRouter()
 
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "1000"))
+# Browser/CDN cache lifetime for summary images; clients revalidate with the ETag afterwards.
+IMAGE_CACHE_MAX_AGE = int(os.getenv("IMAGE_CACHE_MAX_AGE", "60"))
+# Rows fetched per round trip from the server-side cursor of GET /countries/export.
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+_ndjson_encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+# Most names + ids per POST /countries/batch and conversions per POST /convert.
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "1000"))
+# /admin endpoints require this in the X-Admin-Token header; unset disables them.
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+# Largest snapshot POST /admin/snapshot accepts.
+ADMIN_SNAPSHOT_MAX_BYTES = int(os.getenv("ADMIN_SNAPSHOT_MAX_BYTES", str(256 * 1024 * 1024)))
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match uses weak comparison, so a W/ prefix from a proxy still matches
+    candidates = (tag.strip() for tag in if_none_match.split(","))
+    return any((tag[2:] if tag.startswith("W/") else tag) == etag for tag in candidates)
+
+
+def _cached_json_response(request: Request, body: bytes, etag: str, media_type: str = "application/json", cache_control: str = "no-cache") -> Response:
+    """Serve pre-serialized bytes, or 304 when the client already has this version."""
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type=media_type, headers=headers)
+
 
 @router.post("/countries/refresh",status_code=status.HTTP_201_CREATED)
-async def refresh_countries(db: AsyncSession = Depends(get_db)):
-    try:
-        refresh_time = await country_service.refresh_countries(db)
-        return {"message": "Refresh completed", "last_refreshed_at": refresh_time.isoformat() + "Z"}
-    except Exception as e:
+async def refresh_countries(
+    run_async: bool = Query(False, alias="async", description="Return 202 with a job id instead of waiting for the refresh"),
+    mode: Optional[str] = Query(None, description=f"One of: {', '.join(REFRESH_MODES)}; defaults to REFRESH_MODE"),
+    prune: Optional[bool] = Query(None, description="Delete stored countries missing upstream; defaults to REFRESH_PRUNE"),
+):
+    if mode is not None and mode not in REFRESH_MODES:
+        return JSONResponse(status_code=400, content={"error": "Validation failed", "details": {"mode": f"must be one of: {', '.join(REFRESH_MODES)}"}})
+    # joins the refresh already in progress, if any
+    job = refresh_scheduler.submit(mode=mode, prune=prune)
+    if run_async:
+        return JSONResponse(status_code=202, content={
+            "message": "Refresh accepted",
+            "job_id": job.id,
+            "status": job.status,
+            "status_url": f"/countries/refresh/{job.id}",
+        })
+    await refresh_scheduler.wait(job)
+    if job.status == "failed":
         # Distinguish external API fetch errors
-        msg = str(e)
+        msg = job.error or ""
         logger.error(f"Refresh failed: {msg}")
         return JSONResponse(status_code=503, content={"error": "External data source unavailable", "details": msg})
+    return {
+        "message": "Refresh completed",
+        "last_refreshed_at": iso_utc(job.last_refreshed_at),
+        "mode": job.result.mode,
+        "skipped": job.result.skipped,
+        "changes": job.result.counts(),
+    }
+
+
+@router.get("/countries/refresh/{job_id}")
+async def get_refresh_job(job_id: str):
+    job = refresh_scheduler.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": "Refresh job not found"})
+    return job.to_dict()
 
 
 @router.get("/countries",status_code=status.HTTP_200_OK)
-async def list_countries(region: Optional[str] = Query(None), currency: Optional[str] = Query(None), sort: Optional[str] = Query(None), db: AsyncSession = Depends(get_db)):
+async def list_countries(
+    request: Request,
+    region: Optional[str] = Query(None),
+    currency: Optional[str] = Query(None),
+    sort: Optional[str] = Query(None, description=f"One of: {', '.join(SORT_OPTIONS)}"),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="Page size; the next page's cursor is returned in X-Next-Cursor"),
+    cursor: Optional[str] = Query(None, description="Value of X-Next-Cursor from the previous page"),
+    fields: Optional[str] = Query(None, description="Comma-separated columns to return, e.g. name,population"),
+    db: AsyncSession = Depends(get_read_db),
+):
     try:
+        if limit is not None or cursor is not None or fields is not None:
+            try:
+                return await _list_countries_page(db, region, currency, sort, limit, cursor, fields)
+            except PaginationError as e:
+                return JSONResponse(status_code=400, content={"error": "Validation failed", "details": {e.field: str(e)}})
+
+        snapshot = await country_cache.get(db)
+        if snapshot is not None:
+            body, etag = snapshot.list_body(region, currency, sort)
+            return _cached_json_response(request, body, etag)
+
         stmt = select(Country)
         if region:
             stmt = stmt.where(Country.region == region)
         if currency:
             stmt = stmt.where(Country.currency_code == currency)
-        if sort == "gdp_desc":
-            stmt = stmt.order_by(Country.estimated_gdp.desc().nulls_last())
+        if sort in SORT_OPTIONS:
+            stmt = stmt.order_by(*order_by_clauses(sort))
         result = await db.execute(stmt)
         countries = result.scalars().all()
         # Build explicit JSON structure to match required response format and avoid Pydantic output validation issues.
-        output = []
-        for c in countries:
-            last_iso = None
-            if getattr(c, "last_refreshed_at", None):
-                try:
-                    last_iso = c.last_refreshed_at.isoformat().replace("+00:00", "Z")
-                except Exception:
-                    last_iso = str(c.last_refreshed_at)
-
-            output.append({
-                "id": c.id,
-                "name": c.name,
-                "capital": c.capital,
-                "region": c.region,
-                "population": c.population,
-                "currency_code": c.currency_code,
-                "exchange_rate": float(c.exchange_rate) if c.exchange_rate is not None else None,
-                "estimated_gdp": float(c.estimated_gdp) if c.estimated_gdp is not None else None,
-                "flag_url": c.flag_url,
-                "last_refreshed_at": last_iso
-            })
-
+        output = [serialize_country(c) for c in countries]
         return output
     except Exception:
         logger.exception("Failed to list countries")
         raise HTTPException(status_code=500, detail={"error": "Internal server error"})
+
+
+async def _list_countries_page(db: AsyncSession, region, currency, sort, limit, cursor, fields):
+    """Keyset-paginated, column-projected variant of GET /countries, queried straight from SQL."""
+    selected = parse_fields(fields)
+    parsed_sort = parse_sort(sort)
+    sort_field = SORT_FIELDS[parsed_sort[0]] if parsed_sort else None
+    # id and the sort column are always read so the next cursor can be built
+    needed = set(selected) | {"id"} | ({sort_field} if sort_field else set())
+    stmt = select(*[Country.__table__.c[name] for name in COUNTRY_FIELDS if name in needed])
+    if region:
+        stmt = stmt.where(Country.region == region)
+    if currency:
+        stmt = stmt.where(Country.currency_code == currency)
+    if cursor:
+        value, last_id = decode_cursor(cursor, sort)
+        stmt = stmt.where(keyset_condition(sort, value, last_id))
+    stmt = stmt.order_by(*order_by_clauses(sort))
+    if limit is not None:
+        stmt = stmt.limit(limit + 1)
+    rows = (await db.execute(stmt)).all()
+
+    headers = {}
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        headers["X-Next-Cursor"] = encode_cursor(sort, getattr(last, sort_field) if sort_field else None, last.id)
+    return JSONResponse(content=[serialize_country(row, selected) for row in rows], headers=headers)
+
+
 @router.get("/countries/image")
-async def get_summary_image():
-    path = os.path.join("cache", "summary.png")
-    if not os.path.exists(path):
-        logger.info("Summary image not found at %s", path)
-        return JSONResponse(status_code=404, content={"error": "Summary image not found"})
-    return FileResponse(path, media_type="image/png")
+async def get_summary_image(
+    request: Request,
+    width: Optional[int] = Query(None, ge=200, le=2400, description="Image width in pixels; height scales with it"),
+    top: Optional[int] = Query(None, ge=1, le=50, description="Number of countries in the GDP ranking"),
+    region: Optional[str] = Query(None, description="Only rank and count countries in this region"),
+    db: AsyncSession = Depends(get_read_db),
+):
+    if width is None and top is None and not region:
+        path = SUMMARY_IMAGE_PATH
+        if not path.exists():
+            logger.info("Summary image not found at %s", path)
+            return JSONResponse(status_code=404, content={"error": "Summary image not found"})
+        # FileResponse adds an ETag/Last-Modified pair derived from the file's mtime and size
+        return FileResponse(path, media_type="image/png", headers={"Cache-Control": f"public, max-age={IMAGE_CACHE_MAX_AGE}"})
+
+    width = width or BASE_WIDTH
+    top = top or 5
+    snapshot = await country_cache.get(db)
+    aggregates = country_cache.aggregates
+    data = aggregates.image_data(top, region) if aggregates is not None else None
+    if data is not None:
+        generation = aggregates.generation
+        total, ranked, refreshed = data
+    elif snapshot is None:
+        generation = country_cache.generation
+        total, ranked, refreshed = await _image_data_from_db(db, top, region)
+    else:
+        generation = snapshot.generation
+        rows = snapshot.select(region=region, sort="gdp_desc")
+        total = len(rows)
+        ranked = [(row["name"], row["estimated_gdp"]) for row in rows if row["estimated_gdp"] is not None][:top]
+        refreshed = max((row["last_refreshed_at"] for row in rows if row["last_refreshed_at"]), default=None)
+    if total == 0 and region:
+        return JSONResponse(status_code=404, content={"error": "No countries found for region"})
+
+    title = f"Countries Summary — {region}" if region else "Countries Summary"
+    key = (generation, width, top, region)
+    png = await image_variants.get_or_render(
+        key, lambda: run_render(render_summary_png, total, ranked, refreshed or "never", top_n=top, width=width, title=title)
+    )
+    if snapshot is not None:
+        etag = f'"{snapshot.tag}-i{zlib.crc32(repr(key[1:]).encode("utf-8")):08x}"'
+    else:
+        etag = f'"i{zlib.crc32(png):08x}"'
+    return _cached_json_response(request, png, etag, media_type="image/png", cache_control=f"public, max-age={IMAGE_CACHE_MAX_AGE}")
+
+
+async def _image_data_from_db(db: AsyncSession, top: int, region: Optional[str]):
+    count_stmt = select(func.count(Country.id), func.max(Country.last_refreshed_at))
+    top_stmt = select(Country.name, Country.estimated_gdp).where(Country.estimated_gdp != None).order_by(Country.estimated_gdp.desc()).limit(top)
+    if region:
+        count_stmt = count_stmt.where(Country.region == region)
+        top_stmt = top_stmt.where(Country.region == region)
+    total, last = (await db.execute(count_stmt)).one()
+    ranked = [(row.name, row.estimated_gdp) for row in await db.execute(top_stmt)]
+    return total or 0, ranked, iso_utc(last)
+
+
+@router.get("/countries/export")
+async def export_countries(
+    region: Optional[str] = Query(None),
+    currency: Optional[str] = Query(None),
+    sort: Optional[str] = Query(None, description=f"One of: {', '.join(SORT_OPTIONS)}"),
+    fields: Optional[str] = Query(None, description="Comma-separated columns to export, e.g. name,population"),
+    format: str = Query("ndjson", description="ndjson or csv"),
+    gzip: bool = Query(False, description="Compress the stream (Content-Encoding: gzip)"),
+):
+    """
+    Full dataset as NDJSON or CSV, streamed from a server-side cursor in
+    EXPORT_BATCH_SIZE batches so memory stays flat and the first rows go out
+    before the last ones are read.
+    """
+    if format not in EXPORT_FORMATS:
+        return JSONResponse(status_code=400, content={"error": "Validation failed", "details": {"format": f"must be one of: {', '.join(EXPORT_FORMATS)}"}})
+    try:
+        selected = parse_fields(fields)
+        parse_sort(sort)
+    except PaginationError as e:
+        return JSONResponse(status_code=400, content={"error": "Validation failed", "details": {e.field: str(e)}})
+
+    stmt = select(*[Country.__table__.c[name] for name in selected])
+    if region:
+        stmt = stmt.where(Country.region == region)
+    if currency:
+        stmt = stmt.where(Country.currency_code == currency)
+    stmt = stmt.order_by(*order_by_clauses(sort)).execution_options(yield_per=EXPORT_BATCH_SIZE)
+
+    # gzip is a transfer encoding here: clients decompress it, so the saved file is plain
+    headers = {"Content-Disposition": f'attachment; filename="countries.{format}"'}
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(_export_stream(stmt, selected, format, gzip), media_type=EXPORT_FORMATS[format], headers=headers)
+
+
+async def _export_stream(stmt, selected, format: str, compress: bool):
+    # The response outlives the request's dependencies, so the generator owns its session.
+    compressor = zlib.compressobj(wbits=31) if compress else None
+
+    def emit(chunk: bytes) -> bytes:
+        # sync-flush each batch so compressed output keeps pace with the rows
+        return compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH) if compressor else chunk
+
+    serialize = row_serializer(selected)
+    try:
+        async with read_session() as session:
+            result = await session.stream(stmt)
+            if format == "csv":
+                buffer = io.StringIO()
+                writer = csv.writer(buffer, lineterminator="\n")
+                writer.writerow(selected)
+            async for batch in result.partitions():
+                if format == "csv":
+                    # csv writes None as an empty field
+                    writer.writerows(serialize(row).values() for row in batch)
+                    chunk = buffer.getvalue().encode("utf-8")
+                    buffer.seek(0)
+                    buffer.truncate()
+                else:
+                    chunk = "".join(_ndjson_encoder.encode(serialize(row)) + "\n" for row in batch).encode("utf-8")
+                yield emit(chunk)
+            if format == "csv" and buffer.tell():
+                # header only: no rows matched
+                yield emit(buffer.getvalue().encode("utf-8"))
+    except Exception:
+        # headers are already sent; the client sees a truncated body
+        logger.exception("Country export failed mid-stream")
+        raise
+    if compressor is not None:
+        yield compressor.flush()
+
+
+@router.post("/countries/batch")
+async def batch_countries(payload: CountryBatchRequest, db: AsyncSession = Depends(get_read_db)):
+    """
+    Several countries in one response, by name (case-insensitive) and/or id.
+    Served from the in-memory snapshot when it is loaded, otherwise with a
+    single indexed IN query.
+    """
+    if len(payload.names) + len(payload.ids) > BATCH_MAX_ITEMS:
+        return JSONResponse(status_code=400, content={"error": "Validation failed", "details": {"names": f"at most {BATCH_MAX_ITEMS} names and ids per request"}})
+    try:
+        snapshot = await country_cache.get(db)
+        if snapshot is not None:
+            countries, missing_names, missing_ids = snapshot.batch(payload.names, payload.ids)
+            not_found = json.dumps({"names": missing_names, "ids": missing_ids}, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            return Response(content=b'{"countries":' + countries + b',"not_found":' + not_found + b"}", media_type="application/json")
+        return await _batch_from_db(db, payload.names, payload.ids)
+    except Exception:
+        logger.exception("Failed to look up country batch")
+        raise HTTPException(status_code=500, detail={"error": "Internal server error"})
+
+
+async def _batch_from_db(db: AsyncSession, names: List[str], ids: List[int]):
+    keys = [normalize_name(name) for name in names]
+    name_index = country_cache.name_index
+    if name_index is not None:
+        # names resolve to ids in memory, so the query is a primary-key IN
+        wanted_ids = set(ids) | {name_index[key] for key in keys if key in name_index}
+        condition = Country.id.in_(wanted_ids)
+    else:
+        condition = Country.name_normalized.in_(set(keys)) | Country.id.in_(set(ids))
+    rows = (await db.execute(select(Country.__table__).where(condition))).all() if keys or ids else []
+    by_key = {row.name_normalized: row for row in rows}
+    by_id = {row.id: row for row in rows}
+
+    seen = set()
+    countries = []
+    missing_names = []
+    missing_ids = []
+    for name, key in zip(names, keys):
+        row = by_key.get(key)
+        if row is None:
+            missing_names.append(name)
+        elif row.id not in seen:
+            seen.add(row.id)
+            countries.append(serialize_country(row))
+    for country_id in ids:
+        row = by_id.get(country_id)
+        if row is None:
+            missing_ids.append(country_id)
+        elif row.id not in seen:
+            seen.add(row.id)
+            countries.append(serialize_country(row))
+    return {"countries": countries, "not_found": {"names": missing_names, "ids": missing_ids}}
+
+
+@router.post("/convert")
+async def convert(payload: ConvertRequest, db: AsyncSession = Depends(get_read_db)):
+    """
+    Convert amounts between stored currencies. Rates are per USD, so the
+    cross rate from A to B is rate(B) / rate(A).
+    """
+    if len(payload.conversions) > BATCH_MAX_ITEMS:
+        return JSONResponse(status_code=400, content={"error": "Validation failed", "details": {"conversions": f"at most {BATCH_MAX_ITEMS} per request"}})
+    try:
+        rates = await country_cache.get_rates(db)
+    except Exception:
+        logger.exception("Failed to load exchange rates")
+        raise HTTPException(status_code=500, detail={"error": "Internal server error"})
+    if rates is None:
+        return JSONResponse(status_code=503, content={"error": "Exchange rates are being reloaded"}, headers={"Retry-After": "1"})
+
+    results = []
+    for item in payload.conversions:
+        source = item.from_currency.strip().upper()
+        target = item.to_currency.strip().upper()
+        # the upstream rates are quoted against USD
+        source_rate = 1.0 if source == "USD" else rates.get(source)
+        target_rate = 1.0 if target == "USD" else rates.get(target)
+        entry = {"from": source, "to": target, "amount": item.amount, "converted": None, "rate": None}
+        unknown = [code for code, rate in ((source, source_rate), (target, target_rate)) if rate is None]
+        if unknown:
+            entry["error"] = f"No stored exchange rate for {', '.join(dict.fromkeys(unknown))}"
+        else:
+            entry["rate"] = target_rate / source_rate
+            entry["converted"] = item.amount * entry["rate"]
+        results.append(entry)
+    return {"results": results}
+
+
+@router.get("/countries/stats")
+async def country_stats(request: Request, db: AsyncSession = Depends(get_read_db)):
+    """Totals, per-region and per-currency breakdowns and GDP rankings, precomputed per cache generation."""
+    try:
+        aggregates = await country_cache.get_aggregates(db)
+    except Exception:
+        logger.exception("Failed to load country stats")
+        raise HTTPException(status_code=500, detail={"error": "Internal server error"})
+    if aggregates is None:
+        # the cache was invalidated while loading; a retry sees the new generation
+        return JSONResponse(status_code=503, content={"error": "Stats are being rebuilt"}, headers={"Retry-After": "1"})
+    return _cached_json_response(request, aggregates.body, aggregates.etag)
+
 
 @router.get("/countries/{name}", response_model=CountryResponse)
-async def get_country(name: str, db: AsyncSession = Depends(get_db)):
-    stmt = select(Country).where(func.lower(Country.name) == name.lower())
-    result = await db.execute(stmt)
-    country = result.scalars().first()
+async def get_country(name: str, request: Request, db: AsyncSession = Depends(get_read_db)):
+    snapshot = await country_cache.get(db)
+    if snapshot is not None:
+        if not snapshot.contains(name):
+            return JSONResponse(status_code=404, content={"error": "Country not found"})
+        cached = snapshot.detail_body(name)
+        if cached is not None:
+            return _cached_json_response(request, *cached)
+
+    known, country_id = await country_cache.lookup_id(db, name)
+    if known:
+        country = await db.get(Country, country_id) if country_id is not None else None
+    else:
+        stmt = select(Country).where(Country.name_normalized == normalize_name(name))
+        result = await db.execute(stmt)
+        country = result.scalars().first()
     if not country:
         return JSONResponse(status_code=404, content={"error": "Country not found"})
     return CountryResponse.model_validate(country)
 
 @router.delete("/countries/{name}")
 async def delete_country(name: str, db: AsyncSession = Depends(get_db)):
-    stmt = select(Country).where(func.lower(Country.name) == name.lower())
-    result = await db.execute(stmt)
-    country = result.scalars().first()
-    if not country:
+    known, country_id = await country_cache.lookup_id(db, name)
+    if known and country_id is None:
         return JSONResponse(status_code=404, content={"error": "Country not found"})
+    # one indexed DELETE instead of SELECT + ORM delete
+    if known:
+        stmt = delete(Country).where(Country.id == country_id)
+    else:
+        stmt = delete(Country).where(Country.name_normalized == normalize_name(name))
     try:
-        await db.delete(country)
+        result = await db.execute(stmt)
+        if result.rowcount == 0:
+            await db.rollback()
+            return JSONResponse(status_code=404, content={"error": "Country not found"})
         await db.commit()
+        # otherwise an unchanged upstream would let the next refresh skip restoring it
+        await forget_upstream_validators()
+        await country_cache.reload(db)
         return {"message": "Country deleted"}
     except Exception:
         logger.exception("Failed to delete country")
         raise HTTPException(status_code=500, detail={"error": "Internal server error"})
 
 @router.get("/status")
-async def status(db: AsyncSession = Depends(get_db)):
+async def status(db: AsyncSession = Depends(get_read_db)):
     try:
+        aggregates = await country_cache.get_aggregates(db)
+        if aggregates is not None:
+            return Response(content=aggregates.status_body, media_type="application/json")
+
         total_stmt = select(func.count(Country.id))
         total_res = await db.execute(total_stmt)
         total = total_res.scalar() or 0
@@ -108,9 +466,107 @@ async def status(db: AsyncSession = Depends(get_db)):
         last_stmt = select(func.max(Country.last_refreshed_at))
         last_res = await db.execute(last_stmt)
         last = last_res.scalar()
-        last_iso = last.isoformat() + "Z" if last else None
-        return {"total_countries": total, "last_refreshed_at": last_iso}
+        return {"total_countries": total, "last_refreshed_at": iso_utc(last)}
     except Exception:
         logger.exception("Failed to fetch status")
         raise HTTPException(status_code=500, detail={"error": "Internal server error"})
 
+
+@router.get("/rates/{currency}/history")
+async def get_rate_history(
+    currency: str,
+    from_: Optional[str] = Query(None, alias="from", description=f"ISO 8601 start (inclusive); default {RATE_HISTORY_DEFAULT_DAYS} days before `to`"),
+    to: Optional[str] = Query(None, description="ISO 8601 end (exclusive); default now"),
+    step: Optional[str] = Query(None, description="Bucket size: seconds or 15m, 1h, 1d, 1w (default 1h)"),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """Exchange-rate series (per USD) for one currency, downsampled to one point per step."""
+    currency = currency.strip().upper()
+    try:
+        bucket = parse_step(step)
+        end = parse_time("to", to, datetime.now(timezone.utc))
+        start = parse_time("from", from_, end - timedelta(days=RATE_HISTORY_DEFAULT_DAYS))
+        if start >= end:
+            raise HistoryQueryError("from", "must be before to")
+        if (end - start).total_seconds() / bucket > RATE_HISTORY_MAX_POINTS:
+            raise HistoryQueryError("step", f"too small for the range; at most {RATE_HISTORY_MAX_POINTS} points per request")
+    except HistoryQueryError as e:
+        return JSONResponse(status_code=400, content={"error": "Validation failed", "details": {e.field: str(e)}})
+
+    try:
+        points = await query_history(db, currency, start, end, bucket)
+        if not points and not await has_history(db, currency):
+            return JSONResponse(status_code=404, content={"error": "Currency not found"})
+    except Exception:
+        logger.exception("Failed to query rate history")
+        raise HTTPException(status_code=500, detail={"error": "Internal server error"})
+    return {
+        "currency": currency,
+        "from": iso_utc(start),
+        "to": iso_utc(end),
+        "step": bucket,
+        "points": points,
+    }
+
+
+def _admin_denied(request: Request) -> Optional[JSONResponse]:
+    if not ADMIN_TOKEN:
+        return JSONResponse(status_code=403, content={"error": "Admin endpoints are disabled; set ADMIN_TOKEN to enable them"})
+    if not hmac.compare_digest(request.headers.get("x-admin-token", "").encode("utf-8"), ADMIN_TOKEN.encode("utf-8")):
+        return JSONResponse(status_code=403, content={"error": "Forbidden"})
+    return None
+
+
+async def _read_body(request: Request, limit: int) -> Optional[bytes]:
+    """Request body, or None as soon as it is known to exceed ``limit`` bytes."""
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > limit:
+        return None
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > limit:
+            return None
+    return bytes(body)
+
+
+@router.get("/admin/snapshot")
+async def download_snapshot(request: Request, db: AsyncSession = Depends(get_read_db)):
+    """Binary snapshot of the countries table and exchange rates (see snapshot.py)."""
+    denied = _admin_denied(request)
+    if denied is not None:
+        return denied
+    try:
+        data = await export_snapshot(db)
+    except Exception:
+        logger.exception("Failed to export snapshot")
+        raise HTTPException(status_code=500, detail={"error": "Internal server error"})
+    return Response(content=data, media_type="application/octet-stream", headers={"Content-Disposition": 'attachment; filename="countries.snap"'})
+
+
+@router.post("/admin/snapshot")
+async def upload_snapshot(request: Request, replace: bool = Query(False, description="Delete existing countries before loading"), db: AsyncSession = Depends(get_db)):
+    """Load a snapshot sent as the raw request body."""
+    denied = _admin_denied(request)
+    if denied is not None:
+        return denied
+    body = await _read_body(request, ADMIN_SNAPSHOT_MAX_BYTES)
+    if body is None:
+        return JSONResponse(status_code=413, content={"error": "Snapshot too large", "details": f"limit is {ADMIN_SNAPSHOT_MAX_BYTES} bytes"})
+    try:
+        snapshot = decode_snapshot(body)
+        loaded = await import_snapshot(db, snapshot, replace=replace)
+    except SnapshotConflict as e:
+        return JSONResponse(status_code=409, content={"error": "Countries table is not empty", "details": str(e)})
+    except SnapshotError as e:
+        return JSONResponse(status_code=400, content={"error": "Validation failed", "details": {"snapshot": str(e)}})
+    except Exception:
+        logger.exception("Failed to import snapshot")
+        raise HTTPException(status_code=500, detail={"error": "Internal server error"})
+    return {"message": "Snapshot imported", "countries": loaded, "rates": len(snapshot.rates)}
+
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus text exposition of request, DB, refresh and cache metrics."""
+    return Response(content=metrics_registry.render(), media_type=METRICS_CONTENT_TYPE)
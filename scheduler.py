@@ -0,0 +1,173 @@
+import asyncio
+import os
+import random
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+from coherence import coherence
+from database import async_session
+from logger import get_logger, request_id_var
+from metrics import refresh_in_progress, refresh_rows_total, refresh_runs_total, stop_db_tracking
+from service import REFRESH_MODE, RefreshResult, country_service
+from timeutil import iso_utc
+
+logger = get_logger(__name__)
+
+# Periodic refresh; 0 (the default) disables the background loop.
+REFRESH_INTERVAL_SECONDS = float(os.getenv("REFRESH_INTERVAL_SECONDS", "0"))
+# Up to this many seconds are added to each interval so replicas don't refresh in lockstep.
+REFRESH_JITTER_SECONDS = float(os.getenv("REFRESH_JITTER_SECONDS", "0"))
+# Finished jobs kept for GET /countries/refresh/{job_id}.
+REFRESH_JOB_HISTORY = int(os.getenv("REFRESH_JOB_HISTORY", "50"))
+# How long shutdown waits for an in-flight refresh before cancelling it.
+REFRESH_SHUTDOWN_TIMEOUT = float(os.getenv("REFRESH_SHUTDOWN_TIMEOUT", "30"))
+
+
+@dataclass
+class RefreshJob:
+    id: str
+    trigger: str
+    mode: Optional[str] = None
+    prune: Optional[bool] = None
+    status: str = "pending"
+    created_at: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    last_refreshed_at: Optional[datetime] = None
+    error: Optional[str] = None
+    result: Optional[RefreshResult] = None
+    task: Optional[asyncio.Task] = field(default=None, repr=False)
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("succeeded", "failed")
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "trigger": self.trigger,
+            "mode": self.result.mode if self.result else self.mode,
+            "status": self.status,
+            "created_at": iso_utc(self.created_at),
+            "started_at": iso_utc(self.started_at),
+            "finished_at": iso_utc(self.finished_at),
+            "last_refreshed_at": iso_utc(self.last_refreshed_at),
+            "skipped": self.result.skipped if self.result else None,
+            "changes": self.result.counts() if self.result else None,
+            "error": self.error,
+        }
+
+
+class RefreshScheduler:
+    """
+    Runs country refreshes as background tasks, one at a time.
+
+    ``submit`` is single-flight: while a refresh is running every caller
+    (API request or the periodic loop) gets that same job back instead of
+    starting another run. Each job uses its own DB session, so HTTP handlers
+    only await the job and never hold a connection while the upstreams are slow.
+
+    Across workers, refreshes hold the shared ``refresh`` lock, so a second
+    worker's run waits for the first and then usually finds nothing changed
+    upstream. The periodic loop runs in every worker but only the current
+    leader submits; if the leader exits another worker takes over.
+    """
+
+    def __init__(self, interval: float = REFRESH_INTERVAL_SECONDS, jitter: float = REFRESH_JITTER_SECONDS, history: int = REFRESH_JOB_HISTORY):
+        self.interval = interval
+        self.jitter = jitter
+        self.history = history
+        self.jobs: "OrderedDict[str, RefreshJob]" = OrderedDict()
+        self.current: Optional[RefreshJob] = None
+        self._loop_task: Optional[asyncio.Task] = None
+
+    def submit(self, trigger: str = "api", mode: Optional[str] = None, prune: Optional[bool] = None) -> RefreshJob:
+        """Start a refresh, or return the running one (whatever its mode/prune settings)."""
+        if self.current is not None and not self.current.done:
+            return self.current
+        job = RefreshJob(id=uuid.uuid4().hex, trigger=trigger, mode=mode, prune=prune)
+        job.task = asyncio.create_task(self._run(job))
+        self.current = job
+        self.jobs[job.id] = job
+        while len(self.jobs) > self.history:
+            self.jobs.popitem(last=False)
+        return job
+
+    def get(self, job_id: str) -> Optional[RefreshJob]:
+        return self.jobs.get(job_id)
+
+    async def wait(self, job: RefreshJob) -> RefreshJob:
+        # shield: a client disconnecting must not cancel a refresh others may have joined
+        await asyncio.shield(job.task)
+        return job
+
+    async def _run(self, job: RefreshJob) -> None:
+        job.status = "running"
+        job.started_at = datetime.now(timezone.utc)
+        logger.info(f"Refresh job {job.id} started ({job.trigger})")
+        # the task inherited the submitting request's context; keep refresh queries
+        # out of its metrics and tag its log records with the job instead
+        stop_db_tracking()
+        request_id_var.set(f"refresh-{job.id[:10]}")
+        refresh_in_progress.inc()
+        try:
+            async with coherence.exclusive("refresh"), async_session() as session:
+                job.result = await country_service.refresh_countries(session, mode=job.mode, prune=job.prune)
+                job.last_refreshed_at = job.result.last_refreshed_at
+            job.status = "succeeded"
+        except asyncio.CancelledError:
+            job.status = "failed"
+            job.error = "cancelled"
+            raise
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            logger.error(f"Refresh job {job.id} failed: {e}")
+        finally:
+            job.finished_at = datetime.now(timezone.utc)
+            refresh_in_progress.dec()
+            outcome = "skipped" if job.result is not None and job.result.skipped else job.status
+            refresh_runs_total.inc(job.result.mode if job.result is not None else (job.mode or REFRESH_MODE), outcome)
+            if job.result is not None:
+                for change, count in job.result.counts().items():
+                    refresh_rows_total.inc(change, amount=count)
+        logger.info(f"Refresh job {job.id} {job.status} in {(job.finished_at - job.started_at).total_seconds():.2f}s")
+
+    async def _periodic(self) -> None:
+        while True:
+            try:
+                await asyncio.sleep(self.interval + random.uniform(0, self.jitter))
+                if coherence.is_leader():
+                    await self.wait(self.submit(trigger="schedule"))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # one failing lock or DB call must not end scheduling for the life of the process
+                logger.exception("Scheduled refresh failed; trying again next interval")
+
+    async def start(self) -> None:
+        if self.interval > 0 and self._loop_task is None:
+            logger.info(f"Scheduling refresh every {self.interval}s (+ up to {self.jitter}s jitter)")
+            self._loop_task = asyncio.create_task(self._periodic())
+
+    async def stop(self) -> None:
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            try:
+                await self._loop_task
+            except asyncio.CancelledError:
+                pass
+            self._loop_task = None
+        job = self.current
+        if job is not None and not job.done:
+            try:
+                await asyncio.wait_for(asyncio.shield(job.task), timeout=REFRESH_SHUTDOWN_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.warning(f"Cancelling refresh job {job.id} on shutdown")
+                job.task.cancel()
+
+
+refresh_scheduler = RefreshScheduler()
@@ -1,7 +1,7 @@
 from datetime import datetime
 import random
 from pydantic import BaseModel, Field, field_validator, model_validator
-from typing import Optional
+from typing import List, Optional
 
 class CountryBase(BaseModel):
     # Required by project: name and population are required.
@@ -41,3 +41,18 @@ class CountryResponse(CountryBase):
     id: int
     last_refreshed_at: Optional[datetime] = Field(None, description="The last time the country data was refreshed")
     model_config = {"from_attributes": True}
+
+
+class CountryBatchRequest(BaseModel):
+    names: List[str] = Field(default_factory=list, description="Country names, matched case-insensitively", example=["Nigeria", "ghana"])
+    ids: List[int] = Field(default_factory=list, description="Country ids", example=[12, 45])
+
+
+class Conversion(BaseModel):
+    from_currency: str = Field(..., alias="from", example="NGN")
+    to_currency: str = Field(..., alias="to", example="EUR")
+    amount: float = Field(..., allow_inf_nan=False, example=1000)
+
+
+class ConvertRequest(BaseModel):
+    conversions: List[Conversion] = Field(..., description="Amounts to convert, each between any two stored currencies")
@@ -1,18 +1,25 @@
 import httpx
-import random
 from sqlalchemy.ext.asyncio import AsyncSession
-from models import Country
-from schemas import CountryCreate, CountryResponse
+from database import env_bool
+from models import Country, normalize_name
 from dotenv import load_dotenv
 import os
 from logger import get_logger
-from typing import Tuple, List, Optional, Dict, Any
+from http_cache import HTTPResponseCache, UpstreamResponse
+from country_cache import country_cache
+from transform import build_rate_table, transform_countries
+from rate_history import RATE_HISTORY_ENABLED, compact_history, record_rates
+from metrics import phase_timer, refresh_phase_duration
+from summary_image import SUMMARY_IMAGE_PATH, render_summary_png, run_render, write_atomic
+from timeutil import iso_utc
+from typing import Tuple, List, Optional, Dict, Any, Iterable
+from dataclasses import dataclass
 from datetime import datetime, timezone
-from PIL import Image, ImageDraw, ImageFont
-import math
+import time
 import asyncio
-from sqlalchemy import select, func
-from pathlib import Path
+from sqlalchemy import select, func, insert, update, delete
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 logger = get_logger(__name__)
 
 load_dotenv()
@@ -20,143 +27,316 @@ load_dotenv()
 
 COUNTRY_API_URL = os.getenv("COUNTRY_API_URL")
 EXCHANGE_RATE_API_URL = os.getenv("RATE_API_URL")
+UPSTREAM_CACHE_DIR = os.getenv("UPSTREAM_CACHE_DIR", os.path.join("cache", "upstream"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "30"))
+# Rows per executemany batch of INSERT ... ON CONFLICT / ON DUPLICATE KEY UPDATE.
+UPSERT_BATCH_SIZE = int(os.getenv("REFRESH_UPSERT_BATCH_SIZE", "500"))
+# "full" rewrites every country on each refresh; "incremental" only writes
+# countries whose upstream record changed (by source_hash) or that are new.
+REFRESH_MODES = ("full", "incremental")
+REFRESH_MODE = os.getenv("REFRESH_MODE", "full").strip().lower()
+# Delete stored countries that no longer appear upstream.
+REFRESH_PRUNE = env_bool("REFRESH_PRUNE", False)
+
+# Columns overwritten when an upsert hits an existing country (name is kept).
+_UPSERT_UPDATE_COLUMNS = (
+    "capital", "region", "population", "currency_code", "exchange_rate",
+    "estimated_gdp", "flag_url", "last_refreshed_at", "source_hash",
+)
+
+
+def _upsert_statement(dialect: str):
+    """Build a dialect-native upsert keyed on Country.name_normalized.
+
+    Executed with a list of parameter sets, so the statement is compiled once
+    and the driver sends each batch as a single executemany call. It targets
+    the Core table rather than the mapped class so the ORM bulk-insert path
+    does not split a batch into smaller groups.
+    """
+    if dialect == "mysql":
+        stmt = mysql_insert(Country.__table__)
+        return stmt.on_duplicate_key_update({col: stmt.inserted[col] for col in _UPSERT_UPDATE_COLUMNS})
+    stmt = sqlite_insert(Country.__table__)
+    return stmt.on_conflict_do_update(
+        index_elements=[Country.name_normalized],
+        set_={col: stmt.excluded[col] for col in _UPSERT_UPDATE_COLUMNS},
+    )
+
+
+@dataclass
+class RefreshResult:
+    """Outcome of one refresh: when it ran and how many countries it touched."""
+    last_refreshed_at: Optional[datetime]
+    mode: str
+    skipped: bool = False
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    # stored countries missing upstream; removed only when pruning
+    vanished: int = 0
+    deleted: int = 0
+    # rows appended to the exchange-rate history
+    rates_recorded: int = 0
+
+    @property
+    def written(self) -> int:
+        return self.inserted + self.updated + self.deleted
+
+    def counts(self) -> Dict[str, int]:
+        return {
+            "inserted": self.inserted,
+            "updated": self.updated,
+            "unchanged": self.unchanged,
+            "vanished": self.vanished,
+            "deleted": self.deleted,
+        }
+
+
+upstream_cache = HTTPResponseCache(UPSTREAM_CACHE_DIR)
+# Writes that did not come from the upstreams (DELETE, snapshot import) in this process.
+_local_writes = 0
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Shared, pooled client for the upstream APIs; created on first use."""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            timeout=HTTP_TIMEOUT,
+            limits=httpx.Limits(max_connections=10, max_keepalive_connections=4),
+            follow_redirects=True,
+        )
+    return _http_client
+
+
+async def forget_upstream_validators() -> None:
+    """
+    Call after a local write to the countries table. The stored upstream
+    responses no longer describe the table, so the next refresh must fetch and
+    apply them in full instead of skipping as "unchanged".
+    """
+    global _local_writes
+    _local_writes += 1
+    try:
+        await asyncio.to_thread(upstream_cache.clear)
+    except OSError:
+        logger.exception("Failed to clear cached upstream responses")
+
+
+async def close_http_client() -> None:
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
 class CountryService:
     @staticmethod
-    async def fetch_countries_from_api():
+    async def fetch_countries_from_api() -> Tuple[UpstreamResponse, UpstreamResponse]:
        try:
-           async with httpx.AsyncClient() as client:
-               countries_response = await client.get(COUNTRY_API_URL)
-               exchange_rate_response = await client.get(EXCHANGE_RATE_API_URL)
-               countries_response.raise_for_status()
-               exchange_rate_response.raise_for_status()
-               logger.info("Successfully fetched data from APIs")
-               countries_data = countries_response.json()
-               exchange_rate_data = exchange_rate_response.json()
-               return countries_data, exchange_rate_data
+           client = get_http_client()
+           # both upstreams are slow; fetch them concurrently on the shared client
+           countries_response, exchange_rate_response = await asyncio.gather(
+               upstream_cache.fetch(client, COUNTRY_API_URL),
+               upstream_cache.fetch(client, EXCHANGE_RATE_API_URL),
+           )
+           logger.info("Successfully fetched data from APIs")
+           return countries_response, exchange_rate_response
        except httpx.HTTPError as e:
            logger.error(f"Error fetching data from API: {e}")
            raise Exception(f"Failed to fetch data from external APIs: {e}")
        
 
     @staticmethod
-    async def refresh_countries(session:AsyncSession):
+    async def refresh_countries(session:AsyncSession, mode: Optional[str] = None, prune: Optional[bool] = None) -> RefreshResult:
+        # an explicit prune or a mode other than the configured one asks for work
+        # the last run may not have done, so unchanged upstream data is no reason to skip
+        requested = prune is True or (mode is not None and mode != REFRESH_MODE)
+        mode = mode or REFRESH_MODE
+        if mode not in REFRESH_MODES:
+            raise ValueError(f"Unknown refresh mode {mode!r}; expected one of: {', '.join(REFRESH_MODES)}")
+        prune = REFRESH_PRUNE if prune is None else prune
+        local_writes = _local_writes
         try:
-            countries_data, exchange_rate_data = await CountryService.fetch_countries_from_api()
+            with phase_timer("fetch"):
+                countries_response, exchange_rate_response = await CountryService.fetch_countries_from_api()
         except Exception as e:
             logger.error(f"Failed to refresh countries: {e}")
             raise
 
+        incremental = mode == "incremental"
+        if countries_response.unchanged and exchange_rate_response.unchanged:
+            # Nothing changed upstream since the last successful refresh: skip parsing,
+            # DB writes and image rendering, unless the table was emptied meanwhile.
+            last_res = await session.execute(select(func.max(Country.last_refreshed_at)))
+            last = last_res.scalar()
+            await session.rollback()
+            if last is not None and not requested:
+                logger.info("Upstream data unchanged; skipping refresh")
+                return RefreshResult(last_refreshed_at=last, mode=mode, skipped=True)
+            if last is not None and mode == REFRESH_MODE:
+                # only a prune was asked for: compare the stored names with the
+                # payload and delete the missing ones without rewriting the rest
+                incremental = True
+
+        countries_data = countries_response.json()
+        exchange_rate_data = exchange_rate_response.json()
         rates = exchange_rate_data.get("rates") if isinstance(exchange_rate_data, dict) else None
         if not rates:
             logger.error("Exchange rates data is missing or invalid")
             rates = {}
         refresh_time = datetime.now(timezone.utc)
-        prepared = []
-        for c in countries_data:
-            name = c.get("name")
-            capital = c.get("capital")
-            region = c.get("region")
-            population = c.get("population")
-            flag_url = c.get("flag")
-            currencies = c.get("currencies") or []
-            currency_code = None
-            exchange_rate = None
-            estimated_gdp = None
-
-            # If currencies array empty -> currency_code None, exchange_rate None, estimated_gdp 0
-            if isinstance(currencies, list) and len(currencies) > 0:
-                first = currencies[0]
-                # currency objects commonly have 'code'
-                currency_code = first.get("code") if isinstance(first, dict) else None
-                if currency_code:
-                    # lookup exchange rate; rates map currency_code -> rate
-                    rate_val = rates.get(currency_code)
-                    if rate_val is None:
-                        # not found in exchange rates -> exchange_rate None, estimated_gdp None
-                        exchange_rate = None
-                        estimated_gdp = None
-                    else:
-                        try:
-                            exchange_rate = float(rate_val)
-                        except Exception:
-                            exchange_rate = None
-                        if exchange_rate:
-                            # compute estimated_gdp = population × random(1000–2000) ÷ exchange_rate
-                            if population:
-                                multiplier = random.uniform(1000, 2000)
-                                estimated_gdp = (population * multiplier) / exchange_rate
-                            else:
-                                estimated_gdp = None
-                else:
-                    # currencies exist but no code on first currency
-                    currency_code = None
-                    exchange_rate = None
-                    estimated_gdp = 0 if not currencies else None
-            else:
-                # no currencies
-                currency_code = None
-                exchange_rate = None
-                estimated_gdp = 0
-
-            prepared.append({
-                "name": name,
-                "capital": capital,
-                "region": region,
-                "population": population,
-                "currency_code": currency_code,
-                "exchange_rate": exchange_rate,
-                "estimated_gdp": estimated_gdp,
-                "flag_url": flag_url,
-                "last_refreshed_at": refresh_time
-            })
+        # generator: records are transformed in chunks as the upsert consumes them
+        timings = {"transform": 0.0}
+        prepared = transform_countries(countries_data, rates, refresh_time, timings=timings)
 
         # 2) Upsert into DB in a transaction
+        started = time.perf_counter()
         try:
             async with session.begin():
-                for rec in prepared:
-                    # skip if no name or population missing -> but per requirements name & population & currency_code are required when creating via API;
-                    # For refresh we still store countries even with missing currency data, but need name/population for DB model non-null constraints.
-                    name = rec["name"]
-                    if not name:
-                        continue
-                    stmt = select(Country).where(func.lower(Country.name) == name.lower())
-                    result = await session.execute(stmt)
-                    existing = result.scalars().first()
-                    if existing:
-                        # update fields
-                        existing.capital = rec["capital"]
-                        existing.region = rec["region"]
-                        existing.population = rec["population"] if rec["population"] is not None else existing.population
-                        existing.currency_code = rec["currency_code"]
-                        existing.exchange_rate = rec["exchange_rate"]
-                        # estimated_gdp: if currency_code missing -> 0, if rate missing -> None, else computed
-                        existing.estimated_gdp = rec["estimated_gdp"] if rec["estimated_gdp"] is not None else existing.estimated_gdp
-                        existing.flag_url = rec["flag_url"]
-                        existing.last_refreshed_at = rec["last_refreshed_at"]
-                        session.add(existing)
-                    else:
-                        # create new record; ensure required fields exist or set safe defaults
-                        new_country = Country(
-                            name=name,
-                            capital=rec["capital"],
-                            region=rec["region"],
-                            population=rec["population"] or 0,
-                            currency_code=rec["currency_code"],
-                            exchange_rate=rec["exchange_rate"],
-                            estimated_gdp=rec["estimated_gdp"] if rec["estimated_gdp"] is not None else (0 if rec["currency_code"] is None else None),
-                            flag_url=rec["flag_url"],
-                            last_refreshed_at=rec["last_refreshed_at"]
-                        )
-                        session.add(new_country)
+                result = await CountryService._upsert_countries(session, prepared, incremental=incremental, prune=prune)
+                # Append the rates to the history in the same transaction, unless the
+                # rate response was the one we already recorded.
+                if RATE_HISTORY_ENABLED and rates and not exchange_rate_response.unchanged:
+                    result.rates_recorded = await record_rates(session, build_rate_table(rates), refresh_time)
             # commit handled by context manager
         except Exception as e:
             logger.exception("Database error during refresh; rolling back.")
             raise
+        finally:
+            # the transform runs inside the upsert loop; report the two separately
+            refresh_phase_duration.observe(timings["transform"], "transform")
+            refresh_phase_duration.observe(time.perf_counter() - started - timings["transform"], "upsert")
+        result.last_refreshed_at = refresh_time
+        logger.info(
+            f"Refresh ({mode}): {result.inserted} inserted, {result.updated} updated, "
+            f"{result.unchanged} unchanged, {result.vanished} vanished, {result.deleted} deleted; "
+            f"{result.rates_recorded} rates recorded"
+        )
+
+        # Swap in the new in-memory snapshot for GET /countries
+        if result.written:
+            with phase_timer("cache_reload"):
+                await country_cache.reload(session)
+
+        if result.rates_recorded:
+            with phase_timer("rate_history"):
+                try:
+                    await compact_history(session)
+                except Exception:
+                    logger.exception("Rate history maintenance failed; retrying after the next refresh.")
+
+        # Remember the validators only now, so a failed refresh is not skipped next time,
+        # and not at all if a local write landed meanwhile (it may postdate our upsert).
+        for response in (countries_response, exchange_rate_response):
+            if _local_writes != local_writes:
+                logger.info("Countries changed locally during the refresh; not caching upstream responses")
+                break
+            try:
+                await asyncio.to_thread(upstream_cache.store, response)
+            except OSError:
+                logger.exception(f"Failed to cache upstream response for {response.url}")
 
         # 3) After successful DB save, generate summary image
-        await CountryService._generate_summary_image(session, refresh_time)
+        if result.written:
+            with phase_timer("image"):
+                await CountryService._generate_summary_image(session, refresh_time)
+
+        return result
 
-        return refresh_time
+    @staticmethod
+    async def _upsert_countries(session: AsyncSession, prepared: Iterable[Dict[str, Any]], incremental: bool = False, prune: bool = False) -> RefreshResult:
+        """
+        Write prepared records with one SELECT for the existing rows and a
+        handful of batched upserts, instead of one SELECT per country.
+        Incremental mode skips countries whose stored source_hash matches;
+        prune deletes stored countries that are missing upstream.
+        Must be called inside an open transaction.
+        """
+        existing_res = await session.execute(
+            select(Country.id, Country.name_normalized, Country.population, Country.estimated_gdp, Country.source_hash)
+        )
+        existing = {row.name_normalized: row._asdict() for row in existing_res if row.name_normalized}
+
+        # Resolve final column values in Python so inserts and updates keep the
+        # old per-row semantics: on update a missing population/estimated_gdp
+        # keeps the stored value, on insert it falls back to a safe default.
+        rows: Dict[str, Dict[str, Any]] = {}
+        for rec in prepared:
+            name = rec["name"]
+            if not name:
+                continue
+            key = normalize_name(name)
+            current = rows.get(key) or existing.get(key)
+            if current is not None:
+                population = rec["population"] if rec["population"] is not None else current["population"]
+                estimated_gdp = rec["estimated_gdp"] if rec["estimated_gdp"] is not None else current["estimated_gdp"]
+                if key in rows:
+                    # a duplicate later in the same payload keeps the first spelling;
+                    # stored rows keep theirs because the upsert never updates name
+                    name = rows[key]["name"]
+            else:
+                population = rec["population"] or 0
+                estimated_gdp = rec["estimated_gdp"] if rec["estimated_gdp"] is not None else (0 if rec["currency_code"] is None else None)
+            rows[key] = {
+                "id": current.get("id") if current is not None else None,
+                "name": name,
+                "name_normalized": key,
+                "capital": rec["capital"],
+                "region": rec["region"],
+                "population": population,
+                "currency_code": rec["currency_code"],
+                "exchange_rate": rec["exchange_rate"],
+                "estimated_gdp": estimated_gdp,
+                "flag_url": rec["flag_url"],
+                "last_refreshed_at": rec["last_refreshed_at"],
+                "source_hash": rec["source_hash"],
+            }
+
+        if incremental:
+            values = [
+                row for key, row in rows.items()
+                if row["id"] is None or existing[key]["source_hash"] != row["source_hash"]
+            ]
+        else:
+            values = list(rows.values())
+        inserted = sum(1 for row in values if row["id"] is None)
+        vanished = [row["id"] for key, row in existing.items() if key not in rows]
+        dialect = session.bind.dialect.name
+        if dialect in ("sqlite", "mysql"):
+            stmt = _upsert_statement(dialect)
+            for start in range(0, len(values), UPSERT_BATCH_SIZE):
+                batch = [{k: v for k, v in row.items() if k != "id"} for row in values[start:start + UPSERT_BATCH_SIZE]]
+                await session.execute(stmt, batch)
+        else:
+            # Generic path: ORM bulk INSERT for new rows, bulk UPDATE by primary key for the rest.
+            new_rows = [{k: v for k, v in row.items() if k != "id"} for row in values if row["id"] is None]
+            changed_rows = [{k: v for k, v in row.items() if k != "name"} for row in values if row["id"] is not None]
+            if new_rows:
+                await session.execute(insert(Country), new_rows)
+            if changed_rows:
+                await session.execute(update(Country), changed_rows)
+
+        deleted = 0
+        if prune and vanished:
+            if not rows:
+                # an empty upstream payload is far more likely an outage than a real answer
+                logger.warning(f"Upstream returned no countries; not pruning {len(vanished)} stored rows")
+            else:
+                for start in range(0, len(vanished), UPSERT_BATCH_SIZE):
+                    await session.execute(delete(Country).where(Country.id.in_(vanished[start:start + UPSERT_BATCH_SIZE])))
+                deleted = len(vanished)
+        logger.info(f"Upserted {len(values)} countries ({len(existing)} already stored)")
+        return RefreshResult(
+            last_refreshed_at=None,
+            mode="incremental" if incremental else "full",
+            inserted=inserted,
+            updated=len(values) - inserted,
+            unchanged=len(rows) - len(values),
+            vanished=len(vanished),
+            deleted=deleted,
+        )
 
     @staticmethod
     async def _generate_summary_image(session: AsyncSession, refresh_time: datetime):
@@ -166,58 +346,38 @@ class CountryService:
         - top 5 countries by estimated_gdp
         - timestamp of last refresh
         """
-        # fetch stats
+        # the cache was just rebuilt from the committed data; fall back to the DB
+        # only when that failed
+        aggregates = country_cache.aggregates
+        data = aggregates.image_data(5) if aggregates is not None else None
+        if data is None:
+            data = await CountryService._summary_from_db(session)
+            if data is None:
+                return
+        total, top = data[:2]
+        try:
+            # Pillow drawing/encoding and the file write run in the render pool, off the event loop
+            png = await run_render(render_summary_png, total, top, iso_utc(refresh_time))
+            await run_render(write_atomic, SUMMARY_IMAGE_PATH, png)
+            logger.info(f"Saved summary image to {SUMMARY_IMAGE_PATH}")
+        except Exception:
+            logger.exception("Failed to save summary image.")
+
+    @staticmethod
+    async def _summary_from_db(session: AsyncSession):
+        """(total, top 5 by GDP) straight from the table; None when the queries fail."""
         try:
             stmt_total = select(func.count(Country.id))
             total_res = await session.execute(stmt_total)
             total = total_res.scalar() or 0
 
             # top 5 by estimated_gdp (descending), ignoring nulls
-            stmt_top = select(Country).where(Country.estimated_gdp != None).order_by(Country.estimated_gdp.desc()).limit(5)
+            stmt_top = select(Country.name, Country.estimated_gdp).where(Country.estimated_gdp != None).order_by(Country.estimated_gdp.desc()).limit(5)
             top_res = await session.execute(stmt_top)
-            top_countries = top_res.scalars().all()
+            top_countries = top_res.all()
         except Exception:
             logger.exception("Failed to query DB for image generation.")
-            return
-
-        # create canvas
-        Path("cache").mkdir(parents=True, exist_ok=True)
-        img_w, img_h = 800, 600
-        bg_color = (30, 30, 30)
-        text_color = (240, 240, 240)
-        img = Image.new("RGB", (img_w, img_h), color=bg_color)
-        draw = ImageDraw.Draw(img)
-
-        try:
-            # try to use a common font; fallback if not available
-            font_title = ImageFont.truetype("DejaVuSans-Bold.ttf", 28)
-            font_body = ImageFont.truetype("DejaVuSans.ttf", 18)
-        except Exception:
-            font_title = ImageFont.load_default()
-            font_body = ImageFont.load_default()
-
-        padding = 40
-        y = padding
-        draw.text((padding, y), "Countries Summary", fill=text_color, font=font_title)
-        y += 50
-        draw.text((padding, y), f"Total countries: {total}", fill=text_color, font=font_body)
-        y += 30
-        draw.text((padding, y), f"Last refreshed at: {refresh_time.isoformat()}Z", fill=text_color, font=font_body)
-        y += 40
-        draw.text((padding, y), "Top 5 countries by estimated GDP:", fill=text_color, font=font_body)
-        y += 30
-
-        for idx, c in enumerate(top_countries, start=1):
-            name = c.name
-            gdp = c.estimated_gdp or 0
-            draw.text((padding + 10, y), f"{idx}. {name} — {gdp:,.2f}", fill=text_color, font=font_body)
-            y += 24
-
-        img_path = Path("cache") / "summary.png"
-        try:
-            img.save(img_path, format="PNG")
-            logger.info(f"Saved summary image to {img_path}")
-        except Exception:
-            logger.exception("Failed to save summary image.")
+            return None
+        return total, [(c.name, c.estimated_gdp) for c in top_countries]
 
 country_service = CountryService()
\ No newline at end of file
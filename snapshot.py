@@ -0,0 +1,402 @@
+"""
+Binary snapshots of the countries table for warm starts.
+
+A snapshot holds every column of ``countries`` plus the exchange rates the
+last refresh used (added to the rate history on import). It is written column by column in a small versioned
+format, so imports can read fixed-width columns straight out of a
+memory-mapped file without parsing:
+
+    header   magic "CCSNAP", version u16, created_at f64 (unix), table count u16
+    table    name, row count u32, column count u16, columns...
+    column   name, type u8, flags u8, payload length u64, padding to 8 bytes, payload
+    trailer  crc32 u32 of everything before it
+
+Names are a u8 length followed by UTF-8. Payloads start with a validity
+bitmap (bit set = not NULL) when flag 1 is set, followed by the values:
+``q`` int64, ``d`` float64, ``t`` int64 microseconds since the epoch (UTC)
+and ``s`` n+1 uint32 offsets into a UTF-8 blob. Numeric (decimal) columns are
+stored as ``s`` so exchange rates survive exactly. All integers are
+little-endian.
+
+    python snapshot.py export cache/countries.snap
+    python snapshot.py import cache/countries.snap [--replace]
+    python snapshot.py info cache/countries.snap
+"""
+import argparse
+import asyncio
+import mmap
+import os
+import struct
+import sys
+import time
+import zlib
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import DateTime, Float, Integer, Numeric, delete, func, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from coherence import coherence
+from country_cache import country_cache
+from database import env_bool
+from logger import get_logger
+from models import Country, RateHistory, normalize_name
+from rate_history import RATE_HISTORY_ENABLED, record_rates
+from service import EXCHANGE_RATE_API_URL, UPSERT_BATCH_SIZE, CountryService, forget_upstream_validators, upstream_cache
+from summary_image import write_atomic
+from timeutil import as_utc, iso_utc
+from transform import build_rate_table
+
+logger = get_logger(__name__)
+
+# Loaded on startup when the countries table is empty; empty disables it.
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH", "")
+SNAPSHOT_LOAD_ON_EMPTY = env_bool("SNAPSHOT_LOAD_ON_EMPTY", True)
+
+MAGIC = b"CCSNAP"
+VERSION = 1
+_HEADER = struct.Struct("<6sHdH")
+_TABLE = struct.Struct("<IH")
+_COLUMN = struct.Struct("<BBQ")
+_CRC = struct.Struct("<I")
+_HAS_VALIDITY = 1
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+class SnapshotError(ValueError):
+    """The file is not a snapshot this version can read."""
+
+
+class SnapshotConflict(SnapshotError):
+    """Import without replace into a table that already has countries."""
+
+
+@dataclass
+class SnapshotData:
+    created_at: float
+    countries: List[Dict[str, Any]]
+    rates: Dict[str, str] = field(default_factory=dict)
+
+
+def _column_type(column) -> str:
+    # Float subclasses Numeric, so it has to be checked first
+    if isinstance(column.type, Float):
+        return "d"
+    if isinstance(column.type, Integer):
+        return "q"
+    if isinstance(column.type, DateTime):
+        return "t"
+    return "s"
+
+
+def _to_micros(value: datetime) -> int:
+    return (as_utc(value) - _EPOCH) // _MICROSECOND
+
+
+def _name(value: str) -> bytes:
+    data = value.encode("utf-8")
+    return struct.pack("<B", len(data)) + data
+
+
+def _encode_column(kind: str, values: Sequence[Any]) -> Tuple[int, bytes]:
+    count = len(values)
+    flags = 0
+    parts = []
+    if any(value is None for value in values):
+        flags |= _HAS_VALIDITY
+        bitmap = bytearray((count + 7) // 8)
+        for index, value in enumerate(values):
+            if value is not None:
+                bitmap[index >> 3] |= 1 << (index & 7)
+        parts.append(bytes(bitmap))
+    if kind == "s":
+        encoded = [str(value).encode("utf-8") if value is not None else b"" for value in values]
+        offsets = [0] * (count + 1)
+        total = 0
+        for index, data in enumerate(encoded):
+            total += len(data)
+            offsets[index + 1] = total
+        parts.append(struct.pack(f"<{count + 1}I", *offsets))
+        parts.append(b"".join(encoded))
+    else:
+        if kind == "t":
+            values = [_to_micros(value) if value is not None else 0 for value in values]
+        else:
+            values = [value if value is not None else 0 for value in values]
+        parts.append(struct.pack(f"<{count}{'d' if kind == 'd' else 'q'}", *values))
+    return flags, b"".join(parts)
+
+
+def _encode_table(out: bytearray, name: str, columns: Dict[str, Tuple[str, Sequence[Any]]], count: int) -> None:
+    out += _name(name) + _TABLE.pack(count, len(columns))
+    for column_name, (kind, values) in columns.items():
+        flags, payload = _encode_column(kind, values)
+        out += _name(column_name) + _COLUMN.pack(ord(kind), flags, len(payload))
+        # payloads start at file offsets divisible by 8
+        out += b"\0" * (-len(out) % 8)
+        out += payload
+
+
+def encode_snapshot(rows: Sequence[Any], rates: Dict[str, Any], created_at: Optional[float] = None) -> bytes:
+    """Serialize country rows (mappings or Core rows) and a currency -> rate table."""
+    table_columns = Country.__table__.columns
+    countries = {
+        column.name: (_column_type(column), [row.get(column.name) for row in rows])
+        for column in table_columns
+    }
+    codes = sorted(rates)
+    rate_columns = {"currency_code": ("s", codes), "rate": ("s", [rates[code] for code in codes])}
+    out = bytearray(_HEADER.pack(MAGIC, VERSION, created_at if created_at is not None else time.time(), 2))
+    _encode_table(out, "countries", countries, len(rows))
+    _encode_table(out, "rates", rate_columns, len(codes))
+    out += _CRC.pack(zlib.crc32(out))
+    return bytes(out)
+
+
+class _Reader:
+    def __init__(self, buffer: memoryview):
+        self.buffer = buffer
+        self.pos = 0
+
+    def take(self, size: int) -> memoryview:
+        if self.pos + size > len(self.buffer):
+            raise SnapshotError("Snapshot is truncated")
+        chunk = self.buffer[self.pos:self.pos + size]
+        self.pos += size
+        return chunk
+
+    def unpack(self, fmt: struct.Struct) -> tuple:
+        return fmt.unpack(self.take(fmt.size))
+
+    def name(self) -> str:
+        (length,) = self.unpack(struct.Struct("<B"))
+        return str(self.take(length), "utf-8")
+
+
+def _decode_column(kind: str, flags: int, payload: memoryview, count: int) -> List[Any]:
+    validity = None
+    if flags & _HAS_VALIDITY:
+        size = (count + 7) // 8
+        validity = payload[:size]
+        payload = payload[size:]
+    if kind == "s":
+        offsets = payload[:(count + 1) * 4].cast("I") if sys.byteorder == "little" else struct.unpack(f"<{count + 1}I", payload[:(count + 1) * 4])
+        blob = payload[(count + 1) * 4:]
+        values = [str(blob[offsets[index]:offsets[index + 1]], "utf-8") for index in range(count)]
+    elif kind in ("q", "d", "t"):
+        fmt = "d" if kind == "d" else "q"
+        # zero-copy view over the (memory-mapped) file on little-endian hosts
+        raw = payload[:count * 8]
+        values = raw.cast(fmt).tolist() if sys.byteorder == "little" else list(struct.unpack(f"<{count}{fmt}", raw))
+        if kind == "t":
+            values = [_EPOCH + timedelta(microseconds=value) for value in values]
+    else:
+        raise SnapshotError(f"Unknown column type {kind!r}")
+    if validity is not None:
+        for index in range(count):
+            if not validity[index >> 3] & (1 << (index & 7)):
+                values[index] = None
+    return values
+
+
+def decode_snapshot(buffer) -> SnapshotData:
+    """Parse a snapshot from any buffer (bytes, or an mmap for zero-copy column reads)."""
+    view = memoryview(buffer)
+    if len(view) < _HEADER.size + _CRC.size:
+        raise SnapshotError("Snapshot is truncated")
+    (stored_crc,) = _CRC.unpack(view[-_CRC.size:])
+    if zlib.crc32(view[:-_CRC.size]) != stored_crc:
+        raise SnapshotError("Snapshot checksum mismatch")
+    reader = _Reader(view[:-_CRC.size])
+    magic, version, created_at, table_count = reader.unpack(_HEADER)
+    if magic != MAGIC:
+        raise SnapshotError("Not a country snapshot")
+    if version != VERSION:
+        raise SnapshotError(f"Unsupported snapshot version {version} (expected {VERSION})")
+
+    tables: Dict[str, Tuple[int, Dict[str, List[Any]]]] = {}
+    for _ in range(table_count):
+        table_name = reader.name()
+        count, column_count = reader.unpack(_TABLE)
+        columns = {}
+        for _ in range(column_count):
+            column_name = reader.name()
+            kind, flags, length = reader.unpack(_COLUMN)
+            reader.take(-reader.pos % 8)
+            columns[column_name] = _decode_column(chr(kind), flags, reader.take(length), count)
+        tables[table_name] = (count, columns)
+
+    count, columns = tables.get("countries", (0, {}))
+    known = {column.name: column for column in Country.__table__.columns}
+    # columns added after the snapshot was taken are left to their defaults;
+    # columns that no longer exist are ignored
+    present = [name for name in columns if name in known]
+    for name in present:
+        if isinstance(known[name].type, Numeric) and not isinstance(known[name].type, Float):
+            columns[name] = [Decimal(value) if value is not None else None for value in columns[name]]
+    countries = [{name: columns[name][index] for name in present} for index in range(count)]
+    for row in countries:
+        if row.get("name_normalized") is None and row.get("name") is not None:
+            row["name_normalized"] = normalize_name(row["name"])
+
+    _, rate_columns = tables.get("rates", (0, {}))
+    rates = dict(zip(rate_columns.get("currency_code", []), rate_columns.get("rate", [])))
+    return SnapshotData(created_at=created_at, countries=countries, rates=rates)
+
+
+def read_snapshot_file(path: Path) -> SnapshotData:
+    with open(path, "rb") as handle:
+        if os.fstat(handle.fileno()).st_size == 0:
+            raise SnapshotError("Snapshot is empty")
+        mapped = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        return decode_snapshot(mapped)
+    finally:
+        try:
+            mapped.close()
+        except BufferError:
+            # a traceback still references views into the map; it is closed when they are collected
+            pass
+
+
+def _rates_used(rows: Sequence[Any]) -> Dict[str, str]:
+    """The full rate table of the last processed upstream response, else the rates stored on countries."""
+    cached = upstream_cache.load(EXCHANGE_RATE_API_URL) if EXCHANGE_RATE_API_URL else None
+    if cached is not None:
+        try:
+            rates = cached.json().get("rates")
+            if isinstance(rates, dict) and rates:
+                return {str(code): str(rate) for code, rate in rates.items()}
+        except (ValueError, AttributeError):
+            logger.warning("Cached exchange-rate response is unreadable; exporting stored rates only")
+    return {row["currency_code"]: str(row["exchange_rate"]) for row in rows if row["currency_code"] and row["exchange_rate"] is not None}
+
+
+async def export_snapshot(session: AsyncSession) -> bytes:
+    result = await session.execute(select(Country.__table__).order_by(Country.id))
+    rows = [row._mapping for row in result]
+    rates = await asyncio.to_thread(_rates_used, rows)
+    data = encode_snapshot(rows, rates)
+    logger.info(f"Exported snapshot: {len(rows)} countries, {len(rates)} rates, {len(data)} bytes")
+    return data
+
+
+async def import_snapshot(session: AsyncSession, snapshot: SnapshotData, replace: bool = False) -> int:
+    """
+    Bulk-insert the snapshot's countries and rebuild the in-memory caches.
+
+    Without ``replace`` the table must be empty; with it, existing rows are
+    deleted in the same transaction. The snapshot's exchange rates are added
+    to the rate history at the snapshot's creation time, unless already
+    there. Holds the refresh lock, so an import never interleaves with a
+    refresh in any worker. Returns the number of countries loaded.
+    """
+    rows = snapshot.countries
+    async with coherence.exclusive("refresh"):
+        async with session.begin():
+            if replace:
+                await session.execute(delete(Country))
+            else:
+                existing = (await session.execute(select(func.count(Country.id)))).scalar() or 0
+                if existing:
+                    raise SnapshotConflict(f"countries table is not empty ({existing} rows); import with replace to overwrite it")
+            for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+                await session.execute(insert(Country.__table__), rows[start:start + UPSERT_BATCH_SIZE])
+            rates_recorded = await _record_snapshot_rates(session, snapshot) if RATE_HISTORY_ENABLED else 0
+        # the table now reflects the snapshot, not the last upstream responses
+        await forget_upstream_validators()
+        await country_cache.reload(session)
+        last = max((row["last_refreshed_at"] for row in rows if row.get("last_refreshed_at")), default=None)
+        if rows and last is not None:
+            await CountryService._generate_summary_image(session, last)
+    logger.info(f"Imported snapshot: {len(rows)} countries, {rates_recorded} rates added to the history")
+    return len(rows)
+
+
+async def _record_snapshot_rates(session: AsyncSession, snapshot: SnapshotData) -> int:
+    """Append the snapshot's rate table to the history, skipping currencies already recorded at that time."""
+    recorded_at = datetime.fromtimestamp(snapshot.created_at, timezone.utc)
+    table = build_rate_table(snapshot.rates)
+    known = await session.execute(select(RateHistory.currency_code).where(RateHistory.recorded_at == recorded_at))
+    for (code,) in known:
+        table.pop(code, None)
+    return await record_rates(session, table, recorded_at)
+
+
+async def load_snapshot_on_startup(session: AsyncSession) -> Optional[int]:
+    """Load SNAPSHOT_PATH into an empty countries table; None when nothing was loaded."""
+    if not SNAPSHOT_PATH or not SNAPSHOT_LOAD_ON_EMPTY:
+        return None
+    path = Path(SNAPSHOT_PATH)
+    if not path.exists():
+        logger.info(f"No snapshot at {path}; starting empty")
+        return None
+    existing = (await session.execute(select(func.count(Country.id)))).scalar() or 0
+    await session.rollback()
+    if existing:
+        return None
+    started = time.perf_counter()
+    try:
+        snapshot = await asyncio.to_thread(read_snapshot_file, path)
+        loaded = await import_snapshot(session, snapshot)
+    except (OSError, SnapshotError):
+        logger.exception(f"Failed to load snapshot {path}")
+        return None
+    logger.info(f"Loaded {loaded} countries from snapshot {path} in {(time.perf_counter() - started) * 1000:.1f} ms")
+    return loaded
+
+
+async def _run_cli(args) -> None:
+    from database import Base, async_session, engine
+    from models import upgrade_schema
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(upgrade_schema)
+    try:
+        async with async_session() as session:
+            if args.command == "export":
+                data = await export_snapshot(session)
+                write_atomic(Path(args.path), data)
+                print(f"Wrote {args.path} ({len(data)} bytes)")
+            else:
+                started = time.perf_counter()
+                snapshot = read_snapshot_file(Path(args.path))
+                loaded = await import_snapshot(session, snapshot, replace=args.replace)
+                print(f"Imported {loaded} countries in {(time.perf_counter() - started) * 1000:.1f} ms")
+    finally:
+        await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export", help="write the countries table to a snapshot file")
+    export_parser.add_argument("path")
+    import_parser = commands.add_parser("import", help="load a snapshot file into the database")
+    import_parser.add_argument("path")
+    import_parser.add_argument("--replace", action="store_true", help="delete existing countries first")
+    info_parser = commands.add_parser("info", help="describe a snapshot file")
+    info_parser.add_argument("path")
+    args = parser.parse_args()
+
+    if args.command == "info":
+        try:
+            snapshot = read_snapshot_file(Path(args.path))
+        except SnapshotError as e:
+            sys.exit(f"{args.path}: {e}")
+        created = iso_utc(datetime.fromtimestamp(snapshot.created_at, timezone.utc))
+        print(f"{args.path}: version {VERSION}, created {created}, {len(snapshot.countries)} countries, {len(snapshot.rates)} rates")
+        return
+    try:
+        asyncio.run(_run_cli(args))
+    except SnapshotError as e:
+        sys.exit(str(e))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+import asyncio
+import io
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+from PIL import Image, ImageDraw, ImageFont
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+SUMMARY_IMAGE_PATH = Path("cache") / "summary.png"
+# Pillow releases the GIL while encoding, so a couple of threads keep PNG work off the event loop.
+IMAGE_RENDER_WORKERS = int(os.getenv("IMAGE_RENDER_WORKERS", "2"))
+# Rendered on-demand variants (size / top-N / region) kept in memory.
+IMAGE_VARIANT_CACHE_SIZE = int(os.getenv("IMAGE_VARIANT_CACHE_SIZE", "64"))
+
+BASE_WIDTH, BASE_HEIGHT = 800, 600
+BG_COLOR = (30, 30, 30)
+TEXT_COLOR = (240, 240, 240)
+
+_render_executor = ThreadPoolExecutor(max_workers=IMAGE_RENDER_WORKERS, thread_name_prefix="image-render")
+
+
+_thread_state = threading.local()
+
+
+def _fonts(title_size: int, body_size: int):
+    """
+    TrueType fonts are loaded once per size and render thread instead of on
+    every render (FreeType faces are not shared between threads).
+    """
+    cache = getattr(_thread_state, "fonts", None)
+    if cache is None:
+        cache = _thread_state.fonts = {}
+    key = (title_size, body_size)
+    if key not in cache:
+        try:
+            # try to use a common font; fallback if not available
+            cache[key] = (ImageFont.truetype("DejaVuSans-Bold.ttf", title_size), ImageFont.truetype("DejaVuSans.ttf", body_size))
+        except Exception:
+            cache[key] = (ImageFont.load_default(), ImageFont.load_default())
+    return cache[key]
+
+
+def render_summary_png(
+    total: int,
+    top: List[Tuple[str, Optional[float]]],
+    refreshed_label: str,
+    top_n: int = 5,
+    width: int = BASE_WIDTH,
+    title: str = "Countries Summary",
+) -> bytes:
+    """
+    Render the summary card as PNG bytes: total countries, last refresh time
+    and the top countries by estimated GDP. Pure CPU work, meant to run in
+    the render pool via ``run_render``.
+    """
+    scale = width / BASE_WIDTH
+    height = int(max(BASE_HEIGHT, 240 + 24 * top_n) * scale)
+    img = Image.new("RGB", (width, height), color=BG_COLOR)
+    draw = ImageDraw.Draw(img)
+    font_title, font_body = _fonts(max(8, round(28 * scale)), max(6, round(18 * scale)))
+
+    def px(value: float) -> int:
+        return round(value * scale)
+
+    padding = px(40)
+    y = padding
+    draw.text((padding, y), title, fill=TEXT_COLOR, font=font_title)
+    y += px(50)
+    draw.text((padding, y), f"Total countries: {total}", fill=TEXT_COLOR, font=font_body)
+    y += px(30)
+    draw.text((padding, y), f"Last refreshed at: {refreshed_label}", fill=TEXT_COLOR, font=font_body)
+    y += px(40)
+    draw.text((padding, y), f"Top {top_n} countries by estimated GDP:", fill=TEXT_COLOR, font=font_body)
+    y += px(30)
+
+    for idx, (name, gdp) in enumerate(top, start=1):
+        draw.text((padding + px(10), y), f"{idx}. {name} — {gdp or 0:,.2f}", fill=TEXT_COLOR, font=font_body)
+        y += px(24)
+
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def write_atomic(path: Path, data: bytes) -> None:
+    """Write via a temp file in the same directory and rename, so readers never see a partial file."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        # mkstemp creates 0600 files; keep the usual permissions for a served file
+        os.fchmod(fd, 0o644)
+        with os.fdopen(fd, "wb") as tmp:
+            tmp.write(data)
+        os.replace(tmp_name, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_name)
+        except OSError:
+            pass
+        raise
+
+
+async def run_render(fn: Callable, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_render_executor, partial(fn, *args, **kwargs))
+
+
+class ImageVariantCache:
+    """
+    Bounded LRU of rendered PNG variants. Keys include the cache generation,
+    so a refresh naturally retires old renders; concurrent requests for the
+    same missing variant share one render.
+    """
+
+    def __init__(self, max_entries: int = IMAGE_VARIANT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, bytes]" = OrderedDict()
+        self._pending: Dict[Hashable, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get_or_render(self, key: Hashable, render: Callable[[], Awaitable[bytes]]) -> bytes:
+        cached = self._entries.get(key)
+        if cached is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return cached
+        pending = self._pending.get(key)
+        if pending is not None:
+            self.hits += 1
+            return await asyncio.shield(pending)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        try:
+            data = await render()
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                # nobody else may be waiting; avoid "exception was never retrieved"
+                future.exception()
+            raise
+        finally:
+            self._pending.pop(key, None)
+        future.set_result(data)
+        self._entries[key] = data
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return data
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+def shutdown_render_pool() -> None:
+    _render_executor.shutdown(wait=False, cancel_futures=True)
+
+
+image_variants = ImageVariantCache()
@@ -0,0 +1,14 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# Settings are read at import time, so point the app at scratch locations first.
+_scratch = tempfile.mkdtemp(prefix="country-api-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{_scratch}/app.db")
+os.environ.setdefault("LOG_FILE", "")
+os.environ.setdefault("COHERENCE_BACKEND", "none")
+os.environ.setdefault("UPSTREAM_CACHE_DIR", os.path.join(_scratch, "upstream"))
+os.environ.setdefault("SNAPSHOT_LOAD_ON_EMPTY", "false")
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
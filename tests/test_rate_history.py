@@ -0,0 +1,83 @@
+"""Downsampling of the exchange-rate history."""
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+import rate_history
+from database import Base
+from models import RateHistory
+from timeutil import as_utc
+
+NOW = datetime(2026, 10, 17, 12, 30, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def session_factory(tmp_path, monkeypatch):
+    monkeypatch.setattr(rate_history, "RATE_HISTORY_RAW_DAYS", 7)
+    monkeypatch.setattr(rate_history, "RATE_HISTORY_DOWNSAMPLE_SECONDS", 3600)
+    monkeypatch.setattr(rate_history, "RATE_HISTORY_RETENTION_DAYS", 365)
+
+    async def open_session():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'history.db'}")
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        return engine, AsyncSession(engine, expire_on_commit=False)
+
+    return open_session
+
+
+async def _rows(session):
+    result = await session.execute(
+        select(RateHistory.recorded_at, RateHistory.rate, RateHistory.resolution, RateHistory.samples).order_by(RateHistory.recorded_at)
+    )
+    rows = [(as_utc(row.recorded_at), row.rate, row.resolution, row.samples) for row in result]
+    await session.rollback()
+    return rows
+
+
+def test_late_raw_rates_merge_into_the_existing_bucket(session_factory):
+    old = NOW - timedelta(days=10)
+    bucket = rate_history.bucket_start(old, 3600)
+
+    async def scenario():
+        engine, session = await session_factory()
+        await rate_history.record_rates(session, {"NGN": 10.0}, old)
+        await rate_history.record_rates(session, {"NGN": 20.0}, old + timedelta(minutes=1))
+        await session.commit()
+        first = await rate_history.compact_history(session, now=NOW)
+        # a snapshot import writes a rate into the bucket that was already averaged
+        await rate_history.record_rates(session, {"NGN": 40.0}, old + timedelta(minutes=2))
+        await session.commit()
+        # a later call, as from another worker or after a restart, still finds it
+        second = await rate_history.compact_history(session, now=NOW + timedelta(minutes=5))
+        rows = await _rows(session)
+        third = await rate_history.compact_history(session, now=NOW + timedelta(minutes=6))
+        await session.close()
+        await engine.dispose()
+        return first, second, rows, third
+
+    first, second, rows, third = asyncio.run(scenario())
+    assert first == (2, 0)
+    assert second == (1, 0)
+    assert rows == [(bucket, pytest.approx(70.0 / 3), 3600, 3)]
+    # nothing left to do, and no new rows
+    assert third == (0, 0)
+
+
+def test_recent_rates_stay_raw(session_factory):
+    async def scenario():
+        engine, session = await session_factory()
+        await rate_history.record_rates(session, {"NGN": 10.0, "GHS": 1.0}, NOW - timedelta(days=1))
+        await session.commit()
+        result = await rate_history.compact_history(session, now=NOW)
+        rows = await _rows(session)
+        await session.close()
+        await engine.dispose()
+        return result, rows
+
+    result, rows = asyncio.run(scenario())
+    assert result == (0, 0)
+    assert [row[2:] for row in rows] == [(0, 1), (0, 1)]
@@ -0,0 +1,240 @@
+"""Conditional upstream fetches and the "unchanged" refresh skip, against httpx.MockTransport."""
+import asyncio
+import json
+
+import httpx
+import pytest
+from sqlalchemy import delete, func, select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+import service
+from country_cache import country_cache
+from database import Base
+from http_cache import HTTPResponseCache
+from models import Country, normalize_name
+
+COUNTRIES_URL = "http://upstream.test/countries"
+RATES_URL = "http://upstream.test/rates"
+COUNTRIES = [
+    {"name": "Nigeria", "capital": "Abuja", "region": "Africa", "population": 200, "currencies": [{"code": "NGN"}]},
+    {"name": "Ghana", "capital": "Accra", "region": "Africa", "population": 30, "currencies": [{"code": "GHS"}]},
+]
+RATES = {"rates": {"NGN": 1500.0, "GHS": 15.0}}
+
+
+class Upstream:
+    """Both upstream APIs; records the requests it sees."""
+
+    def __init__(self, etags: bool = True, delay: float = 0.0):
+        self.etags = etags
+        self.delay = delay
+        self.countries = COUNTRIES
+        # bumped together with ``countries`` to change the ETag
+        self.version = 1
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.in_flight -= 1
+        payload = self.countries if request.url.path == "/countries" else RATES
+        etag = f'"{request.url.path}-v{self.version}"'
+        if self.etags and request.headers.get("if-none-match") == etag:
+            return httpx.Response(304, headers={"ETag": etag})
+        return httpx.Response(200, content=json.dumps(payload).encode(), headers={"ETag": etag} if self.etags else {})
+
+    def conditional(self):
+        return [request.headers.get("if-none-match") for request in self.requests]
+
+
+@pytest.fixture
+def env(tmp_path, monkeypatch):
+    """A fresh SQLite database, upstream cache and mocked upstreams for one test."""
+    monkeypatch.setattr(service, "COUNTRY_API_URL", COUNTRIES_URL)
+    monkeypatch.setattr(service, "EXCHANGE_RATE_API_URL", RATES_URL)
+    monkeypatch.setattr(service, "REFRESH_MODE", "full")
+    monkeypatch.setattr(service, "REFRESH_PRUNE", False)
+    monkeypatch.setattr(service, "SUMMARY_IMAGE_PATH", tmp_path / "summary.png")
+    monkeypatch.setattr(service, "upstream_cache", HTTPResponseCache(str(tmp_path / "upstream")))
+    country_cache.invalidate()
+    clients = []
+
+    def install(upstream: Upstream):
+        client = httpx.AsyncClient(transport=httpx.MockTransport(upstream))
+        clients.append(client)
+        monkeypatch.setattr(service, "_http_client", client)
+        return upstream
+
+    async def open_session():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'test.db'}")
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        return engine, AsyncSession(engine, expire_on_commit=False)
+
+    yield install, open_session
+    for client in clients:
+        asyncio.run(client.aclose())
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def _count(session):
+    count = (await session.execute(select(func.count(Country.id)))).scalar()
+    await session.rollback()
+    return count
+
+
+def test_not_modified_reuses_cached_response(env):
+    install, open_session = env
+    upstream = install(Upstream(etags=True))
+
+    async def scenario():
+        engine, session = await open_session()
+        first = await service.CountryService.refresh_countries(session)
+        rendered = service.SUMMARY_IMAGE_PATH.exists()
+        service.SUMMARY_IMAGE_PATH.unlink()
+        second = await service.CountryService.refresh_countries(session)
+        count = await _count(session)
+        await session.close()
+        await engine.dispose()
+        return first, second, count, rendered
+
+    first, second, count, rendered = run(scenario())
+    assert not first.skipped and first.inserted == 2
+    assert rendered
+    assert second.skipped and second.written == 0
+    # a skipped refresh leaves the image alone
+    assert not service.SUMMARY_IMAGE_PATH.exists()
+    assert count == 2
+    # the second round sent the stored ETags and got 304s back
+    assert upstream.conditional()[:2] == [None, None]
+    assert sorted(upstream.conditional()[2:]) == ['"/countries-v1"', '"/rates-v1"']
+    assert service.upstream_cache.hits == 2
+
+
+def test_identical_body_without_validators_skips(env):
+    install, open_session = env
+    upstream = install(Upstream(etags=False))
+
+    async def scenario():
+        engine, session = await open_session()
+        first = await service.CountryService.refresh_countries(session)
+        second = await service.CountryService.refresh_countries(session)
+        await session.close()
+        await engine.dispose()
+        return first, second
+
+    first, second = run(scenario())
+    assert not first.skipped
+    # no validators to send, but the body hash matched what was processed last time
+    assert all(header is None for header in upstream.conditional())
+    assert second.skipped
+    assert second.last_refreshed_at is not None
+
+
+def test_validators_stored_only_after_successful_refresh(env, monkeypatch):
+    install, open_session = env
+    install(Upstream(etags=True))
+    upsert = service.CountryService._upsert_countries
+
+    async def failing_upsert(*args, **kwargs):
+        raise RuntimeError("database unavailable")
+
+    async def scenario():
+        engine, session = await open_session()
+        monkeypatch.setattr(service.CountryService, "_upsert_countries", staticmethod(failing_upsert))
+        with pytest.raises(RuntimeError):
+            await service.CountryService.refresh_countries(session)
+        stored_after_failure = [service.upstream_cache.load(url) for url in (COUNTRIES_URL, RATES_URL)]
+        monkeypatch.setattr(service.CountryService, "_upsert_countries", staticmethod(upsert))
+        retry = await service.CountryService.refresh_countries(session)
+        stored_after_success = [service.upstream_cache.load(url) for url in (COUNTRIES_URL, RATES_URL)]
+        await session.close()
+        await engine.dispose()
+        return stored_after_failure, retry, stored_after_success
+
+    stored_after_failure, retry, stored_after_success = run(scenario())
+    assert stored_after_failure == [None, None]
+    # the failed run must not turn the retry into a skip
+    assert not retry.skipped and retry.inserted == 2
+    assert [entry.etag for entry in stored_after_success] == ['"/countries-v1"', '"/rates-v1"']
+
+
+def test_upstreams_are_fetched_concurrently(env):
+    install, open_session = env
+    upstream = install(Upstream(delay=0.2))
+
+    async def scenario():
+        engine, session = await open_session()
+        await service.CountryService.refresh_countries(session)
+        await session.close()
+        await engine.dispose()
+
+    run(scenario())
+    assert len(upstream.requests) == 2
+    assert upstream.max_in_flight == 2
+
+
+def test_local_delete_is_restored_by_next_refresh(env):
+    install, open_session = env
+    install(Upstream(etags=True))
+
+    async def scenario():
+        engine, session = await open_session()
+        await service.CountryService.refresh_countries(session)
+        await session.execute(delete(Country).where(Country.name_normalized == normalize_name("Ghana")))
+        await session.commit()
+        await service.forget_upstream_validators()
+        again = await service.CountryService.refresh_countries(session)
+        count = await _count(session)
+        await session.close()
+        await engine.dispose()
+        return again, count
+
+    again, count = run(scenario())
+    assert not again.skipped
+    assert count == 2
+
+
+def test_explicit_prune_runs_when_upstream_is_unchanged(env):
+    install, open_session = env
+    upstream = install(Upstream(etags=True))
+    upstream.countries = COUNTRIES + [{"name": "Togo", "capital": "Lome", "region": "Africa", "population": 8, "currencies": []}]
+
+    async def scenario():
+        engine, session = await open_session()
+
+        async def refresh(**kwargs):
+            result = await service.CountryService.refresh_countries(session, **kwargs)
+            # the cache reload leaves a read transaction open; each scheduler job gets a new session
+            await session.rollback()
+            return result
+
+        await refresh()
+        upstream.countries, upstream.version = COUNTRIES, 2
+        shrunk = await refresh()
+        pruned = await refresh(prune=True)
+        count = await _count(session)
+        again = await refresh()
+        await session.close()
+        await engine.dispose()
+        return shrunk, pruned, count, again
+
+    shrunk, pruned, count, again = run(scenario())
+    assert shrunk.vanished == 1 and shrunk.deleted == 0
+    # the prune run sent both stored ETags (and got 304s), yet it still pruned
+    assert sorted(upstream.conditional()[4:6]) == ['"/countries-v2"', '"/rates-v2"']
+    assert not pruned.skipped
+    # ... without rewriting the rows that are still there, even in full mode
+    assert pruned.deleted == 1 and pruned.written == 1
+    assert count == 2
+    # without an explicit prune or mode, unchanged upstream data is still skipped
+    assert again.skipped
@@ -0,0 +1,15 @@
+from datetime import datetime, timezone
+from typing import Optional
+
+
+def as_utc(value: datetime) -> datetime:
+    """Timezone-aware UTC copy of ``value``; naive values are taken to be UTC already."""
+    # SQLite hands back naive UTC timestamps
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+
+def iso_utc(value: Optional[datetime]) -> Optional[str]:
+    """ISO 8601 in UTC with a ``Z`` suffix, the one format the API returns timestamps in."""
+    if not value:
+        return None
+    return as_utc(value).isoformat().replace("+00:00", "Z")
@@ -0,0 +1,128 @@
+import hashlib
+import os
+import random
+import time
+from datetime import datetime
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+# Seed for the GDP multipliers; unset keeps the process-wide random state.
+REFRESH_GDP_SEED = os.getenv("REFRESH_GDP_SEED")
+# Upstream records transformed per batch; bounds the prepared records held at once.
+TRANSFORM_CHUNK_SIZE = int(os.getenv("REFRESH_TRANSFORM_CHUNK_SIZE", "5000"))
+
+GDP_MULTIPLIER_MIN, GDP_MULTIPLIER_MAX = 1000, 2000
+
+
+def make_rng(seed: Optional[str] = REFRESH_GDP_SEED):
+    """RNG for GDP multipliers: seeded when configured, otherwise the global `random` module."""
+    return random.Random(seed) if seed is not None else random
+
+
+def build_rate_table(rates: Dict[str, Any]) -> Dict[str, Optional[float]]:
+    """
+    Convert every upstream rate to float once per refresh instead of once per
+    country. Unparseable rates map to None, like a currency missing from the table.
+    """
+    table = {}
+    for code, value in rates.items():
+        if value is None:
+            continue
+        try:
+            table[code] = float(value)
+        except Exception:
+            table[code] = None
+    return table
+
+
+def source_hash(name, capital, region, population, currency_code, exchange_rate_text, flag_url) -> str:
+    """
+    Digest of the upstream values a country row is derived from. The random
+    GDP multiplier is deliberately left out, so an unchanged country hashes
+    the same on every refresh. ``exchange_rate_text`` is the rate's repr,
+    formatted once per currency rather than once per country.
+    """
+    raw = f"{name}\x1f{capital}\x1f{region}\x1f{population}\x1f{currency_code}\x1f{exchange_rate_text}\x1f{flag_url}"
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _transform_chunk(chunk: List[Dict[str, Any]], rate_table: Dict[str, Optional[float]], rate_texts: Dict[str, str], refresh_time: datetime, rng) -> List[Dict[str, Any]]:
+    rate_for = rate_table.get
+    rate_text = rate_texts.get
+    draw = rng.random
+    span = GDP_MULTIPLIER_MAX - GDP_MULTIPLIER_MIN
+    prepared = []
+    append = prepared.append
+    for c in chunk:
+        population = c.get("population")
+        currencies = c.get("currencies")
+        currency_code = None
+        exchange_rate = None
+        estimated_gdp = None
+        if currencies and isinstance(currencies, list):
+            first = currencies[0]
+            # currency objects commonly have 'code'; currencies exist but no code -> estimated_gdp None
+            currency_code = (first.get("code") if isinstance(first, dict) else None) or None
+            if currency_code:
+                # not found / unparseable in exchange rates -> exchange_rate None, estimated_gdp None
+                exchange_rate = rate_for(currency_code)
+                if exchange_rate and population:
+                    # estimated_gdp = population × random(1000–2000) ÷ exchange_rate
+                    # (random.uniform(a, b) is exactly a + (b - a) * random())
+                    estimated_gdp = (population * (GDP_MULTIPLIER_MIN + span * draw())) / exchange_rate
+        else:
+            # If currencies array empty -> currency_code None, exchange_rate None, estimated_gdp 0
+            estimated_gdp = 0
+        name = c.get("name")
+        capital = c.get("capital")
+        region = c.get("region")
+        flag_url = c.get("flag")
+        append({
+            "name": name,
+            "capital": capital,
+            "region": region,
+            "population": population,
+            "currency_code": currency_code,
+            "exchange_rate": exchange_rate,
+            "estimated_gdp": estimated_gdp,
+            "flag_url": flag_url,
+            "last_refreshed_at": refresh_time,
+            "source_hash": source_hash(name, capital, region, population, currency_code, rate_text(currency_code), flag_url),
+        })
+    return prepared
+
+
+def transform_countries(
+    countries: Iterable[Dict[str, Any]],
+    rates: Dict[str, Any],
+    refresh_time: datetime,
+    rng=None,
+    chunk_size: int = TRANSFORM_CHUNK_SIZE,
+    timings: Optional[Dict[str, float]] = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Turn upstream country records into prepared rows for the upsert, as a
+    generator working through the input in fixed-size chunks, so the caller
+    never holds the full prepared list next to its own copy of the rows.
+
+    Semantics match the original per-row loop: no currencies -> estimated_gdp 0;
+    currency without a usable code or rate -> exchange_rate/estimated_gdp None;
+    otherwise estimated_gdp = population × U(1000, 2000) ÷ rate. Each record
+    also carries its ``source_hash`` for incremental refreshes.
+
+    When ``timings`` is given, time spent transforming (excluding the
+    consumer's work between chunks) is added to ``timings["transform"]``.
+    """
+    rng = rng if rng is not None else make_rng()
+    rate_table = build_rate_table(rates)
+    rate_texts = {code: repr(rate) for code, rate in rate_table.items()}
+    iterator = iter(countries)
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        started = time.perf_counter()
+        records = _transform_chunk(chunk, rate_table, rate_texts, refresh_time, rng)
+        if timings is not None:
+            timings["transform"] = timings.get("transform", 0.0) + time.perf_counter() - started
+        yield from records